@@ -1,91 +1,575 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
+from fastapi import FastAPI, Form, HTTPException, Query, Request, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import numpy as np
-import pandas as pd
 import uvicorn
+import asyncio
+import functools
+import json
 import os
-import io
-from PIL import Image
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from typing import List
+
+# Shared model/preprocessing helpers live in scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+
+from batching import MAX_BATCH_SIZE, MicroBatcher
+from executor import BoundedExecutor, Overloaded
+from loader import ModelLoader, NotReady
+from traits import BreedTraitIndex, load_class_indices
+from preprocessing import VALID_EXTS, load_image, new_batch, normalize
+from inference import BACKEND, BATCH_BUCKETS, fast_model_paths, load_predictor, tflite_model_path, tflite_variant
+from cache import PredictionCache, content_digest, dhash
+from cascade import BREED_STAGES, USE_GATE, Stage1Gate, dispatch_breeds, gate_model_name, run_stage1
+from embedding_index import META_NAME, EmbeddingIndex
+from embeddings import INDEX_DIR, load_embedder
+from streaming import FrameFilter, RunningPrediction
+import metrics
+from metrics import STAGE_SECONDS, Counter, Gauge, Histogram, count_prediction, timed
 
 app = FastAPI()
 
-# Root endpoint for API status
+# Root endpoint for API status (the process is up; see /health/ready for the models)
 @app.get("/")
 async def root():
     return {"message": "FarmVision API is running. Use /predict/ with POST to classify images."}
 
-import json
+# Liveness: the process answers requests, even while models are still loading
+@app.get("/health/live")
+async def live():
+    return {"status": "alive"}
 
-# Load models
-cattle_model = tf.keras.models.load_model("models/cattle_detector.h5")
-breed_model = tf.keras.models.load_model("models/breed_classifier.h5")
+# Load models concurrently in the background, so the server starts answering
+# (liveness, 503 on /predict/) right away and a bad file doesn't crash it. With
+# the keras backend these are compiled fixed-shape inference functions, traced
+# and warmed with dummy inputs while loading so the first live request doesn't
+# pay for it, read from the fastest exported format (scripts/export_fast_models.py);
+# FARMVISION_BACKEND=tflite-<variant> serves the exported TFLite models instead
+# (scripts/export_tflite.py)
+MODEL_FILES = {
+    "cattle_detector": "models/cattle_detector.h5",
+    "breed_classifier": "models/breed_classifier.h5",
+    "buffalo_breed_classifier": "models/buffalo_breed_classifier.h5",
+}
+# Optional low-res stage-1 early exit (FARMVISION_STAGE1_GATE=1, see scripts/cascade.py);
+# the gate model is always served with the keras backend
+GATE_MODEL = gate_model_name()
+if USE_GATE:
+    MODEL_FILES[GATE_MODEL] = f"models/{GATE_MODEL}.keras"
+def model_backend(name):
+    return "keras" if name == GATE_MODEL else BACKEND
+# Requests are micro-batched up to MAX_BATCH_SIZE images, so no larger bucket
+# is compiled (TFLite keeps an allocated interpreter per bucket)
+BUCKETS = tuple(sorted({size for size in BATCH_BUCKETS if size < MAX_BATCH_SIZE} | {MAX_BATCH_SIZE}))
+loaders = {
+    name: functools.partial(load_predictor, name, model_backend(name), keras_path=path, buckets=BUCKETS)
+    for name, path in MODEL_FILES.items()
+}
+# Files whose change reloads a model: the one it was loaded from (added by the
+# loader) plus those that would make load_predictor pick another file
+def model_watch_paths(name):
+    if model_backend(name) == "keras":
+        return [MODEL_FILES[name]] + list(fast_model_paths(name).values())
+    return [tflite_model_path(name, tflite_variant(BACKEND))]
+# Seconds between checks for changed model files, 0 = never reload
+RELOAD_INTERVAL = float(os.environ.get("FARMVISION_RELOAD_INTERVAL", 5))
+# Class indices each model is served with, read once at startup; they're watched
+# with the model so a retrained model with other classes is refused, not mislabeled
+CLASS_INDEX_FILES = {
+    "cattle_detector": "models/cattle_class_indices.json",
+    "breed_classifier": "models/breed_class_indices.json",
+    "buffalo_breed_classifier": "models/buffalo_class_indices.json",
+}
+if USE_GATE:
+    CLASS_INDEX_FILES[GATE_MODEL] = CLASS_INDEX_FILES["cattle_detector"]
+served_class_indices = {path: load_class_indices(path) for path in set(CLASS_INDEX_FILES.values())}
+def check_reload(name):
+    path = CLASS_INDEX_FILES.get(name)
+    if path is not None and load_class_indices(path) != served_class_indices[path]:
+        raise ValueError(f"{path} changed; restart the API to serve a model with different classes")
+# Optional re-identification of individual animals (FARMVISION_IDENTIFY=1):
+# pooled backbone embeddings (keras) searched in the index built by scripts/embeddings.py
+IDENTIFY = os.environ.get("FARMVISION_IDENTIFY", "0") == "1"
+EMBEDDER = "embedder"
+if IDENTIFY:
+    loaders[EMBEDDER] = load_embedder
+# Cached responses came from the old model, so a reload drops them
+models = ModelLoader(loaders, on_reload=lambda name: cache.clear(), check_reload=check_reload,
+                     watch={name: model_watch_paths(name) + [CLASS_INDEX_FILES[name]] for name in MODEL_FILES})
+models.start()
+
+# Stage 1 class names by index, for the per-class prediction counters
+stage1_class_indices = served_class_indices[CLASS_INDEX_FILES["cattle_detector"]]
+stage1_classes = sorted(stage1_class_indices, key=stage1_class_indices.get)
 
 # Load breed class indices mapping
-with open("models/breed_class_indices.json", "r") as f:
-    breed_class_indices = json.load(f)
-    # Invert mapping to get index -> breed name
-    idx_to_breed = {int(v): k for k, v in breed_class_indices.items()}
+breed_class_indices = served_class_indices[CLASS_INDEX_FILES["breed_classifier"]]
+# Invert mapping to get index -> breed name
+idx_to_breed = {int(v): k for k, v in breed_class_indices.items()}
 
-# Load dataset.csv for metadata
-df = pd.read_csv("dataset.csv")
+buffalo_class_indices = served_class_indices[CLASS_INDEX_FILES["buffalo_breed_classifier"]]
+idx_to_buffalo_breed = {int(v): k for k, v in buffalo_class_indices.items()}
 
-# Normalize helper
-def preprocess(img: Image.Image):
-    img = img.resize((224, 224))
-    img_array = image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0) / 255.0
-    return img_array
+# Per-breed traits from models/dataset.csv, keyed by breed index (rebuilt when the CSV changes)
+trait_index = BreedTraitIndex(breed_class_indices)
+buffalo_trait_index = BreedTraitIndex(buffalo_class_indices)
+TRAIT_KEYS = ["sex", "age_in_year", "height_in_inch", "weight_in_kg", "ATC_score"]
 
-# Compute ATC score (simple weighted average)
-def compute_atc(age, height, weight):
-    return round((0.2 * age + 0.3 * height + 0.5 * weight) / 10, 2)
+# Stage-1 label -> (breed model, index -> breed name, traits) for the breed stages
+BREEDS = {
+    "cattle": ("breed_classifier", idx_to_breed, trait_index),
+    "buffalo": ("buffalo_breed_classifier", idx_to_buffalo_breed, buffalo_trait_index),
+}
 
-@app.post("/predict/")
-async def predict(file: UploadFile = File(...)):
-    contents = await file.read()
-    img = Image.open(io.BytesIO(contents)).convert("RGB")
-    img_array = preprocess(img)
+# Cache of final responses, dropped whenever a model is reloaded or the class
+# indices or the dataset behind the traits change
+cache = PredictionCache(watch_paths=sorted(served_class_indices) + ["models/dataset.csv"])
+if RELOAD_INTERVAL > 0:
+    models.watch_changes(RELOAD_INTERVAL)
+
+# Look an upload up in the cache and decode + resize it only on a miss (runs on
+# the decode pool, off the event loop). Returns (cached, digest, phash, pixels);
+# pixels stay uint8 until the batch is assembled
+def prepare(contents: bytes):
+    digest = content_digest(contents) if cache.enabled else None
+    cached = cache.get(digest)
+    if cached is not None:
+        return cached, digest, None, None
+
+    with timed("decode"):
+        img = load_image(contents)
+    phash = None
+    if cache.enabled and cache.use_phash:
+        with timed("phash"):
+            phash = dhash(img)
+        cached = cache.get_by_phash(phash)
+        if cached is not None:
+            return cached, digest, phash, None
+    return None, digest, phash, np.asarray(img)
+
+# Reused float32 batch buffer; only the inference thread touches it
+batch_buffer = new_batch(MAX_BATCH_SIZE)
+
+# Run stage 1 on the whole batch (behind the low-res gate when enabled), then
+# each breed model once on the rows stage 1 routed to it (cattle -> stage 2,
+# buffalo -> stage 3); returns (stage-1 label, stage-1 row, breed row or None)
+# per image, in batch order
+def run_stages(pixels):
+    with timed("preprocess"):
+        batch = normalize(pixels, out=batch_buffer[:len(pixels)])
+    gate = Stage1Gate(models.get(GATE_MODEL), stage1_class_indices) if USE_GATE else None
+    pred_stage1 = run_stage1(batch, models.get("cattle_detector"), gate)
+    class_idx = np.argmax(pred_stage1, axis=1)
+    labels = [stage1_classes[i] for i in class_idx]
+    for label in labels:
+        count_prediction("stage1", label)
+
+    breeds = dispatch_breeds(class_idx, stage1_class_indices, {
+        label: lambda rows, model=model: models.get(model)(batch[rows])
+        for label, (model, _, _) in BREEDS.items()
+    })
+    for label, row in zip(labels, breeds):
+        if row is not None:
+            count_prediction(BREED_STAGES[label], BREEDS[label][1][int(np.argmax(row))])
+    return list(zip(labels, pred_stage1, breeds))
+
+batcher = MicroBatcher(run_stages, on_wait=lambda seconds: STAGE_SECONDS.observe(seconds, stage="queue_wait"))
+
+# Embeddings for /identify are batched separately, on their own inference thread and buffer
+embed_buffer = new_batch(MAX_BATCH_SIZE) if IDENTIFY else None
+def run_embedder(pixels):
+    with timed("preprocess"):
+        batch = normalize(pixels, out=embed_buffer[:len(pixels)])
+    with timed("embed"):
+        return list(models.get(EMBEDDER)(batch))
+
+embed_batcher = MicroBatcher(run_embedder,
+                             on_wait=lambda seconds: STAGE_SECONDS.observe(seconds, stage="embed_queue_wait"))
+
+# The embedding index is opened on first use (or created by the first enroll)
+# and reopened when scripts/embeddings.py has added to it since
+identify_index = {"index": None, "mtime": None}
+identify_lock = threading.Lock()
+def get_index(create=False):
+    with identify_lock:
+        meta_path = os.path.join(INDEX_DIR, META_NAME)
+        mtime = os.path.getmtime(meta_path) if os.path.exists(meta_path) else None
+        if (mtime is not None and mtime != identify_index["mtime"]) or (mtime is None and create):
+            identify_index["index"] = EmbeddingIndex(INDEX_DIR, dim=models.get(EMBEDDER).dim)
+            identify_index["mtime"] = os.path.getmtime(meta_path)
+        return identify_index["index"]
+
+def search_index(embedding, k):
+    index = get_index()
+    if index is None:
+        return [], 0
+    with timed("search"):
+        return index.search(embedding, k=k)[0], len(index)
+
+def add_to_index(embedding, sku, source):
+    index = get_index(create=True)
+    with identify_lock:
+        count = index.add(embedding[None], [sku], [source])
+        identify_index["mtime"] = os.path.getmtime(os.path.join(INDEX_DIR, META_NAME))
+    return count
+decode_pool = BoundedExecutor()
+
+# Request-level metrics; queue gauges are read when /metrics is scraped
+REQUEST_SECONDS = Histogram("farmvision_request_seconds", "HTTP request latency", ["path", "status"])
+IN_FLIGHT = Gauge("farmvision_requests_in_flight", "HTTP requests being handled", ["path"])
+QUEUE_DEPTH = Gauge("farmvision_queue_depth", "Items waiting in a work queue", ["queue"])
+QUEUE_DEPTH.set_function(lambda: batcher.queue_depth, queue="inference")
+QUEUE_DEPTH.set_function(lambda: decode_pool.pending, queue="decode")
+MODEL_LOAD_SECONDS = Gauge("farmvision_model_load_seconds", "Time taken to load each model", ["model"])
+for _name in models.loaders:
+    MODEL_LOAD_SECONDS.set_function(
+        lambda name=_name: models.status()["models"][name].get("seconds", float("nan")), model=_name)
+STREAM_FRAMES = Counter("farmvision_stream_frames_total", "Frames received on /stream by outcome", ["outcome"])
+METRIC_PATHS = {"/predict/", "/predict/batch", "/identify", "/identify/enroll"}
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    path = request.url.path
+    if path not in METRIC_PATHS:
+        return await call_next(request)
+    IN_FLIGHT.inc(path=path)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # For /predict/batch this is the time to the first byte of the stream
+        REQUEST_SECONDS.observe(time.perf_counter() - start, path=path, status=str(status))
+        IN_FLIGHT.dec(path=path)
+
+@app.on_event("startup")
+async def start_batcher():
+    await batcher.start()
+    if IDENTIFY:
+        await embed_batcher.start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+    await embed_batcher.stop()
+    decode_pool.shutdown()
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.exception_handler(NotReady)
+async def not_ready_handler(request: Request, exc: NotReady):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+# Readiness: every model loaded; includes per-model load time and source file
+@app.get("/health/ready")
+async def ready():
+    status = models.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/stats/batching")
+async def batching_stats():
+    return {**batcher.stats(), "decode": decode_pool.stats()}
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return cache.stats()
+
+@app.get("/stats/identify")
+async def identify_stats():
+    require_identify()
+    index = await run_in_threadpool(get_index)
+    return index.stats() if index is not None else {"vectors": 0}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
-    # Stage 1: Cattle detection
-    pred_stage1 = cattle_model.predict(img_array)
-    class_idx = np.argmax(pred_stage1, axis=1)[0]
+# Build the JSON response for one image from its stage 1 label and outputs and
+# its breed model's output (None for non-cattle)
+def build_response(label, pred_stage1, pred_breed):
+    # Stage 1: Cattle / buffalo detection
     confidence = float(np.max(pred_stage1))
 
-    if class_idx == 0:  # assuming 0 = not cattle, 1 = cattle
-        return JSONResponse(content={
+    if pred_breed is None:
+        return {
             "is_cattle": False,
+            "animal": label,
             "confidence": confidence
-        })
-
-    # Stage 2: Breed classification
-    pred_stage2 = breed_model.predict(img_array)
-    breed_idx = np.argmax(pred_stage2, axis=1)[0]
-    confidence_breed = float(np.max(pred_stage2))
-    breed_name = idx_to_breed[breed_idx]
-
-    # Fetch traits for this breed (take average of dataset entries)
-    breed_data = df[df["breed"] == breed_name]
-    age = float(breed_data["age_in_year"].mean())
-    height = float(breed_data["height_in_inch"].mean())
-    weight = float(breed_data["weight_in_kg"].mean())
-    sex = breed_data["sex"].mode()[0]
-
-    # Compute ATC score
-    atc_score = compute_atc(age, height, weight)
-
-    return JSONResponse(content={
-        "is_cattle": True,
-        "cattle_confidence": confidence,
+        }
+
+    # Stage 2 / 3: Breed classification
+    _, breed_names, traits_by_breed = BREEDS[label]
+    breed_idx = int(np.argmax(pred_breed))
+    confidence_breed = float(np.max(pred_breed))
+    breed_name = breed_names[breed_idx]
+
+    # Traits for this breed (dataset averages and ATC score, precomputed)
+    with timed("traits"):
+        traits = traits_by_breed.get(breed_idx) or dict.fromkeys(TRAIT_KEYS)
+
+    return {
+        "is_cattle": label == "cattle",
+        "animal": label,
+        f"{label}_confidence": confidence,
         "breed": breed_name,
         "breed_confidence": confidence_breed,
-        "sex": sex,
-        "age_in_year": age,
-        "height_in_inch": height,
-        "weight_in_kg": weight,
-        "ATC_score": atc_score
-    })
+        **traits
+    }
+
+# Cached response for an upload, or run it through the stages and cache the result
+async def classify(contents: bytes):
+    if not models.ready:
+        raise NotReady("Models are still loading")
+    cached, digest, phash, pixels = await decode_pool.run(prepare, contents)
+    if cached is not None:
+        return cached
+
+    # Stage 1 and the breed stages run batched together with other in-flight requests
+    reloads = models.reloads
+    label, pred_stage1, pred_breed = await batcher.submit(pixels)
+    response = build_response(label, pred_stage1, pred_breed)
+    # Not cached when a model was swapped while this one was running
+    if models.reloads == reloads:
+        cache.put(digest, response, phash)
+    return response
+
+@app.post("/predict/")
+async def predict(file: UploadFile = File(...)):
+    with timed("read"):
+        contents = await file.read()
+    return JSONResponse(content=await classify(contents))
+
+# Streaming: a camera sends frames over a WebSocket; near-duplicate frames
+# (dhash), frames over the per-stream rate and frames arriving while the
+# stream already has its window of frames in the cascade are skipped, the rest
+# are batched with other requests and folded into one running prediction
+def decode_frame(contents: bytes):
+    with timed("decode"):
+        img = load_image(contents)
+    with timed("phash"):
+        phash = dhash(img)
+    return phash, np.asarray(img)
+
+def aggregate_response(running):
+    current = running.current()
+    if current is None:
+        return None
+    label, mean_stage1, mean_breed, breed_frames = current
+    if mean_breed is None and label in BREEDS:
+        # Stage 1 leans to this animal overall, but no single frame was routed to its breed model
+        response = {"is_cattle": label == "cattle", "animal": label,
+                    f"{label}_confidence": float(np.max(mean_stage1)), "breed": None}
+    else:
+        response = build_response(label, mean_stage1, mean_breed)
+    return {**response, "frames": running.frames, "breed_frames": breed_frames}
+
+@app.websocket("/stream")
+async def stream(websocket: WebSocket):
+    await websocket.accept()
+    if not models.ready:
+        await websocket.close(code=1013, reason="Models are still loading")
+        return
+    frames = FrameFilter()
+    running = RunningPrediction(stage1_classes)
+    send_lock = asyncio.Lock()
+    tasks = set()
+    # Bumped by "reset"; frames sent before it must not reach the new running prediction
+    generation = 0
+
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def skip(index, reason):
+        STREAM_FRAMES.inc(outcome=reason)
+        await send({"frame": index, "skipped": True, "reason": reason, "aggregate": aggregate_response(running)})
+
+    async def classify_frame(index, pixels, frame_generation):
+        try:
+            label, pred_stage1, pred_breed = await batcher.submit(pixels)
+        except Overloaded:
+            await skip(index, "overloaded")
+            return
+        except Exception as exc:
+            STREAM_FRAMES.inc(outcome="error")
+            await send({"frame": index, "error": str(exc)})
+            return
+        finally:
+            frames.done()
+        if frame_generation != generation:
+            await skip(index, "reset")
+            return
+        running.update(label, pred_stage1, pred_breed)
+        STREAM_FRAMES.inc(outcome="classified")
+        await send({"frame": index, "skipped": False, "prediction": build_response(label, pred_stage1, pred_breed),
+                    "aggregate": aggregate_response(running)})
+
+    index = 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text") is not None:
+                command = message["text"].strip().lower()
+                if command == "end":
+                    break
+                if command == "reset":
+                    generation += 1
+                    frames.reset()
+                    running.reset()
+                    await send({"reset": True})
+                else:
+                    await send({"error": f"Unknown command {command!r}, expected 'reset' or 'end'"})
+                continue
+
+            index += 1
+            reason = frames.precheck()
+            if reason is not None:
+                await skip(index, reason)
+                continue
+            try:
+                phash, pixels = await decode_pool.run(decode_frame, message["bytes"])
+            except Overloaded:
+                await skip(index, "overloaded")
+                continue
+            except Exception as exc:
+                STREAM_FRAMES.inc(outcome="error")
+                await send({"frame": index, "error": str(exc)})
+                continue
+            if not frames.accept(phash):
+                await skip(index, "duplicate")
+                continue
+            task = asyncio.create_task(classify_frame(index, pixels, generation))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        # "end": finish the frames in flight, then send the final prediction
+        await asyncio.gather(*tasks)
+        await send({"final": True, "frames_received": index, "aggregate": aggregate_response(running)})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# Re-identification: embed an upload and find the closest enrolled animals
+def require_identify():
+    if not IDENTIFY:
+        raise HTTPException(status_code=404, detail="Re-identification is disabled (set FARMVISION_IDENTIFY=1)")
+
+def decode_pixels(contents: bytes):
+    with timed("decode"):
+        return np.asarray(load_image(contents))
+
+async def embed_upload(file: UploadFile):
+    require_identify()
+    if not models.ready:
+        raise NotReady("Models are still loading")
+    with timed("read"):
+        contents = await file.read()
+    pixels = await decode_pool.run(decode_pixels, contents)
+    return await embed_batcher.submit(pixels)
+
+@app.post("/identify")
+async def identify(file: UploadFile = File(...), k: int = Query(5, ge=1, le=100)):
+    embedding = await embed_upload(file)
+    matches, index_size = await run_in_threadpool(search_index, embedding, k)
+    return {"matches": matches, "index_size": index_size}
+
+# Enroll one more image of an animal (incremental insert into the index)
+@app.post("/identify/enroll")
+async def enroll(file: UploadFile = File(...), sku: str = Form(...)):
+    embedding = await embed_upload(file)
+    try:
+        count = await run_in_threadpool(add_to_index, embedding, sku, file.filename or "upload")
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+    return {"sku": sku, "index_size": count}
+
+# Max images of one /predict/batch request being decoded or waiting for inference
+BATCH_WINDOW = int(os.environ.get("FARMVISION_BATCH_WINDOW", 32))
+
+# Copy an upload to a temp file we own: FastAPI may close the upload before a
+# streamed response finishes, and spooled uploads must not be held in memory
+def take_upload(upload: UploadFile):
+    upload.file.seek(0)
+    owned = tempfile.TemporaryFile()
+    shutil.copyfileobj(upload.file, owned)
+    owned.seek(0)
+    return upload.filename or "upload", owned
+
+# Yield (name, loader) for every image in the uploads; zip archives are read
+# member by member so only images currently in flight are ever in memory
+def iter_images(owned_files):
+    for name, fileobj in owned_files:
+        if zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            archive = zipfile.ZipFile(fileobj)
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                    continue
+                if not info.filename.lower().endswith(VALID_EXTS):
+                    continue
+                yield info.filename, functools.partial(archive.read, info)
+        else:
+            fileobj.seek(0)
+            yield name, fileobj.read
+
+async def predict_one(name, load):
+    try:
+        contents = await run_in_threadpool(load)
+        # A batch upload waits for capacity instead of failing when the queues are full
+        while True:
+            try:
+                response = await classify(contents)
+                break
+            except Overloaded:
+                await asyncio.sleep(0.05)
+        return {"filename": name, **response}
+    except Exception as exc:
+        return {"filename": name, "error": str(exc)}
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...)):
+    if not models.ready:
+        raise NotReady("Models are still loading")
+    owned_files = [await run_in_threadpool(take_upload, f) for f in files]
+
+    async def results():
+        images = iter_images(owned_files)
+        pending = set()
+        try:
+            while True:
+                # Keep at most BATCH_WINDOW images in flight; they are batched
+                # with each other (and other requests) by the micro-batcher
+                while len(pending) < BATCH_WINDOW:
+                    item = await run_in_threadpool(next, images, None)
+                    if item is None:
+                        break
+                    pending.add(asyncio.create_task(predict_one(*item)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield json.dumps(task.result()) + "\n"
+        finally:
+            for task in pending:
+                task.cancel()
+            for _, fileobj in owned_files:
+                fileobj.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from executor import Overloaded
+
+# Tunables (override through the environment when starting uvicorn)
+MAX_BATCH_SIZE = int(os.environ.get("FARMVISION_MAX_BATCH_SIZE", 16))
+MAX_WAIT_MS = float(os.environ.get("FARMVISION_MAX_WAIT_MS", 10))
+MAX_QUEUE_SIZE = int(os.environ.get("FARMVISION_MAX_QUEUE_SIZE", 256))
+
+
+class MicroBatcher:
+    """Groups concurrent single-image requests into one batch.
+
+    `batch_fn` receives the stacked inputs (N, H, W, C) and must return a
+    sequence of N per-image results, in the same order. It runs on a single
+    dedicated thread, one batch at a time, so the models never compete with
+    each other for cores. `on_wait`, if given, is called with the seconds
+    each image spent queued before its batch started.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS,
+                 max_queue_size=MAX_QUEUE_SIZE, on_wait=None):
+        self.batch_fn = batch_fn
+        self.on_wait = on_wait
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.batches_run = 0
+        self.images_run = 0
+        self.rejected = 0
+        self._queue = None
+        self._worker = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="farmvision-inference")
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self.queue_depth,
+            "batches_run": self.batches_run,
+            "images_run": self.images_run,
+            "rejected": self.rejected,
+            "mean_batch_size": round(self.images_run / self.batches_run, 2) if self.batches_run else 0.0,
+        }
+
+    async def submit(self, x):
+        """Queue one preprocessed image (H, W, C) and wait for its result.
+
+        Raises Overloaded instead of waiting when the queue is full.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((x, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise Overloaded(f"Inference queue is full ({self.max_queue_size} requests), try again later")
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (client disconnect) don't need a slot in the batch
+            batch = [(x, f, queued) for x, f, queued in batch if not f.done()]
+            if not batch:
+                continue
+            if self.on_wait is not None:
+                now = time.perf_counter()
+                for _, _, queued in batch:
+                    self.on_wait(now - queued)
+
+            inputs = np.stack([x for x, _, _ in batch])
+            try:
+                # Run the models off the event loop so new requests keep queueing
+                results = await loop.run_in_executor(self._executor, self.batch_fn, inputs)
+            except Exception as exc:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            self.batches_run += 1
+            self.images_run += len(batch)
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
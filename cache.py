@@ -0,0 +1,161 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Tunables (override through the environment when starting uvicorn)
+CACHE_SIZE = int(os.environ.get("FARMVISION_CACHE_SIZE", 1024))  # max responses kept, 0 disables
+CACHE_TTL = float(os.environ.get("FARMVISION_CACHE_TTL", 3600))  # seconds
+CACHE_PHASH = os.environ.get("FARMVISION_CACHE_PHASH", "0") == "1"
+
+
+def content_digest(contents: bytes):
+    return hashlib.sha256(contents).hexdigest()
+
+
+def dhash(img, hash_size=8):
+    """64-bit difference hash of a PIL image; re-encoded or resized copies of
+    the same photo usually get the same value."""
+    small = img.convert("L").resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+class PredictionCache:
+    """LRU cache of final responses keyed by the SHA-256 of the uploaded bytes,
+    optionally also by the perceptual hash of the decoded image.
+
+    Entries expire after `ttl` seconds, and the whole cache is dropped when
+    any of `watch_paths` (e.g. the dataset behind the traits) changes or on
+    `clear()` (e.g. after a model reload).
+    `misses` counts responses that had to be computed and were stored.
+    """
+
+    def __init__(self, watch_paths=(), max_entries=CACHE_SIZE, ttl=CACHE_TTL, use_phash=CACHE_PHASH,
+                 check_interval=1.0):
+        self.watch_paths = tuple(watch_paths)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_phash = use_phash
+        self.check_interval = check_interval
+        self.hits = 0
+        self.phash_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()  # digest -> (expires_at, response, phash)
+        self._by_phash = {}  # phash -> digest
+        self._lock = threading.Lock()
+        self._fingerprint = self._current_fingerprint()
+        self._next_check = time.monotonic() + check_interval
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _current_fingerprint(self):
+        fingerprint = []
+        for path in self.watch_paths:
+            try:
+                st = os.stat(path)
+                fingerprint.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    def _check_sources(self, now):
+        # Called with the lock held; stats the watched files at most once per check_interval
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        fingerprint = self._current_fingerprint()
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._entries.clear()
+            self._by_phash.clear()
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_phash.clear()
+            self.invalidations += 1
+
+    def _drop(self, digest):
+        _, _, phash = self._entries.pop(digest)
+        if phash is not None and self._by_phash.get(phash) == digest:
+            del self._by_phash[phash]
+
+    def _lookup(self, digest, now):
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            self._drop(digest)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(digest)
+        return entry[1]
+
+    def get(self, digest):
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._check_sources(now)
+            response = self._lookup(digest, now)
+            if response is not None:
+                self.hits += 1
+            return response
+
+    def get_by_phash(self, phash):
+        if not self.enabled:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._check_sources(now)
+            digest = self._by_phash.get(phash)
+            response = self._lookup(digest, now) if digest is not None else None
+            if response is not None:
+                self.phash_hits += 1
+            return response
+
+    def put(self, digest, response, phash=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._check_sources(now)
+            self.misses += 1
+            if digest in self._entries:
+                self._drop(digest)
+            self._entries[digest] = (now + self.ttl, response, phash)
+            if phash is not None:
+                self._by_phash[phash] = digest
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.phash_hits + self.misses
+        return {
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "use_phash": self.use_phash,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "phash_hits": self.phash_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.phash_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,45 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Tunables (override through the environment when starting uvicorn)
+DECODE_WORKERS = int(os.environ.get("FARMVISION_DECODE_WORKERS", min(4, os.cpu_count() or 1)))
+MAX_PENDING_DECODES = int(os.environ.get("FARMVISION_MAX_PENDING_DECODES", 64))
+
+
+class Overloaded(Exception):
+    """Raised when a work queue is full; the API answers 503."""
+
+
+class BoundedExecutor:
+    """Thread pool that runs blocking work for the event loop and rejects
+    new jobs once `max_pending` are already queued or running."""
+
+    def __init__(self, max_workers=DECODE_WORKERS, max_pending=MAX_PENDING_DECODES, name="farmvision"):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+    async def run(self, fn, *args):
+        # Only touched from the event loop thread, so no lock is needed
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded(f"{self.pending} jobs already pending, try again later")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
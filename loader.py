@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class NotReady(Exception):
+    """Raised while models are still loading or failed to load; the API answers 503."""
+
+
+def fingerprint(paths):
+    """(mtime_ns, size) per path, None when missing; a directory (SavedModel)
+    by its newest file and total size."""
+    result = []
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                stats = [os.stat(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files]
+                result.append((max((st.st_mtime_ns for st in stats), default=0), sum(st.st_size for st in stats)))
+            else:
+                st = os.stat(path)
+                result.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            result.append(None)
+    return tuple(result)
+
+
+class ModelLoader:
+    """Loads models concurrently on background threads and tracks readiness.
+
+    `loaders` maps a model name to a zero-argument function returning the
+    loaded predictor. A loader that raises is recorded as failed instead of
+    propagating, so one bad model file leaves the process up (and not ready)
+    rather than crashing it.
+
+    With `watch_changes(interval)`, a model is loaded again when the file it
+    was loaded from (its `source`) or one of its `watch` paths changes; the
+    old model keeps serving until the new one is loaded, and stays when the
+    reload fails. `check_reload(name)` runs before every reload and refuses it
+    by raising; `on_reload(name)` is called after every swap.
+    """
+
+    def __init__(self, loaders, watch=None, on_reload=None, check_reload=None):
+        self.loaders = dict(loaders)
+        self.watch = {name: tuple((watch or {}).get(name, ())) for name in self.loaders}
+        self.on_reload = on_reload
+        self.check_reload = check_reload
+        self.started_at = None
+        self.reloads = 0
+        self._models = {}
+        self._status = {name: {"state": "pending"} for name in self.loaders}
+        self._fingerprints = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._remaining = len(self.loaders)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        pool = ThreadPoolExecutor(max_workers=max(len(self.loaders), 1), thread_name_prefix="farmvision-load")
+        for name, fn in self.loaders.items():
+            pool.submit(self._load, name, fn)
+        pool.shutdown(wait=False)
+        if not self.loaders:
+            self._done.set()
+
+    def _watched(self, name, source):
+        return self.watch[name] + ((source,) if source and source not in self.watch[name] else ())
+
+    def _load(self, name, fn, reload=False):
+        if not reload:
+            with self._lock:
+                self._status[name] = {"state": "loading"}
+        start = time.perf_counter()
+        try:
+            if reload and self.check_reload is not None:
+                self.check_reload(name)
+            model = fn()
+            status = {"state": "ready", "source": getattr(model, "source", None)}
+            print(f"✅ {'Reloaded' if reload else 'Loaded'} {name} in {time.perf_counter() - start:.2f}s "
+                  f"from {status['source']}")
+        except Exception as exc:
+            model = None
+            status = {"state": "failed", "error": f"{type(exc).__name__}: {exc}"}
+            print(f"❌ Failed to {'reload' if reload else 'load'} {name}: {status['error']}")
+        status["seconds"] = round(time.perf_counter() - start, 3)
+
+        with self._lock:
+            if model is not None:
+                self._models[name] = model
+                self._status[name] = status
+            elif name in self._models:
+                # Keep serving the model that was loaded before
+                self._status[name]["reload_error"] = status["error"]
+            else:
+                self._status[name] = status
+            # Changes are tracked from here on, against the file that is being served
+            self._fingerprints[name] = fingerprint(self._watched(name, self._status[name].get("source")))
+            if not reload:
+                self._remaining -= 1
+                if not self._remaining:
+                    self._done.set()
+        if reload and model is not None:
+            self.reloads += 1
+            if self.on_reload is not None:
+                self.on_reload(name)
+
+    def check_changes(self):
+        """Reload every loaded (or failed) model whose watched files changed; returns their names."""
+        with self._lock:
+            changed = [name for name, seen in self._fingerprints.items()
+                       if fingerprint(self._watched(name, self._status[name].get("source"))) != seen]
+        for name in changed:
+            self._load(name, self.loaders[name], reload=True)
+        return changed
+
+    def watch_changes(self, interval):
+        """Check for changed model files every `interval` seconds on a daemon thread."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check_changes()
+                except Exception as exc:
+                    print(f"❌ Model change check failed: {type(exc).__name__}: {exc}")
+
+        threading.Thread(target=loop, name="farmvision-reload", daemon=True).start()
+
+    @property
+    def ready(self):
+        return len(self._models) == len(self.loaders)
+
+    def wait(self, timeout=None):
+        """Block until every model has finished loading (or failed); returns `ready`."""
+        self._done.wait(timeout)
+        return self.ready
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is None:
+            raise NotReady(f"Model {name} is {self._status[name]['state']}")
+        return model
+
+    def status(self):
+        with self._lock:
+            models = {name: dict(status) for name, status in self._status.items()}
+        return {"ready": self.ready, "reloads": self.reloads, "models": models}
@@ -0,0 +1,250 @@
+"""Offline batch inference over directories, globs or a manifest of image paths.
+
+Images are read and decoded in parallel, run through the cascade from
+scripts/pipeline.py in batches (stage 1 on the whole batch, then the cattle
+and buffalo sub-batches through stage 2 / stage 3), and written in chunks of
+`--chunk-size` rows to CSV or Parquet files under the output directory.
+A checkpoint is written after every chunk, so re-running the same command
+resumes after the last completed chunk.
+
+With --stage-workers, decoding and every model stage run in their own worker
+processes connected by shared-memory queues (scripts/stage_workers.py), and
+per-stage utilization is written to stage_utilization.json in the output
+directory.
+
+Usage (from the project root):
+    python scripts/batch_infer.py data/herd1 "data/herd2/**/*.jpg" --output results/
+    python scripts/batch_infer.py --manifest paths.txt --output results/ --format parquet
+    python scripts/batch_infer.py data/herd1 --output results/ --stage-workers decode=6,stage1=1,cattle=1,buffalo=1
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import itertools
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from preprocessing import IMG_SIZE, VALID_EXTS, new_batch, preprocess_image
+
+COLUMNS = ["path", "stage1_label", "stage1_confidence", "breed", "breed_confidence", "error"]
+CHECKPOINT_NAME = "checkpoint.json"
+UTILIZATION_NAME = "stage_utilization.json"
+
+
+def iter_inputs(sources, manifest=None):
+    """Image paths in a deterministic order (required for resuming)."""
+    if manifest:
+        with open(manifest, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    # Plain list of paths, or a CSV whose first column is the path
+                    yield line.split(",", 1)[0]
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(VALID_EXTS):
+                        yield os.path.join(root, name)
+        else:
+            for path in sorted(glob.iglob(source, recursive=True)):
+                if path.lower().endswith(VALID_EXTS) and os.path.isfile(path):
+                    yield path
+
+
+def chunked(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_path(path, out):
+    """Decode one image into `out`; the error text when it's unreadable, else None."""
+    try:
+        preprocess_image(path, IMG_SIZE, out=out)
+        return None
+    except Exception as exc:
+        return f"{type(exc).__name__}: {exc}"
+
+
+def submit_batch(paths, pool):
+    batch = new_batch(len(paths), IMG_SIZE)
+    return paths, batch, [pool.submit(load_path, path, batch[i]) for i, path in enumerate(paths)]
+
+
+def collect_batch(paths, batch, futures):
+    """(paths, decoded rows, readable paths, {path: error}); unreadable images are reported, not fatal."""
+    results = [future.result() for future in futures]
+    ok = [path for path, error in zip(paths, results) if error is None]
+    errors = {path: error for path, error in zip(paths, results) if error is not None}
+    if errors:
+        batch = batch[[i for i, error in enumerate(results) if error is None]]
+    return paths, batch, ok, errors
+
+
+def prefetched_batches(paths, batch_size, pool, prefetch):
+    """Decode every image as its own task on `pool`, with up to `prefetch`
+    batches queued ahead of the consumer."""
+    pending = deque()
+    for chunk in chunked(paths, batch_size):
+        pending.append(submit_batch(chunk, pool))
+        if len(pending) >= prefetch:
+            yield collect_batch(*pending.popleft())
+    while pending:
+        yield collect_batch(*pending.popleft())
+
+
+class ChunkWriter:
+    def __init__(self, output_dir, fmt):
+        self.output_dir = output_dir
+        self.fmt = fmt
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, index, rows):
+        path = os.path.join(self.output_dir, f"part-{index:05d}.{self.fmt}")
+        tmp = path + ".tmp"
+        if self.fmt == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pylist(rows, schema=pa.schema([
+                ("path", pa.string()), ("stage1_label", pa.string()), ("stage1_confidence", pa.float32()),
+                ("breed", pa.string()), ("breed_confidence", pa.float32()), ("error", pa.string()),
+            ]))
+            pq.write_table(table, tmp)
+        else:
+            with open(tmp, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                writer.writeheader()
+                writer.writerows(rows)
+        os.replace(tmp, path)
+        return path
+
+
+def run_signature(args):
+    # A checkpoint only applies to the same inputs
+    key = json.dumps([args.sources, args.manifest, args.chunk_size], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def load_checkpoint(path, signature):
+    if not os.path.exists(path):
+        return {"signature": signature, "done": 0, "chunks": 0}
+    with open(path, "r") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("signature") != signature:
+        raise SystemExit(f"{path} belongs to a run with different inputs; use a new --output or --restart")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumable batch inference with the stage 1/2/3 cascade.")
+    parser.add_argument("sources", nargs="*", help="image directories (recursive) or glob patterns")
+    parser.add_argument("--manifest", help="text/CSV file with one image path per line (first column)")
+    parser.add_argument("--output", required=True, help="directory for result chunks and the checkpoint")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--chunk-size", type=int, default=50000, help="rows per output file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode threads")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches queued for decoding ahead of inference")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between throughput reports")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--stage-workers", metavar="decode=N,stage1=N,cattle=N,buffalo=N",
+                        help="run each stage in its own worker processes (scripts/stage_workers.py)")
+    args = parser.parse_args()
+    if not args.sources and not args.manifest:
+        parser.error("give at least one directory/glob or --manifest")
+    if args.stage_workers:
+        from stage_workers import StagePipeline, parse_workers
+        try:
+            stage_workers = parse_workers(args.stage_workers)
+        except ValueError as exc:
+            parser.error(f"--stage-workers: {exc}")
+
+    checkpoint_path = os.path.join(args.output, CHECKPOINT_NAME)
+    os.makedirs(args.output, exist_ok=True)
+    signature = run_signature(args)
+    checkpoint = {"signature": signature, "done": 0, "chunks": 0} if args.restart \
+        else load_checkpoint(checkpoint_path, signature)
+    if checkpoint["done"]:
+        print(f"Resuming after {checkpoint['done']:,} images ({checkpoint['chunks']} chunks written)")
+
+    writer = ChunkWriter(args.output, args.format)
+    paths = itertools.islice(iter_inputs(args.sources, args.manifest), checkpoint["done"], None)
+
+    rows = []
+    processed = 0
+    start = last_report = time.perf_counter()
+    last_processed = 0
+
+    def flush():
+        path = writer.write(checkpoint["chunks"], rows)
+        checkpoint["chunks"] += 1
+        checkpoint["done"] += len(rows)
+        save_checkpoint(checkpoint_path, checkpoint)
+        print(f"💾 {path} ({len(rows):,} rows, {checkpoint['done']:,} total)")
+        rows.clear()
+
+    with ExitStack() as stack:
+        if args.stage_workers:
+            stage_pipeline = stack.enter_context(StagePipeline(args.batch_size, stage_workers))
+            batches = stage_pipeline.run(chunked(paths, args.batch_size))
+        else:
+            # Loads the models, so only after argument parsing
+            from pipeline import classify_batch
+            pool = stack.enter_context(ThreadPoolExecutor(max_workers=args.workers))
+            batches = ((batch_paths, ok_paths, classify_batch(batch) if ok_paths else [], errors)
+                       for batch_paths, batch, ok_paths, errors
+                       in prefetched_batches(paths, args.batch_size, pool, args.prefetch))
+
+        for batch_paths, ok_paths, batch_results, errors in batches:
+            results = dict(zip(ok_paths, batch_results))
+            for path in batch_paths:
+                row = {"path": path, "stage1_label": None, "stage1_confidence": None,
+                       "breed": None, "breed_confidence": None, "error": errors.get(path)}
+                row.update(results.get(path, {}))
+                rows.append(row)
+                if len(rows) >= args.chunk_size:
+                    flush()
+            processed += len(batch_paths)
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_every:
+                recent = (processed - last_processed) / (now - last_report)
+                overall = processed / (now - start)
+                print(f"{checkpoint['done'] + len(rows):,} images | {recent:.1f} img/s (avg {overall:.1f} img/s)")
+                last_report, last_processed = now, processed
+
+    if rows:
+        flush()
+    elapsed = time.perf_counter() - start
+    print(f"✅ Processed {processed:,} images in {elapsed:.1f}s "
+          f"({processed / elapsed if elapsed else 0:.1f} img/s), results in {args.output}")
+
+    if args.stage_workers:
+        utilization = stage_pipeline.utilization()
+        for stage, u in utilization["stages"].items():
+            print(f"  {stage:>8}: {u['workers']} worker(s), {u['utilization'] or 0:.0%} busy, "
+                  f"{u['wait_in_s']:.1f}s waiting for input, {u['wait_out_s']:.1f}s blocked downstream")
+        print(f"  {utilization['hint']}")
+        with open(os.path.join(args.output, UTILIZATION_NAME), "w") as f:
+            json.dump(utilization, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
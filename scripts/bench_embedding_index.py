@@ -0,0 +1,155 @@
+"""Query latency and recall of the embedding index as it grows.
+
+Builds an index of synthetic embeddings per size (a few noisy views around a
+centre per animal, like several photos of one SKU, with the animals clustered
+by breed so near neighbours are similar-looking animals), then times single
+queries (new noisy views of enrolled animals) with exact search and with the
+IVF index at several `nprobe` values. Recall@k is the share of the exact
+search's top-k SKUs the IVF search also returns; top-1 is how often the
+query's own animal comes first. Indexes up to BRUTE_FORCE_MAX vectors are only
+searched exhaustively.
+
+Usage (from the project root):
+    python scripts/bench_embedding_index.py [--sizes 1000 10000 100000 500000] [--dim 1280] [--queries 200]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from embedding_index import BRUTE_FORCE_MAX, EmbeddingIndex
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD_CHUNK = 8192
+
+
+def latency_summary(times_ms):
+    times_ms = np.array(times_ms)
+    return {
+        "p50_ms": round(float(np.percentile(times_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(times_ms, 99)), 3),
+        "mean_ms": round(float(times_ms.mean()), 3),
+    }
+
+
+def noisy_views(centres, noise, rng):
+    views = centres + rng.standard_normal(centres.shape, dtype=np.float32) * noise
+    return views / np.linalg.norm(views, axis=1, keepdims=True)
+
+
+def animal_centres(skus, dim, breeds, spread, rng):
+    """Unit centres per animal, clustered around per-breed centres."""
+    breed_centres = rng.standard_normal((breeds, dim), dtype=np.float32)
+    centres = breed_centres[rng.integers(0, breeds, skus)] * (1 - spread) \
+        + rng.standard_normal((skus, dim), dtype=np.float32) * spread
+    return centres / np.linalg.norm(centres, axis=1, keepdims=True)
+
+
+def build(directory, size, dim, args, rng):
+    skus = max(1, size // args.views)
+    centres = animal_centres(skus, dim, args.breeds, args.spread, rng)
+    noise = args.noise
+    index = EmbeddingIndex(directory, dim=dim)
+    start = time.perf_counter()
+    for lo in range(0, size, BUILD_CHUNK):
+        sku_ids = np.arange(lo, min(lo + BUILD_CHUNK, size)) % skus
+        index.add(noisy_views(centres[sku_ids], noise, rng), [f"SKU {i}" for i in sku_ids])
+    if size > BRUTE_FORCE_MAX:
+        index.train()
+    return index, centres, time.perf_counter() - start
+
+
+def run_queries(index, queries, k, nprobe):
+    times, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, k=k, nprobe=nprobe)[0])
+        times.append((time.perf_counter() - start) * 1000)
+    return times, results
+
+
+def top1(results, truth):
+    return round(float(np.mean([bool(m) and m[0]["sku"] == f"SKU {t}" for m, t in zip(results, truth)])), 4)
+
+
+def bench(size, args, rng):
+    directory = tempfile.mkdtemp(prefix="farmvision-index-")
+    try:
+        index, centres, build_s = build(directory, size, args.dim, args, rng)
+        truth = rng.integers(0, len(centres), args.queries)
+        queries = noisy_views(centres[truth], args.noise, rng)
+
+        times, exact = run_queries(index, queries, args.k, None)
+        exact_skus = [{m["sku"] for m in matches} for matches in exact]
+        result = {
+            "size": size,
+            "skus": len(centres),
+            "build_s": round(build_s, 2),
+            "bytes_on_disk": index.stats()["bytes_on_disk"],
+            "ivf_lists": index.meta["nlist"],
+            "exact": {**latency_summary(times), "top1": top1(exact, truth)},
+            "ivf": [],
+        }
+        # Below BRUTE_FORCE_MAX the index is always searched exhaustively
+        for nprobe in args.nprobe if size > BRUTE_FORCE_MAX else []:
+            if nprobe > index.meta["nlist"]:
+                continue
+            times, found = run_queries(index, queries, args.k, nprobe)
+            recall = np.mean([len(want & {m["sku"] for m in got}) / max(len(want), 1)
+                              for want, got in zip(exact_skus, found)])
+            result["ivf"].append({"nprobe": nprobe, **latency_summary(times),
+                                  f"recall_at_{args.k}": round(float(recall), 4), "top1": top1(found, truth)})
+        return result
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark embedding index query latency vs. index size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 500000])
+    parser.add_argument("--dim", type=int, default=1280)
+    parser.add_argument("--views", type=int, default=5, help="vectors (images) per SKU")
+    parser.add_argument("--breeds", type=int, default=20)
+    parser.add_argument("--spread", type=float, default=0.5, help="how far animals sit from their breed centre")
+    parser.add_argument("--noise", type=float, default=0.02, help="per-dimension noise around each animal's centre")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(BASE_DIR, "reports", "embedding_index.json"))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for size in args.sizes:
+        r = bench(size, args, rng)
+        results.append(r)
+        print(f"{size:>9,} vectors ({r['bytes_on_disk'] / 1e6:,.1f} MB, built in {r['build_s']}s): "
+              f"exact p50 {r['exact']['p50_ms']} ms / p99 {r['exact']['p99_ms']} ms")
+        for ivf in r["ivf"]:
+            print(f"{'':>10}IVF nprobe {ivf['nprobe']:>3}/{r['ivf_lists']}: p50 {ivf['p50_ms']} ms / "
+                  f"p99 {ivf['p99_ms']} ms, recall@{args.k} {ivf[f'recall_at_{args.k}']:.3f}, top-1 {ivf['top1']:.3f}")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "dim": args.dim,
+        "views_per_sku": args.views,
+        "breeds": args.breeds,
+        "spread": args.spread,
+        "noise": args.noise,
+        "queries": args.queries,
+        "k": args.k,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
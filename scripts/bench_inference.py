@@ -0,0 +1,74 @@
+"""Single-image latency: model.predict() vs. the compiled predictor.
+
+Usage (from the project root):
+    python scripts/bench_inference.py [--model models/cattle_detector.keras] [--iters 200] [--batch 1]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from inference import CompiledPredictor
+
+
+def latencies_ms(fn, x, iters):
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn(x)
+        times.append((time.perf_counter() - start) * 1000)
+    return np.array(times)
+
+
+def summarize(times):
+    return {
+        "p50_ms": round(float(np.percentile(times, 50)), 3),
+        "p99_ms": round(float(np.percentile(times, 99)), 3),
+        "mean_ms": round(float(times.mean()), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="models/cattle_detector.keras")
+    parser.add_argument("--iters", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    model = tf.keras.models.load_model(args.model)
+    x = np.random.rand(args.batch, *model.input_shape[1:]).astype(np.float32)
+
+    # Cold first call: what the first live request used to pay
+    start = time.perf_counter()
+    model.predict(x, verbose=0)
+    cold_predict = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    predictor = CompiledPredictor(model)
+    warmup = (time.perf_counter() - start) * 1000
+
+    results = {
+        "model": args.model,
+        "batch": args.batch,
+        "iters": args.iters,
+        "predict_first_call_ms": round(cold_predict, 3),
+        "compiled_warmup_ms": round(warmup, 3),
+        "predict": summarize(latencies_ms(lambda b: model.predict(b, verbose=0), x, args.iters)),
+        "compiled": summarize(latencies_ms(predictor, x, args.iters)),
+    }
+
+    for name in ("predict", "compiled"):
+        r = results[name]
+        print(f"{name:>9}: p50 {r['p50_ms']:.2f} ms | p99 {r['p99_ms']:.2f} ms | mean {r['mean_ms']:.2f} ms")
+    print(f"First predict() call: {cold_predict:.1f} ms | compiled warm-up at startup: {warmup:.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
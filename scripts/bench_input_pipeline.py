@@ -0,0 +1,70 @@
+"""Steps/second of the tf.data input pipeline vs. ImageDataGenerator.
+
+Only the input side is measured (no model), with the augmentation the given
+stage trains with.
+
+Usage (from the project root):
+    python scripts/bench_input_pipeline.py --stage stage1 [--steps 50] [--cache-dir /tmp/input_cache]
+
+Shards written by the split scripts (--shards) are measured too when present.
+"""
+import argparse
+import itertools
+import os
+import time
+
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+from input_pipeline import AUGMENTATION, directory_dataset, shard_dataset
+from shards import index_path
+
+DATA_DIRS = {"stage1": "data_stage1", "stage2": "data_stage2", "stage3": "data_stage3"}
+
+
+def steps_per_second(batches, steps, warmup=3):
+    it = iter(batches)
+    for _ in itertools.islice(it, warmup):
+        pass
+    start = time.perf_counter()
+    n = sum(1 for _ in itertools.islice(it, steps))
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stage", choices=sorted(DATA_DIRS), default="stage1")
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--cache-dir", help="also measure the tf.data pipeline with an on-disk cache")
+    args = parser.parse_args()
+
+    train_dir = os.path.join(DATA_DIRS[args.stage], "train")
+    augment = AUGMENTATION[args.stage]
+
+    gen = ImageDataGenerator(rescale=1./255, fill_mode="nearest", **augment).flow_from_directory(
+        train_dir, target_size=(224, 224), batch_size=args.batch_size, class_mode="categorical", shuffle=True)
+    results = {"ImageDataGenerator": steps_per_second(gen, args.steps)}
+
+    ds = directory_dataset(train_dir, batch_size=args.batch_size, augment=augment, cache_dir=None,
+                           use_shards=False)
+    results["tf.data"] = steps_per_second(ds.dataset.repeat(), args.steps)
+
+    if args.cache_dir:
+        cached = directory_dataset(train_dir, batch_size=args.batch_size, augment=augment, cache_dir=args.cache_dir,
+                                   use_shards=False)
+        # First pass fills the cache, second pass reads from it
+        for _ in cached.dataset:
+            pass
+        results["tf.data (cached)"] = steps_per_second(cached.dataset.repeat(), args.steps)
+
+    if os.path.exists(index_path(train_dir)):
+        sharded = shard_dataset(train_dir, batch_size=args.batch_size, augment=augment)
+        results["tf.data (shards)"] = steps_per_second(sharded.dataset.repeat(), args.steps)
+
+    baseline = results["ImageDataGenerator"]
+    for name, sps in results.items():
+        print(f"{name:>20}: {sps:6.2f} steps/s ({sps * args.batch_size:7.1f} img/s, {sps / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Memory and throughput of serve.py as the number of workers grows.
+
+For every worker count, starts `serve.py --workers N` on a free loopback port,
+waits until every worker has loaded its models, drives it with the load test
+workload (closed loop, `--concurrency-per-worker` clients per worker) and then
+reads the memory of the supervisor and its workers from /proc. PSS
+(proportional set size) splits shared pages between the processes that map
+them: `Pss_File` (the shared model weights, shared libraries) stays flat as
+workers are added, while `Pss_Anon` grows by each worker's TensorFlow runtime
+and buffers, plus its own copy of the weights with `--xnnpack`.
+
+Usage (from the project root):
+    python scripts/bench_workers.py [--workers 1 2 4 8] [--backend tflite-float32] [--duration 20] [--pin-cpus]
+                                    [--xnnpack]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from loadtest import DATA_DIR, DEFAULT_MIX, Workload, free_port, load_images, parse_mix, run, summarize
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEMORY_FIELDS = ("Rss", "Pss", "Pss_Anon", "Pss_File", "Shared_Clean", "Private_Dirty")
+
+
+def memory_kb(pid):
+    """Fields of /proc/<pid>/smaps_rollup in kB (missing fields are left out)."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in MEMORY_FIELDS:
+                values[name] = int(rest.split()[0])
+    return values
+
+
+def default_worker_counts(cpus=os.cpu_count() or 1):
+    """1, 2, 4, ... up to the number of CPUs, and the CPU count itself."""
+    counts, n = {cpus}, 1
+    while n < cpus:
+        counts.add(n)
+        n *= 2
+    return sorted(counts)
+
+
+def wait_ready(proc, status_file, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"serve.py exited with {proc.returncode}")
+        try:
+            with open(status_file, "r") as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            status = None
+        if status and any(w["failed"] for w in status["workers"]):
+            raise RuntimeError(f"A worker failed to load its models: {status}")
+        if status and all(w["ready"] for w in status["workers"]):
+            return status
+        time.sleep(0.5)
+    raise RuntimeError(f"Workers not ready after {timeout}s")
+
+
+def bench(workers, workload, args):
+    port = free_port()
+    status_file = os.path.join(tempfile.mkdtemp(prefix="farmvision-workers-"), "status.json")
+    cmd = [sys.executable, os.path.join(BASE_DIR, "serve.py"), "--workers", str(workers), "--host", "127.0.0.1",
+           "--port", str(port), "--backend", args.backend, "--status-file", status_file]
+    if args.pin_cpus:
+        cmd.append("--pin-cpus")
+    if args.xnnpack:
+        cmd.append("--xnnpack")
+    proc = subprocess.Popen(cmd, cwd=BASE_DIR)
+    try:
+        start = time.perf_counter()
+        status = wait_ready(proc, status_file, args.ready_timeout)
+        ready_s = time.perf_counter() - start
+        idle = [memory_kb(pid) for pid in [status["supervisor"]] + [w["pid"] for w in status["workers"]]]
+
+        load_args = argparse.Namespace(rate=None, concurrency=args.concurrency_per_worker * workers,
+                                       warmup=args.warmup, duration=args.duration, timeout=args.timeout)
+        records, elapsed, _ = asyncio.run(run(f"http://127.0.0.1:{port}", workload, load_args))
+        loaded = [memory_kb(pid) for pid in [status["supervisor"]] + [w["pid"] for w in status["workers"]]]
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+
+    def total_mb(samples, field):
+        return round(sum(s.get(field, 0) for s in samples) / 1024, 1)
+
+    result = summarize(records, elapsed)
+    return {
+        "workers": workers,
+        "threads_per_worker": status["threads_per_worker"],
+        "ready_s": round(ready_s, 2),
+        "throughput_rps": result["throughput_rps"],
+        "error_rate": result["error_rate"],
+        "latency_ms": result["latency_ms"],
+        "memory_mb": {field: total_mb(loaded, field) for field in MEMORY_FIELDS},
+        "idle_memory_mb": {field: total_mb(idle, field) for field in MEMORY_FIELDS},
+        "pss_per_worker_mb": round(total_mb(loaded[1:], "Pss") / workers, 1),
+        "private_per_worker_mb": round(total_mb(loaded[1:], "Pss_Anon") / workers, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serve.py memory and throughput for 1..N workers.")
+    parser.add_argument("--workers", type=int, nargs="+", default=default_worker_counts())
+    parser.add_argument("--backend", default=os.environ.get("FARMVISION_BACKEND", "tflite-float32"))
+    parser.add_argument("--pin-cpus", action="store_true")
+    parser.add_argument("--xnnpack", action="store_true", help="serve with XNNPACK (private weights per worker)")
+    parser.add_argument("--concurrency-per-worker", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout (s)")
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--images-dir", default=DATA_DIR)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(BASE_DIR, "reports", "workers.json"))
+    args = parser.parse_args()
+
+    images = load_images(args.images_dir, list(args.mix), 50, args.seed)
+    results = []
+    for workers in args.workers:
+        workload = Workload(images, args.mix, unique=True, seed=args.seed)
+        r = bench(workers, workload, args)
+        results.append(r)
+        print(f"{workers:>3} workers: {r['throughput_rps']:>8} req/s, p99 {r['latency_ms'].get('p99')} ms, "
+              f"PSS {r['memory_mb']['Pss']:,.0f} MB ({r['pss_per_worker_mb']:,.0f} MB/worker, "
+              f"{r['private_per_worker_mb']:,.0f} MB private), "
+              f"summed RSS {r['memory_mb']['Rss']:,.0f} MB, errors {r['error_rate']:.2%}")
+
+    base = results[0]
+    for r in results:
+        r["speedup"] = round(r["throughput_rps"] / base["throughput_rps"], 2) if base["throughput_rps"] else None
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "backend": args.backend,
+        "cpus": os.cpu_count(),
+        "pin_cpus": args.pin_cpus,
+        "xnnpack": args.xnnpack,
+        "concurrency_per_worker": args.concurrency_per_worker,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Stage-1 routing shared by the API and scripts/pipeline.py.
+
+Stage 1 sorts a batch into buffalo / cattle / non_cattle. The cattle rows go
+to the cattle breed model (stage 2) and the buffalo rows to the buffalo breed
+model (stage 3), each as one sub-batch, and the breed outputs are scattered
+back into the batch's order. Non-cattle rows never reach a breed model.
+
+With FARMVISION_STAGE1_GATE=1 a low-resolution stage-1 model (trained with
+STAGE1_IMG_SIZE=128 python scripts/train_stage1.py) runs first on a
+downscaled copy of the batch. Confident non_cattle predictions exit there,
+confident cattle/buffalo predictions go straight to the breed stages, and
+only the uncertain rest is escalated to the full 224x224 detector.
+"""
+import os
+
+import numpy as np
+
+from metrics import BATCH_SIZE, count_prediction, timed
+from preprocessing import downscale
+
+# Stage-1 label -> breed stage that handles it
+BREED_STAGES = {"cattle": "stage2", "buffalo": "stage3"}
+
+USE_GATE = os.environ.get("FARMVISION_STAGE1_GATE", "0") == "1"
+GATE_SIZE = int(os.environ.get("FARMVISION_GATE_SIZE", 128))
+# A low-res non_cattle prediction at least this confident is final
+GATE_REJECT = float(os.environ.get("FARMVISION_GATE_REJECT", 0.9))
+# A low-res cattle/buffalo prediction at least this confident skips the
+# full-res detector (> 1 always escalates them)
+GATE_ACCEPT = float(os.environ.get("FARMVISION_GATE_ACCEPT", 0.98))
+GATE_DECISIONS = ("exit", "accept", "escalate")
+
+
+def gate_model_name(size=GATE_SIZE):
+    """Base name in models/ of the low-res detector train_stage1.py writes."""
+    return f"cattle_detector_{size}"
+
+
+def gate_decisions(preds, stage1_class_indices, reject=GATE_REJECT, accept=GATE_ACCEPT):
+    """(exit, accept, escalate) row indices for low-res stage-1 outputs."""
+    idx = np.argmax(preds, axis=1)
+    confidence = preds[np.arange(len(preds)), idx]
+    non_cattle = idx == stage1_class_indices["non_cattle"]
+    exits = non_cattle & (confidence >= reject)
+    accepts = ~non_cattle & (confidence >= accept)
+    return np.flatnonzero(exits), np.flatnonzero(accepts), np.flatnonzero(~(exits | accepts))
+
+
+class Stage1Gate:
+    """Low-res stage-1 model plus the thresholds deciding which rows escalate.
+
+    `predict` takes a (N, size, size, 3) batch; calling the gate with the
+    full-res batch downscales it first and returns
+    (low-res probabilities, exit rows, accept rows, escalate rows). `counts`
+    holds the running number of images per decision.
+    """
+
+    def __init__(self, predict, stage1_class_indices, size=GATE_SIZE, reject=GATE_REJECT, accept=GATE_ACCEPT):
+        self.predict = predict
+        self.stage1_class_indices = stage1_class_indices
+        self.size = size
+        self.reject = reject
+        self.accept = accept
+        self.counts = dict.fromkeys(GATE_DECISIONS, 0)
+
+    def __call__(self, x):
+        with timed("stage1_gate"):
+            preds = np.array(self.predict(downscale(x, self.size)), dtype=np.float32)
+        BATCH_SIZE.observe(len(x), stage="stage1_gate")
+        decisions = gate_decisions(preds, self.stage1_class_indices, self.reject, self.accept)
+        for decision, rows in zip(GATE_DECISIONS, decisions):
+            self.counts[decision] += len(rows)
+            if len(rows):
+                count_prediction("stage1_gate", decision, len(rows))
+        return (preds,) + decisions
+
+
+def run_stage1(x, full_predict, gate=None):
+    """Stage-1 probabilities for a full-res batch; with a gate, the full-res
+    detector only runs on the rows it escalates."""
+    if gate is None:
+        with timed("stage1"):
+            preds = full_predict(x)
+        BATCH_SIZE.observe(len(x), stage="stage1")
+        return preds
+
+    preds, _, _, escalate = gate(x)
+    if len(escalate):
+        with timed("stage1"):
+            preds[escalate] = full_predict(x[escalate])
+        BATCH_SIZE.observe(len(escalate), stage="stage1")
+    return preds
+
+
+def dispatch_breeds(stage1_idx, stage1_class_indices, predict_rows):
+    """Breed outputs per row (None where stage 1 found no cattle/buffalo).
+
+    `predict_rows` maps a stage-1 label ("cattle", "buffalo") to a function
+    taking the row indices routed to it and returning one probability row per
+    index, e.g. `lambda rows: breed_predict(batch[rows])`.
+    """
+    breeds = [None] * len(stage1_idx)
+    for label, predict in predict_rows.items():
+        rows = np.flatnonzero(stage1_idx == stage1_class_indices[label])
+        if not len(rows):
+            continue
+        stage = BREED_STAGES[label]
+        with timed(stage):
+            preds = predict(rows)
+        BATCH_SIZE.observe(len(rows), stage=stage)
+        for row, p in zip(rows, preds):
+            breeds[row] = p
+    return breeds
@@ -0,0 +1,356 @@
+"""On-disk nearest-neighbour index of animal embeddings, keyed by SKU.
+
+Vectors are L2-normalized and stored as float16 in an append-only file that
+is memory-mapped for search, next to the SKU and source image of every
+vector:
+
+    models/embedding_index/
+        meta.json       dim, committed vector count, IVF settings
+        vectors.f16     (count, dim) float16, row-major
+        lists.i32       IVF list of every vector (once trained)
+        centroids.npy   (nlist, dim) float32 IVF centroids (once trained)
+        entries.tsv     "<sku>\t<source>" per vector
+        index.lock      held (flock) while a process appends or trains
+
+Inserts append to the files and then rewrite meta.json. The count there is
+the commit point: rows past it (from an interrupted insert) are dropped on
+open. Several processes (API workers, scripts/embeddings.py) can add to one
+index: each takes the lock and first reads the rows the others committed.
+Small indexes are searched exhaustively with one matrix product per chunk.
+From BRUTE_FORCE_MAX vectors on, an inverted-file (IVF) index is
+trained with k-means, and queries only scan the `nprobe` lists whose
+centroids are closest. It is retrained when the index has grown RETRAIN_GROWTH
+times since the last training. Matches are returned per SKU (best image per
+animal), by cosine similarity.
+"""
+import contextlib
+import json
+import math
+import mmap
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+import numpy as np
+
+META_NAME = "meta.json"
+VECTORS_NAME = "vectors.f16"
+LISTS_NAME = "lists.i32"
+CENTROIDS_NAME = "centroids.npy"
+ENTRIES_NAME = "entries.tsv"
+LOCK_NAME = "index.lock"
+
+BRUTE_FORCE_MAX = int(os.environ.get("FARMVISION_INDEX_BRUTE_FORCE_MAX", 10000))
+NPROBE = int(os.environ.get("FARMVISION_INDEX_NPROBE", 16))
+RETRAIN_GROWTH = 4
+TRAIN_SAMPLE = 65536
+KMEANS_ITERATIONS = 10
+CHUNK_ROWS = 65536
+# Re-sort the inverted lists once this many vectors were added since the last sort
+TAIL_MAX = 8192
+
+
+def normalize_rows(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def default_nlist(count):
+    return int(min(4096, max(16, 4 * math.sqrt(count))))
+
+
+def nearest_centroids(x, centroids, n=1):
+    """Indices of the `n` most similar centroids for every row of `x`."""
+    out = np.empty((len(x), n), dtype=np.int32)
+    for start in range(0, len(x), CHUNK_ROWS):
+        sims = x[start:start + CHUNK_ROWS].astype(np.float32) @ centroids.T
+        if n == 1:
+            out[start:start + CHUNK_ROWS, 0] = np.argmax(sims, axis=1)
+        else:
+            top = np.argpartition(-sims, n - 1, axis=1)[:, :n]
+            out[start:start + CHUNK_ROWS] = top
+    return out
+
+
+def kmeans(x, k, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on normalized rows; returns (k, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assign = nearest_centroids(x, centroids)[:, 0]
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        present = np.flatnonzero(counts)
+        sums[present] = np.add.reduceat(x[order], np.concatenate([[0], np.cumsum(counts)[:-1]])[present])
+        # Empty clusters restart from random points
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    def __init__(self, directory, dim=None):
+        self.directory = directory
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        if not os.path.exists(self._path(META_NAME)):
+            if dim is None:
+                raise FileNotFoundError(f"No embedding index in {directory} (give `dim` to create one)")
+            os.makedirs(directory, exist_ok=True)
+        with self._file_lock():
+            if os.path.exists(self._path(META_NAME)):
+                self._open()
+            else:
+                self._create(dim)
+        self._remap()
+        self._sort_lists()
+
+    def _create(self, dim):
+        self.meta = {"dim": int(dim), "count": 0, "nlist": 0, "trained_count": 0}
+        self._skus, self._sku_codes, self._sources = [], np.zeros(0, dtype=np.int32), []
+        self._sku_index = {}
+        self._lists = np.zeros(0, dtype=np.int32)
+        self.centroids = None
+        for name in (VECTORS_NAME, LISTS_NAME, ENTRIES_NAME):
+            open(self._path(name), "wb").close()
+        self._commit()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    def __len__(self):
+        return self.meta["count"]
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with self._lock:
+            # Reentrant like self._lock (add() trains): flock() on a second
+            # descriptor would wait for the lock this thread already holds
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self._path(LOCK_NAME), "a") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+
+    def _refresh(self):
+        """Pick up what other processes committed; call with the file lock held."""
+        with open(self._path(META_NAME), "r") as f:
+            meta = json.load(f)
+        if meta != self.meta:
+            self._open()
+            self._remap()
+            self._sort_lists()
+
+    def _open(self):
+        with open(self._path(META_NAME), "r") as f:
+            self.meta = json.load(f)
+        count, dim = self.meta["count"], self.meta["dim"]
+        # Drop anything past the committed count (an interrupted insert)
+        for name, row_bytes in ((VECTORS_NAME, dim * 2), (LISTS_NAME, 4 if self.meta["nlist"] else 0)):
+            if os.path.getsize(self._path(name)) > count * row_bytes:
+                os.truncate(self._path(name), count * row_bytes)
+
+        self._skus, codes, self._sources, self._sku_index = [], [], [], {}
+        with open(self._path(ENTRIES_NAME), "r", encoding="utf-8") as f:
+            lines = [line for _, line in zip(range(count), f)]
+        if len(lines) < count:
+            raise ValueError(f"{self._path(ENTRIES_NAME)} has {len(lines)} entries, expected {count}")
+        with open(self._path(ENTRIES_NAME), "r+", encoding="utf-8") as f:
+            f.seek(sum(len(line.encode("utf-8")) for line in lines))
+            f.truncate()
+        for line in lines:
+            sku, _, source = line.rstrip("\n").partition("\t")
+            codes.append(self._code(sku))
+            self._sources.append(source)
+        self._sku_codes = np.array(codes, dtype=np.int32)
+
+        self.centroids = np.load(self._path(CENTROIDS_NAME)) if self.meta["nlist"] else None
+        self._lists = np.fromfile(self._path(LISTS_NAME), dtype=np.int32) if self.meta["nlist"] \
+            else np.zeros(0, dtype=np.int32)
+
+    def _code(self, sku):
+        code = self._sku_index.get(sku)
+        if code is None:
+            code = self._sku_index[sku] = len(self._skus)
+            self._skus.append(sku)
+        return code
+
+    def _commit(self):
+        tmp = self._path(META_NAME + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp, self._path(META_NAME))
+
+    def _remap(self, start=0):
+        """Map the committed vectors; rows from `start` on are new since the last call."""
+        count = self.meta["count"]
+        self._vectors = np.memmap(self._path(VECTORS_NAME), dtype=np.float16, mode="r",
+                                  shape=(count, self.dim)) if count else np.zeros((0, self.dim), dtype=np.float16)
+        # Widening float16 costs far more than the product itself, so small
+        # (exhaustively searched) indexes keep a float32 copy in memory. It is
+        # an anonymous mapping sized for BRUTE_FORCE_MAX rows up front (pages
+        # are only backed once written), so adds fill it in place.
+        if count > BRUTE_FORCE_MAX:
+            self._dense = None
+            return
+        if start == 0 or self._dense is None:
+            buffer = mmap.mmap(-1, max(BRUTE_FORCE_MAX, 1) * self.dim * 4)
+            self._dense = np.frombuffer(buffer, dtype=np.float32).reshape(-1, self.dim)
+            start = 0
+        self._dense[start:count] = self._vectors[start:count]
+
+    def _sort_lists(self):
+        """Group vector rows by IVF list; rows added later go to the unsorted tail."""
+        self._order = np.argsort(self._lists, kind="stable").astype(np.int32)
+        self._offsets = np.searchsorted(self._lists[self._order], np.arange(self.meta["nlist"] + 1))
+        self._sorted_count = len(self._lists)
+
+    @property
+    def skus(self):
+        return len(self._skus)
+
+    def sources(self):
+        with self._lock:
+            return set(self._sources)
+
+    def add(self, vectors, skus, sources=None):
+        """Append embeddings with their SKUs (and source images); returns the new count."""
+        vectors = normalize_rows(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d vectors, got {vectors.shape[1]}")
+        sources = list(sources) if sources is not None else [""] * len(vectors)
+        if not (len(vectors) == len(skus) == len(sources)):
+            raise ValueError("vectors, skus and sources must have the same length")
+        for text in list(skus) + sources:
+            if "\t" in text or "\n" in text:
+                raise ValueError(f"SKUs and sources can't contain tabs or newlines: {text!r}")
+
+        with self._file_lock():
+            self._refresh()
+            start = self.meta["count"]
+            with open(self._path(VECTORS_NAME), "ab") as f:
+                vectors.astype(np.float16).tofile(f)
+            if self.centroids is not None:
+                lists = nearest_centroids(vectors, self.centroids)[:, 0]
+                with open(self._path(LISTS_NAME), "ab") as f:
+                    lists.tofile(f)
+                self._lists = np.concatenate([self._lists, lists])
+            with open(self._path(ENTRIES_NAME), "a", encoding="utf-8") as f:
+                f.writelines(f"{sku}\t{source}\n" for sku, source in zip(skus, sources))
+            self._sku_codes = np.concatenate([self._sku_codes, np.array([self._code(s) for s in skus],
+                                                                          dtype=np.int32)])
+            self._sources.extend(sources)
+            self.meta["count"] += len(vectors)
+            self._commit()
+            self._remap(start)
+
+            count = self.meta["count"]
+            if count >= BRUTE_FORCE_MAX and (self.centroids is None
+                                             or count >= RETRAIN_GROWTH * self.meta["trained_count"]):
+                self.train()
+            elif len(self._lists) - self._sorted_count > TAIL_MAX:
+                self._sort_lists()
+            return count
+
+    def train(self, nlist=None, seed=0):
+        """(Re)build the IVF index: k-means on a sample, then assign every vector."""
+        with self._file_lock():
+            self._refresh()
+            count = self.meta["count"]
+            nlist = min(nlist or default_nlist(count), count)
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(count, min(count, max(TRAIN_SAMPLE, 40 * nlist)), replace=False))
+            centroids = kmeans(self._vectors[sample].astype(np.float32), nlist, seed=seed)
+            lists = nearest_centroids(self._vectors, centroids)[:, 0]
+
+            np.save(self._path(CENTROIDS_NAME), centroids)
+            lists.tofile(self._path(LISTS_NAME))
+            self.centroids, self._lists = centroids, lists
+            self.meta.update(nlist=int(nlist), trained_count=count)
+            self._commit()
+            self._sort_lists()
+
+    def _candidates(self, query, nprobe):
+        """Rows to score for one query: everything, or the rows of its nprobe closest lists."""
+        if nprobe is None or self.centroids is None or len(self._vectors) <= BRUTE_FORCE_MAX:
+            return None
+        probes = nearest_centroids(query[None], self.centroids, min(nprobe, len(self.centroids)))[0]
+        rows = [self._order[self._offsets[p]:self._offsets[p + 1]] for p in probes]
+        tail = np.arange(self._sorted_count, len(self._lists), dtype=np.int32)
+        if len(tail):
+            rows.append(tail[np.isin(self._lists[tail], probes)])
+        return np.sort(np.concatenate(rows))
+
+    def _scores(self, query, rows):
+        if rows is None and self._dense is not None:
+            count = len(self._vectors)
+            return np.arange(count), self._dense[:count] @ query
+        if rows is None:
+            scores = np.empty(len(self._vectors), dtype=np.float32)
+            for start in range(0, len(self._vectors), CHUNK_ROWS):
+                scores[start:start + CHUNK_ROWS] = self._vectors[start:start + CHUNK_ROWS].astype(np.float32) @ query
+            return np.arange(len(scores)), scores
+        return rows, self._vectors[rows].astype(np.float32) @ query
+
+    def search(self, queries, k=5, nprobe=NPROBE):
+        """Top-k SKUs per query: lists of {"sku", "score", "source"}, best first.
+
+        Several images of one animal count once, with their best score.
+        `nprobe=None` always scans every vector (exact search).
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        results = []
+        for query in queries:
+            with self._lock:
+                rows = self._candidates(query, nprobe)
+                rows, scores = self._scores(query, rows)
+                codes = self._sku_codes[rows]
+            if not len(scores):
+                results.append([])
+                continue
+            # Enough of the best rows to cover k distinct SKUs in all but odd cases
+            take = min(len(scores), k * 16)
+            top = np.argpartition(-scores, take - 1)[:take] if take < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            matches, seen = [], set()
+            for i in top:
+                code = codes[i]
+                if code in seen:
+                    continue
+                seen.add(code)
+                matches.append({"sku": self._skus[code], "score": round(float(scores[i]), 4),
+                                "source": self._sources[rows[i]] or None})
+                if len(matches) == k:
+                    break
+            results.append(matches)
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {"vectors": len(self), "skus": self.skus, "dim": self.dim,
+                    "ivf_lists": self.meta["nlist"], "trained_on": self.meta["trained_count"],
+                    "search": "ivf" if self.centroids is not None and len(self) > BRUTE_FORCE_MAX else "exact",
+                    "nprobe": NPROBE,
+                    "bytes_on_disk": sum(os.path.getsize(self._path(n)) for n in os.listdir(self.directory)
+                                         if os.path.isfile(self._path(n)))}
@@ -0,0 +1,101 @@
+"""Animal embeddings from a trained stage backbone, and enrollment into the
+re-identification index (scripts/embedding_index.py).
+
+The embedding is the pooled MobileNetV2 feature (1280-d) of a trained stage
+model, by default the fine-tuned cattle breed model
+(FARMVISION_EMBED_HEAD=stage1|cattle_breed|buffalo_breed). It is served by a
+CompiledPredictor like the stage models, always with the keras backend.
+
+Enrollment reads a folder per SKU (the `sku` column of models/dataset.csv)
+and only embeds images that aren't in the index yet, so it can be re-run as
+new photos arrive:
+
+    animals/
+        BLF 2340/ img1.jpg img2.jpg ...
+        BLF 2342/ ...
+
+Usage (from the project root):
+    python scripts/embeddings.py animals/ [--index models/embedding_index] [--batch-size 64] [--train]
+"""
+import argparse
+import csv
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tensorflow as tf
+from tensorflow.keras.layers import GlobalAveragePooling2D
+
+from batch_infer import prefetched_batches
+from embedding_index import EmbeddingIndex
+from inference import BATCH_BUCKETS, CompiledPredictor, load_keras_model
+from multihead import BASE_DIR, STAGES, stage_model_path
+from preprocessing import list_directory
+
+EMBED_HEAD = os.environ.get("FARMVISION_EMBED_HEAD", "cattle_breed")
+INDEX_DIR = os.environ.get("FARMVISION_INDEX_DIR", os.path.join(BASE_DIR, "models", "embedding_index"))
+DATASET_PATH = os.path.join(BASE_DIR, "models", "dataset.csv")
+
+
+def load_embedder(head=EMBED_HEAD, buckets=BATCH_BUCKETS):
+    """Predictor mapping a (N, 224, 224, 3) batch to pooled backbone features."""
+    model, source = load_keras_model(STAGES[head][0], stage_model_path(head))
+    if not isinstance(model, tf.keras.Model):
+        # The SavedModel export only has the classifier output
+        source = stage_model_path(head)
+        model = tf.keras.models.load_model(source, compile=False)
+    pool = next(layer for layer in model.layers if isinstance(layer, GlobalAveragePooling2D))
+    features = tf.keras.Model(model.inputs, pool.output)
+    predictor = CompiledPredictor(features, buckets=buckets)
+    predictor.source = source
+    predictor.dim = int(features.output_shape[-1])
+    return predictor
+
+
+def known_skus(dataset_path=DATASET_PATH):
+    with open(dataset_path, "r", newline="") as f:
+        return {row["sku"] for row in csv.DictReader(f)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed images per SKU folder into the re-identification index.")
+    parser.add_argument("images", help="directory with one folder of images per SKU")
+    parser.add_argument("--index", default=INDEX_DIR)
+    parser.add_argument("--head", default=EMBED_HEAD, choices=list(STAGES))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode threads")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches queued for decoding ahead of inference")
+    parser.add_argument("--train", action="store_true", help="rebuild the IVF lists after enrolling")
+    args = parser.parse_args()
+
+    filepaths, labels, class_indices = list_directory(args.images)
+    skus = sorted(class_indices, key=class_indices.get)
+    sku_of = {path: skus[i] for path, i in zip(filepaths, labels)}
+    if os.path.exists(DATASET_PATH):
+        unknown = set(skus) - known_skus()
+        if unknown:
+            print(f"⚠️ {len(unknown)} SKU folders are not in {DATASET_PATH}, e.g. {sorted(unknown)[:3]}")
+
+    embed = load_embedder(args.head, tuple(sorted(set(BATCH_BUCKETS) | {args.batch_size})))
+    index = EmbeddingIndex(args.index, dim=embed.dim)
+    done = index.sources()
+    todo = [path for path in filepaths if path not in done]
+    print(f"{len(filepaths):,} images of {len(skus):,} SKUs; {len(todo):,} new "
+          f"(index has {len(index):,} vectors)")
+
+    start = time.perf_counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for _, batch, ok_paths, errors in prefetched_batches(todo, args.batch_size, pool, args.prefetch):
+            failed += len(errors)
+            if ok_paths:
+                index.add(embed(batch), [sku_of[p] for p in ok_paths], ok_paths)
+    if args.train and len(index):
+        index.train()
+    elapsed = time.perf_counter() - start
+    print(f"✅ Embedded {len(todo) - failed:,} images in {elapsed:.1f}s ({failed} unreadable); "
+          f"index: {index.stats()}")
+
+
+if __name__ == "__main__":
+    main()
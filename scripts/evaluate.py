@@ -0,0 +1,336 @@
+"""Batched evaluation of one stage, or the whole cascade, on the full val split.
+
+Images are decoded on a thread pool a few batches ahead of inference (or
+streamed from the pre-resized shards when the split has them) and run through
+the model in large batches. Reports accuracy, per-class precision/recall/F1,
+the confusion matrix, throughput and per-batch inference latency, and writes
+them as JSON so model versions can be compared.
+
+The cascade is scored end to end on data_stage1/val/non_cattle (expected
+"non_cattle"), data_stage2/val ("cattle/<breed>") and data_stage3/val
+("buffalo/<breed>").
+
+With --gate, stage 1 and the cascade are scored behind the low-res early-exit
+gate (scripts/cascade.py) and also without it on the same batches. The report
+gains an "early_exit" section with the exit/escalation rates, the accuracy
+cost and the measured compute saved; for stage 1 it also sweeps the
+thresholds, so they can be picked from one run. Throughput then covers both
+runs.
+
+Usage (from the project root):
+    python scripts/evaluate.py --stage 1|2|3|cascade [--batch-size 128] [--output reports/eval_1.json]
+                               [--baseline reports/eval_1_prev.json] [--tag v2]
+    python scripts/evaluate.py --stage 1|cascade --gate [--gate-size 128] [--reject 0.9] [--accept 0.98]
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batch_infer import prefetched_batches
+from cascade import GATE_ACCEPT, GATE_DECISIONS, GATE_REJECT, GATE_SIZE, Stage1Gate, gate_decisions, gate_model_name
+from inference import BACKEND, BATCH_BUCKETS, load_predictor
+from multihead import BASE_DIR, HEAD_NAMES, STAGES, load_class_names, stage_model_path
+from preprocessing import list_directory, normalize
+from shards import ShardReader, index_path
+
+STAGE_HEADS = {"1": "stage1", "2": "cattle_breed", "3": "buffalo_breed"}
+SWEEP_REJECT = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+SWEEP_ACCEPT = (0.9, 0.95, 0.98, 0.99, 1.01)
+
+
+def val_dir(head):
+    return os.path.join(BASE_DIR, STAGES[head][2], "val")
+
+
+def iter_split(split_dir, batch_size, pool, prefetch, label_fn=str, classes=None):
+    """(float32 batch, true labels, unreadable count) over a val split.
+
+    `classes` restricts the split to those class folders; `label_fn` maps a
+    class name to the label it is scored against.
+    """
+    if os.path.exists(index_path(split_dir)):
+        reader = ShardReader(split_dir)
+        for pixels, labels, _ in reader.iter_batches(batch_size):
+            names = [reader.classes[i] for i in labels]
+            keep = [i for i, name in enumerate(names) if classes is None or name in classes]
+            if keep:
+                yield normalize(pixels[keep]), [label_fn(names[i]) for i in keep], 0
+        return
+
+    filepaths, labels, class_indices = list_directory(split_dir)
+    names = sorted(class_indices, key=class_indices.get)
+    label_of = {path: names[i] for path, i in zip(filepaths, labels)
+                if classes is None or names[i] in classes}
+    for _, batch, ok_paths, errors in prefetched_batches(list(label_of), batch_size, pool, prefetch):
+        yield batch, [label_fn(label_of[p]) for p in ok_paths], len(errors)
+
+
+def stage_evaluator(head, backend, batch_size):
+    """(batches to score, predict function) for a single stage."""
+    name = STAGES[head][0]
+    buckets = tuple(sorted(set(BATCH_BUCKETS) | {batch_size}))
+    keras_path = stage_model_path(head) if backend == "keras" else None
+    predict = load_predictor(name, backend, keras_path=keras_path, buckets=buckets)
+    class_names = load_class_names()[HEAD_NAMES.index(head)]
+
+    def classify(x):
+        return [class_names[i] for i in np.argmax(predict(x), axis=1)]
+
+    return [(val_dir(head), {})], classify
+
+
+def load_gate(batch_size, size, reject, accept):
+    buckets = tuple(sorted(set(BATCH_BUCKETS) | {batch_size}))
+    predict = load_predictor(gate_model_name(size), "keras", buckets=buckets)
+    class_names = load_class_names()[0]
+    return Stage1Gate(predict, {name: i for i, name in enumerate(class_names)}, size, reject, accept)
+
+
+def gated_stage1_evaluator(batch_size, gate, stats):
+    """Stage 1 behind the gate; the full-res detector also runs on every batch
+    so `stats` can compare the two."""
+    buckets = tuple(sorted(set(BATCH_BUCKETS) | {batch_size}))
+    keras_path = stage_model_path("stage1") if BACKEND == "keras" else None
+    full = load_predictor("cattle_detector", BACKEND, keras_path=keras_path, buckets=buckets)
+    class_names = load_class_names()[0]
+
+    def classify(x):
+        t0 = time.perf_counter()
+        full_preds = full(x)
+        t1 = time.perf_counter()
+        preds, _, _, escalate = gate(x)
+        stats["low_preds"].append(preds.copy())
+        t2 = time.perf_counter()
+        if len(escalate):
+            preds[escalate] = full(x[escalate])
+        t3 = time.perf_counter()
+        stats["full_s"] += t1 - t0
+        stats["gated_s"] += t3 - t1
+        stats["escalated_s"] += t3 - t2
+        stats["full_preds"].append(full_preds)
+        stats["ungated"].extend(class_names[i] for i in np.argmax(full_preds, axis=1))
+        return [class_names[i] for i in np.argmax(preds, axis=1)]
+
+    return [(val_dir("stage1"), {})], classify
+
+
+def cascade_evaluator(gate=None, stats=None):
+    # Loads the models (per-stage or combined, per FARMVISION_BACKEND / USE_COMBINED_MODEL)
+    from pipeline import classify_batch
+
+    def labels(results):
+        return ["non_cattle" if r["stage1_label"] == "non_cattle" else f"{r['stage1_label']}/{r['breed']}"
+                for r in results]
+
+    def classify(x):
+        if gate is None:
+            return labels(classify_batch(x))
+        t0 = time.perf_counter()
+        stats["ungated"].extend(labels(classify_batch(x, gate=None)))
+        t1 = time.perf_counter()
+        gated = labels(classify_batch(x, gate=gate))
+        stats["full_s"] += t1 - t0
+        stats["gated_s"] += time.perf_counter() - t1
+        return gated
+
+    sources = [
+        (val_dir("stage1"), {"classes": {"non_cattle"}}),
+        (val_dir("cattle_breed"), {"label_fn": lambda breed: f"cattle/{breed}"}),
+        (val_dir("buffalo_breed"), {"label_fn": lambda breed: f"buffalo/{breed}"}),
+    ]
+    return sources, classify
+
+
+def classification_report(y_true, y_pred):
+    """Accuracy, per-class precision/recall/F1 and the confusion matrix
+    (rows: true label, columns: predicted label)."""
+    labels = sorted(set(y_true)) + sorted(set(y_pred) - set(y_true))
+    index = {label: i for i, label in enumerate(labels)}
+    matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    np.add.at(matrix, ([index[y] for y in y_true], [index[y] for y in y_pred]), 1)
+
+    tp = np.diag(matrix)
+    predicted, support = matrix.sum(axis=0), matrix.sum(axis=1)
+    precision = np.divide(tp, predicted, out=np.zeros(len(labels)), where=predicted > 0)
+    recall = np.divide(tp, support, out=np.zeros(len(labels)), where=support > 0)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(labels)),
+                   where=(precision + recall) > 0)
+    return {
+        "accuracy": float(tp.sum() / max(matrix.sum(), 1)),
+        "per_class": {label: {"precision": round(float(precision[i]), 4), "recall": round(float(recall[i]), 4),
+                              "f1": round(float(f1[i]), 4), "support": int(support[i])}
+                      for i, label in enumerate(labels)},
+        "confusion_matrix": {"labels": labels, "matrix": matrix.tolist()},
+    }
+
+
+def threshold_sweep(low_preds, full_preds, y_true, class_names, gate_s, full_s):
+    """Accuracy and estimated compute per (reject, accept) pair, from the
+    low-res and full-res stage-1 outputs of one run. The gated cost is the
+    gate's time plus the full detector's per-image time for every escalated
+    image, relative to the full detector on everything."""
+    class_indices = {name: i for i, name in enumerate(class_names)}
+    truth = np.array([class_indices[y] for y in y_true])
+    low_idx, full_idx = np.argmax(low_preds, axis=1), np.argmax(full_preds, axis=1)
+    full_accuracy = float(np.mean(full_idx == truth))
+    sweep = []
+    for reject in SWEEP_REJECT:
+        for accept in SWEEP_ACCEPT:
+            _, _, escalate = gate_decisions(low_preds, class_indices, reject, accept)
+            pred = low_idx.copy()
+            pred[escalate] = full_idx[escalate]
+            accuracy = float(np.mean(pred == truth))
+            cost = (gate_s + full_s * len(escalate) / len(truth)) / full_s
+            sweep.append({"reject": reject, "accept": accept, "escalate_rate": round(len(escalate) / len(truth), 4),
+                          "accuracy": round(accuracy, 4), "accuracy_cost": round(full_accuracy - accuracy, 4),
+                          "compute_saved": round(1 - cost, 4)})
+    return sweep
+
+
+def early_exit_report(gate, stats, y_true, y_pred, stage):
+    n = len(y_true)
+    full_accuracy = float(np.mean([a == b for a, b in zip(stats["ungated"], y_true)])) if n else 0.0
+    gated_accuracy = float(np.mean([a == b for a, b in zip(y_pred, y_true)])) if n else 0.0
+    report = {
+        "gate_model": gate_model_name(gate.size),
+        "size": gate.size,
+        "reject": gate.reject,
+        "accept": gate.accept,
+        **{f"{decision}_rate": round(gate.counts[decision] / max(n, 1), 4) for decision in GATE_DECISIONS},
+        "accuracy_full": round(full_accuracy, 4),
+        "accuracy_gated": round(gated_accuracy, 4),
+        "accuracy_cost": round(full_accuracy - gated_accuracy, 4),
+        "seconds_full": round(stats["full_s"], 3),
+        "seconds_gated": round(stats["gated_s"], 3),
+        "compute_saved": round(1 - stats["gated_s"] / stats["full_s"], 4) if stats["full_s"] else None,
+        # Pixels (roughly FLOPs) of one gate pass relative to a full-res pass
+        "gate_pixel_ratio": round((gate.size / 224) ** 2, 4),
+    }
+    if stage == "1" and stats["low_preds"]:
+        report["sweep"] = threshold_sweep(np.concatenate(stats["low_preds"]), np.concatenate(stats["full_preds"]),
+                                          y_true, load_class_names()[0], stats["gated_s"] - stats["escalated_s"],
+                                          stats["full_s"])
+    return report
+
+
+def latency_summary(seconds):
+    ms = np.asarray(seconds) * 1000
+    if not len(ms):
+        return {}
+    return {"mean": round(float(ms.mean()), 3),
+            **{f"p{q}": round(float(np.percentile(ms, q)), 3) for q in (50, 95, 99)},
+            "max": round(float(ms.max()), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a stage or the cascade on the full val split.")
+    parser.add_argument("--stage", choices=["1", "2", "3", "cascade"], required=True)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="decode threads")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches queued for decoding ahead of inference")
+    parser.add_argument("--output", help="JSON report path (default reports/eval_<stage>.json)")
+    parser.add_argument("--baseline", help="earlier JSON report to print differences against")
+    parser.add_argument("--tag", help="free-form label stored in the report, e.g. the model version")
+    parser.add_argument("--gate", action="store_true",
+                        help="score stage 1 / the cascade behind the low-res early-exit gate, against no gate")
+    parser.add_argument("--gate-size", type=int, default=GATE_SIZE)
+    parser.add_argument("--reject", type=float, default=GATE_REJECT,
+                        help="low-res non_cattle confidence that exits at the gate")
+    parser.add_argument("--accept", type=float, default=GATE_ACCEPT,
+                        help="low-res cattle/buffalo confidence that skips the full-res detector")
+    args = parser.parse_args()
+    if args.gate and args.stage not in ("1", "cascade"):
+        parser.error("--gate applies to --stage 1 and --stage cascade")
+
+    gate = None
+    stats = {"full_s": 0.0, "gated_s": 0.0, "escalated_s": 0.0, "ungated": [], "low_preds": [], "full_preds": []}
+    if args.gate:
+        gate = load_gate(args.batch_size, args.gate_size, args.reject, args.accept)
+    if args.stage == "cascade":
+        sources, classify = cascade_evaluator(gate, stats)
+    elif gate is not None:
+        sources, classify = gated_stage1_evaluator(args.batch_size, gate, stats)
+    else:
+        sources, classify = stage_evaluator(STAGE_HEADS[args.stage], BACKEND, args.batch_size)
+
+    y_true, y_pred, batch_times = [], [], []
+    unreadable = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        for split_dir, options in sources:
+            for x, labels, errors in iter_split(split_dir, args.batch_size, pool, args.prefetch, **options):
+                unreadable += errors
+                if not labels:
+                    continue
+                t0 = time.perf_counter()
+                y_pred.extend(classify(x))
+                batch_times.append(time.perf_counter() - t0)
+                y_true.extend(labels)
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "stage": args.stage,
+        "tag": args.tag,
+        "backend": BACKEND,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "data": [split_dir for split_dir, _ in sources],
+        "samples": len(y_true),
+        "unreadable": unreadable,
+        "batch_size": args.batch_size,
+        **classification_report(y_true, y_pred),
+        "throughput": {
+            "images_per_s": round(len(y_true) / elapsed, 2) if elapsed else None,
+            "inference_images_per_s": round(len(y_true) / sum(batch_times), 2) if batch_times else None,
+            "wall_s": round(elapsed, 3),
+        },
+        "batch_latency_ms": latency_summary(batch_times),
+    }
+    if gate is not None:
+        report["early_exit"] = early_exit_report(gate, stats, y_true, y_pred, args.stage)
+
+    print(f"Stage {args.stage}: accuracy {report['accuracy']:.4f} on {len(y_true):,} images "
+          f"({unreadable} unreadable)")
+    for label, m in report["per_class"].items():
+        print(f"  {label:>30}: precision {m['precision']:.4f}  recall {m['recall']:.4f}  support {m['support']}")
+    print(f"Throughput: {report['throughput']['images_per_s']} img/s end to end, "
+          f"{report['throughput']['inference_images_per_s']} img/s inference; "
+          f"batch latency p50 {report['batch_latency_ms'].get('p50')} ms, "
+          f"p99 {report['batch_latency_ms'].get('p99')} ms")
+    if gate is not None:
+        e = report["early_exit"]
+        print(f"Early exit ({e['gate_model']}, reject {e['reject']}, accept {e['accept']}): "
+              f"{e['exit_rate']:.1%} exit, {e['accept_rate']:.1%} accepted, {e['escalate_rate']:.1%} escalated; "
+              f"accuracy {e['accuracy_full']:.4f} -> {e['accuracy_gated']:.4f} ({-e['accuracy_cost']:+.4f}), "
+              f"compute saved {e['compute_saved']}")
+        # Full grid is in the report; show the cheapest settings within 1% accuracy
+        best = sorted((row for row in e.get("sweep", []) if row["accuracy_cost"] <= 0.01),
+                      key=lambda row: -row["compute_saved"])[:5]
+        for row in best:
+            print(f"  reject {row['reject']:.2f} accept {row['accept']:.2f}: escalate {row['escalate_rate']:.1%}, "
+                  f"accuracy {row['accuracy']:.4f} ({-row['accuracy_cost']:+.4f}), "
+                  f"compute saved {row['compute_saved']:.1%}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print(f"vs. {args.baseline} ({baseline.get('tag') or baseline.get('timestamp')}): "
+              f"accuracy {report['accuracy'] - baseline['accuracy']:+.4f}, "
+              f"throughput {(report['throughput']['images_per_s'] or 0) - (baseline['throughput']['images_per_s'] or 0):+.1f} img/s")
+        for label, m in report["per_class"].items():
+            prev = baseline["per_class"].get(label)
+            if prev and abs(m["recall"] - prev["recall"]) >= 0.01:
+                print(f"  {label}: recall {prev['recall']:.4f} -> {m['recall']:.4f}")
+
+    output = args.output or os.path.join(BASE_DIR, "reports", f"eval_{args.stage}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
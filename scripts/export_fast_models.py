@@ -0,0 +1,93 @@
+"""Export the stage models in fast-loading formats and time every format.
+
+Writes, next to each model in models/:
+  * <name>.weights.npz   weights only, set into the architecture built in code
+                          (multihead.build_stage_architecture)
+  * <name>_savedmodel/   SavedModel with a serving signature
+
+and checks both give the same predictions as the original. inference.load_predictor
+(and so the API) then picks the fastest format automatically, as long as the
+export is newer than the .keras/.h5 file. Load times per format are written
+to models/load_report.json.
+
+Usage (from the project root):
+    python scripts/export_fast_models.py [--heads stage1 cattle_breed] [--skip-savedmodel]
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from inference import MODELS_DIR, SavedModelAdapter, fast_model_paths, load_keras_model
+from multihead import HEAD_NAMES, IMG_SIZE, STAGES, build_stage_architecture, stage_model_path
+
+
+def export_savedmodel(model, path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    if hasattr(model, "export"):
+        model.export(path)
+    else:
+        tf.saved_model.save(model, path)
+
+
+def timed_load(fn):
+    start = time.perf_counter()
+    model = fn()
+    return model, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stage models as weights-only and SavedModel.")
+    parser.add_argument("--heads", nargs="+", default=list(HEAD_NAMES), choices=HEAD_NAMES)
+    parser.add_argument("--skip-savedmodel", action="store_true")
+    args = parser.parse_args()
+
+    x = np.random.default_rng(0).random((4,) + IMG_SIZE + (3,), dtype=np.float32)
+    report = {}
+    for head in args.heads:
+        name = STAGES[head][0]
+        source = stage_model_path(head)
+        paths = fast_model_paths(name)
+
+        model, original_s = timed_load(lambda: tf.keras.models.load_model(source, compile=False))
+        expected = model(x, training=False).numpy()
+        report[name] = {"source": source, "load_seconds": {os.path.splitext(source)[1][1:]: round(original_s, 3)}}
+
+        np.savez(paths["weights"], *model.get_weights())
+
+        def from_weights():
+            rebuilt = build_stage_architecture(head)
+            with np.load(paths["weights"]) as weights:
+                rebuilt.set_weights([weights[f"arr_{i}"] for i in range(len(weights.files))])
+            return rebuilt
+
+        rebuilt, weights_s = timed_load(from_weights)
+        if not np.allclose(rebuilt(x, training=False).numpy(), expected, atol=1e-5):
+            os.remove(paths["weights"])
+            raise SystemExit(f"❌ {name}: rebuilt architecture does not match {source}; weights export removed")
+        report[name]["load_seconds"]["weights"] = round(weights_s, 3)
+
+        if not args.skip_savedmodel:
+            export_savedmodel(model, paths["savedmodel"])
+            saved, saved_s = timed_load(lambda: SavedModelAdapter(paths["savedmodel"]))
+            if not np.allclose(saved(tf.constant(x)).numpy(), expected, atol=1e-5):
+                shutil.rmtree(paths["savedmodel"])
+                raise SystemExit(f"❌ {name}: SavedModel predictions differ from {source}; export removed")
+            report[name]["load_seconds"]["savedmodel"] = round(saved_s, 3)
+
+        _, chosen = load_keras_model(name, source)
+        report[name]["served_from"] = chosen
+        times = ", ".join(f"{fmt} {s:.2f}s" for fmt, s in report[name]["load_seconds"].items())
+        print(f"✅ {name}: {times}; serving from {os.path.basename(chosen)}")
+
+    with open(os.path.join(MODELS_DIR, "load_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Export the stage models to TFLite (float32, float16, full-integer int8).
+
+int8 models are calibrated on a sample of data_stage*/val and take uint8
+pixels / produce uint8 probabilities; TFLitePredictor handles the
+(de)quantization. After exporting, every variant is evaluated on the
+validation split and compared against the Keras model so the fastest variant
+within tolerance can be picked.
+
+Usage (from the project root):
+    python scripts/export_tflite.py [--variants float16 int8] [--calibration-images 200]
+                                    [--tolerance 0.01]
+Serve with FARMVISION_BACKEND=tflite-<variant>.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from inference import TFLITE_DIR, TFLITE_VARIANTS, TFLitePredictor, tflite_model_path
+from input_pipeline import split_class_indices
+from multihead import BASE_DIR, HEAD_NAMES, STAGES, load_stage_model
+from preprocessing import list_directory, load_batch
+
+EVAL_BATCH = 32
+
+
+def convert(model, variant, calibration_paths):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if variant == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        def representative_dataset():
+            for path in calibration_paths:
+                yield [load_batch([path])]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.uint8
+        converter.inference_output_type = tf.uint8
+    return converter.convert()
+
+
+def evaluate(predict, items):
+    """Predicted class per item and mean per-image latency (ms)."""
+    preds = []
+    elapsed = 0.0
+    for i in range(0, len(items), EVAL_BATCH):
+        x = load_batch([p for p, _ in items[i:i + EVAL_BATCH]])
+        start = time.perf_counter()
+        probs = predict(x)
+        elapsed += time.perf_counter() - start
+        preds.append(np.argmax(probs, axis=1))
+    return np.concatenate(preds), elapsed * 1000 / max(len(items), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stage models to TFLite and report accuracy drift.")
+    parser.add_argument("--variants", nargs="+", default=list(TFLITE_VARIANTS), choices=TFLITE_VARIANTS)
+    parser.add_argument("--heads", nargs="+", default=list(HEAD_NAMES), choices=HEAD_NAMES)
+    parser.add_argument("--calibration-images", type=int, default=200)
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="max allowed val accuracy drop vs. Keras when recommending a variant")
+    args = parser.parse_args()
+
+    os.makedirs(TFLITE_DIR, exist_ok=True)
+    random.seed(42)
+    report = {}
+
+    for head in args.heads:
+        name, _, data_dir = STAGES[head]
+        model = load_stage_model(head)
+        val_dir = os.path.join(BASE_DIR, data_dir, "val")
+        filepaths, labels, _ = list_directory(val_dir, class_indices=split_class_indices(val_dir))
+        items = list(zip(filepaths, labels))
+        calibration = [p for p, _ in random.sample(items, min(args.calibration_images, len(items)))]
+        labels = np.array([label for _, label in items])
+
+        keras_pred, keras_ms = evaluate(lambda x: model.predict(x, verbose=0), items)
+        keras_acc = float(np.mean(keras_pred == labels))
+        report[name] = {"keras": {"accuracy": keras_acc, "ms_per_image": round(keras_ms, 3)}}
+        print(f"{name} keras: acc {keras_acc:.4f}, {keras_ms:.2f} ms/image")
+
+        for variant in args.variants:
+            path = tflite_model_path(name, variant)
+            with open(path, "wb") as f:
+                f.write(convert(model, variant, calibration))
+
+            pred, ms = evaluate(TFLitePredictor(path), items)
+            acc = float(np.mean(pred == labels))
+            report[name][variant] = {
+                "accuracy": acc,
+                "accuracy_drift": round(acc - keras_acc, 4),
+                "agreement": float(np.mean(pred == keras_pred)),
+                "ms_per_image": round(ms, 3),
+                "size_mb": round(os.path.getsize(path) / 1e6, 2),
+            }
+            print(f"{name} {variant}: acc {acc:.4f} (drift {acc - keras_acc:+.4f}), "
+                  f"{ms:.2f} ms/image, {report[name][variant]['size_mb']} MB -> {path}")
+
+        # Fastest variant whose accuracy stays within tolerance of the Keras model
+        ok = [v for v in args.variants if keras_acc - report[name][v]["accuracy"] <= args.tolerance]
+        report[name]["recommended"] = min(ok, key=lambda v: report[name][v]["ms_per_image"]) if ok else "keras"
+        print(f"✅ {name}: recommended backend tflite-{report[name]['recommended']}"
+              if ok else f"⚠️ {name}: no TFLite variant within tolerance, keep keras")
+
+    with open(os.path.join(TFLITE_DIR, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
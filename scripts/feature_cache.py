@@ -0,0 +1,115 @@
+"""Train a classification head on cached backbone features.
+
+While the MobileNetV2 backbone is frozen, every epoch would push every image
+through it again to get the same pooled features. Instead, the pooled
+features of the train and val splits are computed once (optionally for
+several augmented views of the training images), stored as memory-mapped
+.npy files, and the head layers are trained on those. The head layers are
+the full model's own layer objects, so the full model picks up the trained
+weights and only the fine-tuning phase runs the whole network.
+
+Enable in the training scripts with FEATURE_CACHE=1 (FEATURE_VIEWS=N for N
+augmented views per training image, default 1 = no augmentation).
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import GlobalAveragePooling2D, Input
+from tensorflow.keras.models import Sequential
+
+from input_pipeline import directory_dataset
+
+USE_FEATURE_CACHE = os.environ.get("FEATURE_CACHE", "0") == "1"
+FEATURE_VIEWS = int(os.environ.get("FEATURE_VIEWS", 1))
+FEATURE_CACHE_DIR = os.environ.get("FEATURE_CACHE_DIR", "feature_cache")
+
+
+def _cache_key(filepaths, img_size, views, augment, seed):
+    h = hashlib.sha1()
+    for path in filepaths:
+        st = os.stat(path)
+        h.update(f"{path}|{st.st_size}|{st.st_mtime_ns}\n".encode())
+    h.update(json.dumps([list(img_size), views, augment, seed], sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def cached_features(base_model, directory, img_size=(224, 224), views=1, augment=None, seed=42,
+                    batch_size=64, cache_dir=FEATURE_CACHE_DIR):
+    """(features, labels) memmaps for `directory`; computed once, then reused.
+
+    View 0 is the un-augmented image; views 1..N-1 use `augment`. Rows are
+    ordered view-major: row v * N_images + i is view v of image i.
+    """
+    listing = directory_dataset(directory, img_size, batch_size, shuffle=False, cache_dir=None)
+    n = listing.samples
+    key = _cache_key(listing.filepaths, img_size, views, augment, seed)
+    name = "_".join(os.path.normpath(str(directory)).split(os.sep)[-2:])
+    features_path = os.path.join(cache_dir, f"{name}_{key}_features.npy")
+    labels_path = os.path.join(cache_dir, f"{name}_{key}_labels.npy")
+
+    if not (os.path.exists(features_path) and os.path.exists(labels_path)):
+        os.makedirs(cache_dir, exist_ok=True)
+        extractor = Sequential([base_model, GlobalAveragePooling2D()])
+        dim = extractor.output_shape[-1]
+        tmp_path = features_path + ".tmp.npy"
+        features = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(n * views, dim))
+        for view in range(views):
+            ds = listing if view == 0 else directory_dataset(
+                directory, img_size, batch_size, augment=augment, shuffle=False, seed=seed + view, cache_dir=None)
+            row = view * n
+            for images, _ in ds.dataset:
+                out = extractor(images, training=False).numpy()
+                features[row:row + len(out)] = out
+                row += len(out)
+            print(f"Cached features for {directory}: view {view + 1}/{views}")
+        features.flush()
+        del features
+        np.save(labels_path, np.tile(listing.classes, views))
+        os.replace(tmp_path, features_path)
+
+    return np.load(features_path, mmap_mode="r"), np.load(labels_path, mmap_mode="r")
+
+
+def feature_dataset(features, labels, num_classes, batch_size=32, shuffle=True, seed=42):
+    """Batches gathered from the memmaps on demand, so they never need to fit in memory."""
+    def gather(idx):
+        idx = np.sort(idx)
+        return np.asarray(features[idx], dtype=np.float32), np.asarray(labels[idx], dtype=np.int32)
+
+    ds = tf.data.Dataset.range(len(features))
+    if shuffle:
+        ds = ds.shuffle(len(features), seed=seed, reshuffle_each_iteration=True)
+
+    def load(idx):
+        x, y = tf.numpy_function(gather, [idx], [tf.float32, tf.int32])
+        x.set_shape((None, features.shape[1]))
+        return x, tf.one_hot(y, num_classes)
+
+    return ds.batch(batch_size).map(load, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+
+def fit_head_on_features(base_model, head_layers, train_dir, val_dir, epochs, img_size=(224, 224),
+                         batch_size=32, views=FEATURE_VIEWS, augment=None, optimizer="adam",
+                         class_weight=None, callbacks=None):
+    """Frozen-backbone training phase on cached features; returns the History.
+
+    `head_layers` are the layers after global average pooling in the full
+    model (see multihead.split_at_pooling); they are trained in place.
+    """
+    x_train, y_train = cached_features(base_model, train_dir, img_size, views=views, augment=augment)
+    x_val, y_val = cached_features(base_model, val_dir, img_size)
+    # Works for shard-only splits too (split scripts with --materialize none)
+    num_classes = len(directory_dataset(train_dir, img_size, shuffle=False, cache_dir=None).class_indices)
+
+    head_model = Sequential([Input(shape=(x_train.shape[1],))] + list(head_layers))
+    head_model.compile(optimizer=optimizer, loss="categorical_crossentropy", metrics=["accuracy"])
+    return head_model.fit(
+        feature_dataset(x_train, y_train, num_classes, batch_size),
+        validation_data=feature_dataset(x_val, y_val, num_classes, batch_size, shuffle=False),
+        epochs=epochs,
+        class_weight=class_weight,
+        callbacks=callbacks
+    )
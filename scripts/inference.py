@@ -0,0 +1,222 @@
+"""Low-latency inference for small batches.
+
+`model.predict()` builds a tf.data pipeline and runs the callback machinery on
+every call, which dominates latency for one image. `CompiledPredictor` calls
+the model through a `tf.function` traced once per fixed batch size (inputs are
+zero-padded up to the next bucket), and warms every bucket up front so no live
+request pays the tracing cost. Batches larger than the biggest bucket still go
+through `model.predict()`.
+
+`TFLitePredictor` has the same call interface (and the same buckets, one
+interpreter allocated per bucket) for the models exported by
+scripts/export_tflite.py; `FARMVISION_BACKEND` picks which one is served.
+
+Keras models load from the fastest up-to-date format written by
+scripts/export_fast_models.py: weights only (`<name>.weights.npz`, set into the
+architecture built in code), then a SavedModel (`<name>_savedmodel/`), then
+the .keras/.h5 file itself.
+"""
+import os
+
+import numpy as np
+import tensorflow as tf
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, "models")
+TFLITE_DIR = os.path.join(MODELS_DIR, "tflite")
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+# XLA-compile the traced functions (FARMVISION_XLA=1); worth trying on CPU, not always faster
+USE_XLA = os.environ.get("FARMVISION_XLA", "0") == "1"
+# keras | tflite-float32 | tflite-float16 | tflite-int8
+BACKEND = os.environ.get("FARMVISION_BACKEND", "keras")
+TFLITE_VARIANTS = ("float32", "float16", "int8")
+TFLITE_THREADS = int(os.environ.get("FARMVISION_TFLITE_THREADS", os.cpu_count() or 1))
+# XNNPACK (TFLite's default CPU delegate) is much faster but repacks the weights
+# into private memory; with FARMVISION_TFLITE_XNNPACK=0 the builtin kernels read
+# them straight from the mmapped .tflite file, so forked workers share them
+TFLITE_XNNPACK = os.environ.get("FARMVISION_TFLITE_XNNPACK", "1") == "1"
+# TF thread pools for this process (0 = TF's default, all cores); serve.py sets
+# them per worker so several workers don't oversubscribe the CPU
+INTRA_OP_THREADS = int(os.environ.get("FARMVISION_INTRA_OP_THREADS", 0))
+INTER_OP_THREADS = int(os.environ.get("FARMVISION_INTER_OP_THREADS", 0))
+if INTRA_OP_THREADS:
+    tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+if INTER_OP_THREADS:
+    tf.config.threading.set_inter_op_parallelism_threads(INTER_OP_THREADS)
+
+
+class CompiledPredictor:
+    def __init__(self, model, buckets=BATCH_BUCKETS, jit_compile=USE_XLA, warmup=True):
+        self.model = model
+        self.buckets = tuple(sorted(buckets))
+        self.input_shape = tuple(model.input_shape[1:])
+        self._fn = tf.function(lambda x: model(x, training=False), jit_compile=jit_compile)
+        if warmup:
+            self.warmup()
+
+    def warmup(self):
+        """Trace and run every bucket once with dummy inputs."""
+        for size in self.buckets:
+            self._fn(tf.zeros((size,) + self.input_shape, dtype=tf.float32))
+
+    def _bucket(self, n):
+        return next(size for size in self.buckets if size >= n)
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        n = len(x)
+        if n > self.buckets[-1]:
+            # Large offline batches: predict() pipelines them efficiently
+            return self.model.predict(x, batch_size=self.buckets[-1], verbose=0)
+
+        size = self._bucket(n)
+        if size != n:
+            padded = np.zeros((size,) + x.shape[1:], dtype=np.float32)
+            padded[:n] = x
+            x = padded
+        outputs = self._fn(tf.constant(x))
+        return tf.nest.map_structure(lambda t: t.numpy()[:n], outputs)
+
+
+def tflite_model_path(name, variant):
+    """Path of an exported model, e.g. ("cattle_detector", "int8")."""
+    return os.path.join(TFLITE_DIR, f"{name}_{variant}.tflite")
+
+
+def tflite_variant(backend=BACKEND):
+    if not backend.startswith("tflite-") or backend[len("tflite-"):] not in TFLITE_VARIANTS:
+        raise ValueError(f"Unknown TFLite backend {backend!r}, expected one of "
+                         + ", ".join(f"tflite-{v}" for v in TFLITE_VARIANTS))
+    return backend[len("tflite-"):]
+
+
+class TFLitePredictor:
+    """Runs an exported .tflite model; (de)quantizes inputs/outputs as needed.
+
+    Resizing an interpreter reallocates all of its tensors, so every bucket
+    gets its own interpreter, allocated once up front; inputs are zero-padded
+    up to the next bucket and larger batches run through the biggest bucket in
+    chunks. With XNNPACK each of them packs its own copy of the weights.
+    """
+
+    def __init__(self, model_path, num_threads=TFLITE_THREADS, xnnpack=TFLITE_XNNPACK, buckets=BATCH_BUCKETS):
+        self.model_path = model_path
+        self.buckets = tuple(sorted(buckets))
+        resolver = tf.lite.experimental.OpResolverType
+        self._interpreters = {}
+        for size in self.buckets:
+            interpreter = tf.lite.Interpreter(
+                model_path=model_path, num_threads=num_threads,
+                experimental_op_resolver_type=resolver.AUTO if xnnpack else resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+            self._input = interpreter.get_input_details()[0]
+            interpreter.resize_tensor_input(self._input["index"], (size,) + tuple(self._input["shape"][1:]))
+            interpreter.allocate_tensors()
+            self._interpreters[size] = interpreter
+        self._outputs = interpreter.get_output_details()
+        self.input_shape = tuple(self._input["shape"][1:])
+        self._padded = {size: np.zeros((size,) + self.input_shape, dtype=self._input["dtype"])
+                        for size in self.buckets}
+
+    def _bucket(self, n):
+        return next(size for size in self.buckets if size >= n)
+
+    def _run(self, x):
+        n = len(x)
+        size = self._bucket(n)
+        interpreter = self._interpreters[size]
+        if size != n:
+            padded = self._padded[size]
+            padded[:n] = x
+            x = padded
+        interpreter.set_tensor(self._input["index"], x)
+        interpreter.invoke()
+        # get_tensor copies, so the slices don't alias the interpreter's buffers
+        return [interpreter.get_tensor(detail["index"])[:n] for detail in self._outputs]
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        dtype = self._input["dtype"]
+        if dtype != np.float32:
+            # Full-integer model: quantize with the input's scale/zero point
+            scale, zero_point = self._input["quantization"]
+            info = np.iinfo(dtype)
+            x = np.clip(np.round(x / scale + zero_point), info.min, info.max).astype(dtype)
+
+        largest = self.buckets[-1]
+        chunks = [self._run(x[i:i + largest]) for i in range(0, len(x), largest)]
+        outputs = []
+        for i, detail in enumerate(self._outputs):
+            y = np.concatenate([chunk[i] for chunk in chunks]) if len(chunks) > 1 else chunks[0][i]
+            if detail["dtype"] != np.float32:
+                scale, zero_point = detail["quantization"]
+                y = (y.astype(np.float32) - zero_point) * scale
+            outputs.append(y)
+        return outputs[0] if len(outputs) == 1 else outputs
+
+
+class SavedModelAdapter:
+    """The parts of the Keras model interface CompiledPredictor uses, on top of
+    a SavedModel's serving signature."""
+
+    def __init__(self, path):
+        self._loaded = tf.saved_model.load(path)
+        self._fn = self._loaded.signatures["serving_default"]
+        (self._input_name, spec), = self._fn.structured_input_signature[1].items()
+        self.input_shape = tuple(spec.shape)
+
+    def __call__(self, x, training=False):
+        outputs = self._fn(**{self._input_name: x})
+        outputs = [outputs[key] for key in sorted(outputs)]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    def predict(self, x, batch_size=32, verbose=0):
+        return np.concatenate([self(tf.constant(x[i:i + batch_size])).numpy()
+                               for i in range(0, len(x), batch_size)])
+
+
+def fast_model_paths(name):
+    """Where scripts/export_fast_models.py writes the fast-loading formats."""
+    base = os.path.join(MODELS_DIR, name)
+    return {"weights": base + ".weights.npz", "savedmodel": base + "_savedmodel"}
+
+
+def load_keras_model(name, keras_path=None):
+    """(model, path it was loaded from), using the fastest format that is at
+    least as new as `keras_path` (default models/<name>.keras)."""
+    keras_path = keras_path or os.path.join(MODELS_DIR, name + ".keras")
+    source_mtime = os.path.getmtime(keras_path) if os.path.exists(keras_path) else 0
+
+    def fresh(path):
+        return os.path.exists(path) and os.path.getmtime(path) >= source_mtime
+
+    paths = fast_model_paths(name)
+    from multihead import build_stage_architecture, head_for_model
+    head = head_for_model(name)
+    if head is not None and fresh(paths["weights"]):
+        model = build_stage_architecture(head)
+        with np.load(paths["weights"]) as weights:
+            model.set_weights([weights[f"arr_{i}"] for i in range(len(weights.files))])
+        return model, paths["weights"]
+    if fresh(paths["savedmodel"]):
+        return SavedModelAdapter(paths["savedmodel"]), paths["savedmodel"]
+    # compile=False: no optimizer/metrics to restore for inference
+    return tf.keras.models.load_model(keras_path, compile=False), keras_path
+
+
+def load_predictor(name, backend=BACKEND, keras_path=None, buckets=BATCH_BUCKETS):
+    """Predictor for one stage model under the selected backend.
+
+    `name` is the model's base name in models/ (e.g. "cattle_detector");
+    `keras_path` overrides which Keras file is loaded for the keras backend
+    and `buckets` the batch sizes it is compiled for. The predictor's
+    `source` is the file it was loaded from.
+    """
+    if backend == "keras":
+        model, source = load_keras_model(name, keras_path)
+        predictor = CompiledPredictor(model, buckets=buckets)
+    else:
+        source = tflite_model_path(name, tflite_variant(backend))
+        predictor = TFLitePredictor(source, buckets=buckets)
+    predictor.source = source
+    return predictor
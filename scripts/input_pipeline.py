@@ -0,0 +1,248 @@
+"""tf.data input pipeline replacing ImageDataGenerator.flow_from_directory.
+
+Images are decoded, resized and augmented in parallel inside the tf.data
+runtime instead of single-threaded Python, optionally cached to disk as
+decoded uint8 224x224 images, and prefetched while the model trains.
+Shuffling and augmentation are seeded, so two runs with the same seed see
+the same batches.
+
+The augmentation follows ImageDataGenerator.random_transform: one affine
+transform (rotation, shift, shear, zoom; bilinear, `fill_mode="nearest"`),
+then channel shift, horizontal flip and brightness, then rescaling to [0, 1].
+Class indices, `classes` and the number of steps match flow_from_directory.
+
+With DATA_SHARDS=1, splits that have pre-resized shards (see shards.py) are
+streamed from those instead of decoding the JPEGs.
+
+When the split's parent has a class_indices.json (written by
+split_manifest.py), labels follow it instead of the folders of that split, so
+train and val always agree.
+"""
+import json
+import math
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from preprocessing import list_directory
+from shards import ShardReader, index_path, parse_example
+from split_manifest import CLASS_INDICES_NAME
+
+AUTOTUNE = tf.data.AUTOTUNE
+# Set INPUT_CACHE_DIR to cache decoded/resized images on disk between epochs and runs
+CACHE_DIR = os.environ.get("INPUT_CACHE_DIR")
+SHUFFLE_BUFFER = 2048
+# Read splits from data_stageN/shards/<split> when they have been written
+USE_SHARDS = os.environ.get("DATA_SHARDS", "0") == "1"
+# Samples gathered from the npy memmaps per Python call
+SHARD_GATHER = 256
+
+# Augmentation each training script used with ImageDataGenerator
+AUGMENTATION = {
+    "stage1": dict(
+        rotation_range=20,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.3,
+        brightness_range=[0.8, 1.2],
+        channel_shift_range=30.0,
+        horizontal_flip=True,
+    ),
+    "stage2": dict(
+        rotation_range=30,
+        width_shift_range=0.1,
+        height_shift_range=0.1,
+        shear_range=0.1,
+        zoom_range=0.2,
+        brightness_range=[0.8, 1.2],
+        horizontal_flip=True,
+    ),
+    "stage3": dict(
+        rotation_range=30,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True,
+    ),
+}
+
+
+class DirectoryDataset:
+    """A batched tf.data.Dataset over a class-per-folder directory, plus the
+    flow_from_directory attributes the training scripts rely on."""
+
+    def __init__(self, dataset, filepaths, classes, class_indices, batch_size):
+        self.dataset = dataset
+        self.filepaths = filepaths
+        self.classes = classes
+        self.class_indices = class_indices
+        self.samples = len(filepaths)
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return math.ceil(self.samples / self.batch_size)
+
+
+def decode_and_resize(path, img_size):
+    img = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    # Nearest-neighbour, like flow_from_directory's default; keeps uint8
+    img = tf.image.resize(img, img_size, method="nearest")
+    img.set_shape(tuple(img_size) + (3,))
+    return img
+
+
+def _matrix(*values):
+    return tf.reshape(tf.stack([tf.cast(v, tf.float32) for v in values]), (3, 3))
+
+
+def _uniform(seed, index, low, high):
+    return tf.random.stateless_uniform((), seed=tf.stack([seed, tf.constant(index, tf.int64)]),
+                                       minval=low, maxval=high)
+
+
+def augment_fn(img_size, rotation_range=0, width_shift_range=0.0, height_shift_range=0.0,
+               shear_range=0.0, zoom_range=0.0, brightness_range=None, channel_shift_range=0.0,
+               horizontal_flip=False):
+    """Per-image augmentation on float32 pixels in [0, 255], seeded by an int64 scalar."""
+    h, w = img_size
+    zoom_low, zoom_high = 1 - zoom_range, 1 + zoom_range
+
+    def augment(img, seed):
+        theta = np.pi / 180 * _uniform(seed, 0, -rotation_range, rotation_range)
+        tx = _uniform(seed, 1, -height_shift_range, height_shift_range) * h
+        ty = _uniform(seed, 2, -width_shift_range, width_shift_range) * w
+        shear = np.pi / 180 * _uniform(seed, 3, -shear_range, shear_range)
+        zx = _uniform(seed, 4, zoom_low, zoom_high)
+        zy = _uniform(seed, 5, zoom_low, zoom_high)
+
+        # Same composition as keras' apply_affine_transform, in (row, col) coordinates
+        rotation = _matrix(tf.cos(theta), -tf.sin(theta), 0, tf.sin(theta), tf.cos(theta), 0, 0, 0, 1)
+        shift = _matrix(1, 0, tx, 0, 1, ty, 0, 0, 1)
+        shear_m = _matrix(1, -tf.sin(shear), 0, 0, tf.cos(shear), 0, 0, 0, 1)
+        zoom = _matrix(zx, 0, 0, 0, zy, 0, 0, 0, 1)
+        o_x, o_y = h / 2 - 0.5, w / 2 - 0.5
+        offset = _matrix(1, 0, o_x, 0, 1, o_y, 0, 0, 1)
+        reset = _matrix(1, 0, -o_x, 0, 1, -o_y, 0, 0, 1)
+        t = offset @ rotation @ shift @ shear_m @ zoom @ reset
+
+        # ImageProjectiveTransform works in (x=col, y=row) coordinates
+        transform = tf.stack([t[1, 1], t[1, 0], t[1, 2], t[0, 1], t[0, 0], t[0, 2], 0.0, 0.0])
+        img = tf.raw_ops.ImageProjectiveTransformV3(
+            images=img[tf.newaxis], transforms=transform[tf.newaxis], output_shape=tf.constant(img_size),
+            fill_value=0.0, interpolation="BILINEAR", fill_mode="NEAREST")[0]
+
+        if channel_shift_range:
+            intensity = _uniform(seed, 6, -channel_shift_range, channel_shift_range)
+            img = tf.clip_by_value(img + intensity, tf.reduce_min(img), tf.reduce_max(img))
+        if horizontal_flip:
+            img = tf.cond(_uniform(seed, 7, 0.0, 1.0) < 0.5, lambda: tf.reverse(img, axis=[1]), lambda: img)
+        if brightness_range is not None:
+            img = tf.clip_by_value(img * _uniform(seed, 8, *brightness_range), 0.0, 255.0)
+        return img
+
+    return augment
+
+
+def _augment_and_batch(ds, num_classes, img_size, batch_size, augment, seed):
+    """uint8 (image, label) elements -> batched float (images, one-hot labels)."""
+    ds = ds.map(lambda img, y: (tf.cast(img, tf.float32), tf.one_hot(y, num_classes)),
+                num_parallel_calls=AUTOTUNE)
+    if augment:
+        fn = augment_fn(img_size, **augment)
+        seeds = tf.data.Dataset.random(seed=seed)
+        ds = tf.data.Dataset.zip((ds, seeds)).map(lambda xy, s: (fn(xy[0], s), xy[1]),
+                                                  num_parallel_calls=AUTOTUNE)
+    ds = ds.map(lambda img, y: (img / 255.0, y), num_parallel_calls=AUTOTUNE)
+    return ds.batch(batch_size).prefetch(AUTOTUNE)
+
+
+def shard_dataset(location, img_size=(224, 224), batch_size=32, augment=None, shuffle=True, seed=42):
+    """Same as directory_dataset, streamed from the shards of a split."""
+    reader = ShardReader(location)
+    num_classes = len(reader.class_indices)
+    img_size = tuple(img_size)
+
+    if reader.format == "npy":
+        def gather(idx):
+            # Sorted reads are sequential within each memmap
+            return reader.take(np.sort(idx))
+
+        ds = tf.data.Dataset.range(reader.samples)
+        if shuffle:
+            ds = ds.shuffle(reader.samples, seed=seed, reshuffle_each_iteration=True)
+
+        def load(idx):
+            images, labels = tf.numpy_function(gather, [idx], [tf.uint8, tf.int32])
+            images.set_shape((None,) + reader.img_size + (3,))
+            labels.set_shape((None,))
+            return images, labels
+
+        ds = ds.batch(SHARD_GATHER).map(load, num_parallel_calls=AUTOTUNE).unbatch()
+    else:
+        ds = tf.data.Dataset.from_tensor_slices(reader.files)
+        if shuffle:
+            ds = ds.shuffle(len(reader.files), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.interleave(tf.data.TFRecordDataset, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+        ds = ds.map(lambda record: parse_example(record, reader.img_size), num_parallel_calls=AUTOTUNE)
+        if shuffle:
+            ds = ds.shuffle(min(SHUFFLE_BUFFER, reader.samples), seed=seed, reshuffle_each_iteration=True)
+
+    if img_size != reader.img_size:
+        ds = ds.map(lambda img, y: (tf.cast(tf.image.resize(img, img_size, method="nearest"), tf.uint8), y),
+                    num_parallel_calls=AUTOTUNE)
+    ds = _augment_and_batch(ds, num_classes, img_size, batch_size, augment, seed)
+    return DirectoryDataset(ds, list(reader.paths), reader.labels, reader.class_indices, batch_size)
+
+
+def split_class_indices(directory):
+    """The class indices split_manifest.py wrote next to the split `directory`, or None."""
+    path = os.path.join(os.path.dirname(os.path.normpath(str(directory))), CLASS_INDICES_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def directory_dataset(directory, img_size=(224, 224), batch_size=32, augment=None, shuffle=True,
+                      seed=42, cache_dir=CACHE_DIR, use_shards=None, class_indices=None):
+    """Batched (images, one-hot labels) dataset over `directory`.
+
+    `augment` is a dict of ImageDataGenerator-style settings (see
+    AUGMENTATION). With `cache_dir`, decoded uint8 images are cached on disk
+    after the first epoch and later epochs shuffle within SHUFFLE_BUFFER.
+    With `use_shards` (default: DATA_SHARDS) and shards written for
+    `directory`, images come from the shards and `cache_dir` is not needed.
+    `class_indices` (default: the split's class_indices.json, else the
+    folders) fixes the label of each class, e.g. val to the train split's.
+    """
+    if class_indices is None:
+        class_indices = split_class_indices(directory)
+    if use_shards is None:
+        use_shards = USE_SHARDS
+    if use_shards and os.path.exists(index_path(directory)):
+        ds = shard_dataset(directory, img_size, batch_size, augment, shuffle, seed)
+        if class_indices is not None and ds.class_indices != class_indices:
+            raise ValueError(f"Shards of {directory} were written with other class indices; rewrite them")
+        return ds
+
+    filepaths, labels, class_indices = list_directory(directory, class_indices=class_indices)
+    num_classes = len(class_indices)
+    img_size = tuple(img_size)
+
+    ds = tf.data.Dataset.from_tensor_slices((filepaths, labels))
+    if shuffle and not cache_dir:
+        # Cheap full shuffle of the file list before decoding
+        ds = ds.shuffle(len(filepaths), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.map(lambda p, y: (decode_and_resize(p, img_size), y), num_parallel_calls=AUTOTUNE)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        name = "_".join(os.path.normpath(str(directory)).split(os.sep)[-3:])
+        ds = ds.cache(os.path.join(cache_dir, f"{name}_{img_size[0]}x{img_size[1]}"))
+        if shuffle:
+            ds = ds.shuffle(min(SHUFFLE_BUFFER, len(filepaths)), seed=seed, reshuffle_each_iteration=True)
+
+    ds = _augment_and_batch(ds, num_classes, img_size, batch_size, augment, seed)
+    return DirectoryDataset(ds, filepaths, labels, class_indices, batch_size)
@@ -0,0 +1,315 @@
+"""Load test and latency benchmark for the FastAPI service.
+
+Starts app.py in-process (uvicorn on a free loopback port, so no network or
+GPU is needed) or targets a running server with --url, and sends /predict/
+requests with a configurable mix of cattle, buffalo and non-cattle images:
+
+  * closed loop, `--concurrency N`: N clients each send their next request as
+    soon as the previous one returns;
+  * open loop, `--rate R`: requests start at R per second whether or not
+    earlier ones finished, and latency is measured from the scheduled start
+    (no coordinated omission).
+
+Images come from data_stage1/val/<class> (synthetic JPEGs when the split is
+not there). Every upload gets unique trailing bytes so the response cache
+cannot answer it (--allow-cache-hits to measure the cache too).
+
+Reports p50/p95/p99 latency, throughput and error rate (overall and per
+class) as JSON, and with --baseline exits with status 1 if latency,
+throughput or error rate regressed beyond the tolerances.
+
+Usage (from the project root):
+    python scripts/loadtest.py --concurrency 16 --duration 30 [--mix cattle=0.5,buffalo=0.25,non_cattle=0.25]
+    python scripts/loadtest.py --rate 40 --baseline loadtest_baseline.json [--save-baseline]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+import httpx
+import numpy as np
+
+from preprocessing import VALID_EXTS
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data_stage1", "val")
+CLASSES = ("cattle", "buffalo", "non_cattle")
+DEFAULT_MIX = "cattle=0.5,buffalo=0.25,non_cattle=0.25"
+
+
+def parse_mix(text):
+    weights = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in CLASSES:
+            raise argparse.ArgumentTypeError(f"unknown class {name!r} in --mix, expected {CLASSES}")
+        weights[name.strip()] = float(weight)
+    total = sum(weights.values())
+    if total <= 0:
+        raise argparse.ArgumentTypeError("--mix weights must add up to more than 0")
+    return {name: w / total for name, w in weights.items() if w > 0}
+
+
+def synthetic_jpeg(rng, size=(640, 480)):
+    from PIL import Image
+
+    pixels = rng.integers(0, 256, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    img = Image.fromarray(pixels).resize(size, Image.BILINEAR)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def load_images(images_dir, classes, per_class, seed):
+    """Up to `per_class` encoded images per class, kept in memory."""
+    rng = np.random.default_rng(seed)
+    images = {}
+    for cls in classes:
+        class_dir = os.path.join(images_dir, cls)
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(VALID_EXTS)) \
+            if os.path.isdir(class_dir) else []
+        if files:
+            random.Random(seed).shuffle(files)
+            images[cls] = []
+            for name in files[:per_class]:
+                with open(os.path.join(class_dir, name), "rb") as f:
+                    images[cls].append(f.read())
+        else:
+            print(f"⚠️ No images in {class_dir}, using synthetic JPEGs for '{cls}'")
+            images[cls] = [synthetic_jpeg(rng) for _ in range(min(per_class, 16))]
+    return images
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class InProcessServer:
+    """app.py served by uvicorn on a background thread (real HTTP on loopback)."""
+
+    def __init__(self):
+        import uvicorn
+
+        sys.path.insert(0, BASE_DIR)
+        from app import app, models  # starts loading the models in the background
+
+        self.models = models
+
+        self.url = f"http://127.0.0.1:{free_port()}"
+        port = int(self.url.rsplit(":", 1)[1])
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 60
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("In-process server failed to start")
+            time.sleep(0.05)
+        if not self.models.wait(timeout=600):
+            raise RuntimeError(f"Models failed to load: {self.models.status()}")
+        return self.url
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+class Workload:
+    def __init__(self, images, mix, unique, seed):
+        self.images = images
+        self.classes = list(mix)
+        self.weights = [mix[c] for c in self.classes]
+        self.unique = unique
+        self.rng = random.Random(seed)
+
+    def next(self):
+        cls = self.rng.choices(self.classes, self.weights)[0]
+        payload = self.rng.choice(self.images[cls])
+        if self.unique:
+            # Decoders ignore bytes after the end of the image; the cache key changes
+            payload += self.rng.randbytes(16)
+        return cls, payload
+
+
+async def send(client, url, cls, payload, started):
+    try:
+        response = await client.post(url, files={"file": ("image.jpg", payload, "image/jpeg")})
+        status = response.status_code
+    except httpx.HTTPError as exc:
+        status = type(exc).__name__
+    return {"class": cls, "status": status, "start": started, "latency": time.perf_counter() - started}
+
+
+async def closed_loop(client, url, workload, concurrency, duration):
+    records = []
+    end = time.perf_counter() + duration
+
+    async def user():
+        while time.perf_counter() < end:
+            cls, payload = workload.next()
+            records.append(await send(client, url, cls, payload, time.perf_counter()))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return records
+
+
+async def open_loop(client, url, workload, rate, duration):
+    tasks = []
+    start = time.perf_counter()
+    for i in range(int(rate * duration)):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        cls, payload = workload.next()
+        tasks.append(asyncio.create_task(send(client, url, cls, payload, scheduled)))
+    return list(await asyncio.gather(*tasks))
+
+
+def percentiles(seconds):
+    if not seconds:
+        return {}
+    ms = np.asarray(seconds) * 1000
+    return {"mean": round(float(ms.mean()), 2),
+            **{f"p{q}": round(float(np.percentile(ms, q)), 2) for q in (50, 95, 99)},
+            "max": round(float(ms.max()), 2)}
+
+
+def summarize(records, elapsed):
+    ok = [r for r in records if r["status"] == 200]
+    status_codes = {}
+    for r in records:
+        status_codes[str(r["status"])] = status_codes.get(str(r["status"]), 0) + 1
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else 0.0,
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": percentiles([r["latency"] for r in ok]),
+        "status_codes": status_codes,
+        "per_class": {cls: {"requests": sum(1 for r in records if r["class"] == cls),
+                            "latency_ms": percentiles([r["latency"] for r in ok if r["class"] == cls])}
+                      for cls in CLASSES if any(r["class"] == cls for r in records)},
+    }
+
+
+def regressions(result, baseline, tolerance, max_error_rate):
+    """Human-readable list of metrics that regressed against `baseline`."""
+    found = []
+    for q in ("p50", "p95", "p99"):
+        now, before = result["latency_ms"].get(q), baseline["latency_ms"].get(q)
+        if now is not None and before and now > before * (1 + tolerance):
+            found.append(f"{q} latency {before:.1f} -> {now:.1f} ms (+{now / before - 1:.0%})")
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        found.append(f"throughput {baseline['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} req/s")
+    if result["error_rate"] > max(baseline["error_rate"], max_error_rate):
+        found.append(f"error rate {baseline['error_rate']:.2%} -> {result['error_rate']:.2%}")
+    return found
+
+
+async def run(url, workload, args):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        predict_url = url.rstrip("/") + "/predict/"
+        load = (lambda d: open_loop(client, predict_url, workload, args.rate, d)) if args.rate \
+            else (lambda d: closed_loop(client, predict_url, workload, args.concurrency, d))
+        if args.warmup:
+            await load(args.warmup)
+        start = time.perf_counter()
+        records = await load(args.duration)
+        elapsed = time.perf_counter() - start
+
+        server_stats = None
+        try:
+            stats = await client.get(url.rstrip("/") + "/stats/batching")
+            if stats.status_code == 200:
+                server_stats = stats.json()
+        except httpx.HTTPError:
+            pass
+    return records, elapsed, server_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the FastAPI service.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=8, help="closed loop: concurrent clients (default)")
+    mode.add_argument("--rate", type=float, help="open loop: requests started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before the run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"default {DEFAULT_MIX}")
+    parser.add_argument("--images-dir", default=DATA_DIR, help="class-per-folder images to send")
+    parser.add_argument("--images-per-class", type=int, default=50)
+    parser.add_argument("--allow-cache-hits", action="store_true", help="send byte-identical repeats")
+    parser.add_argument("--url", help="target a running server instead of starting app.py in-process")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout (s)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(BASE_DIR, "reports", "loadtest.json"))
+    parser.add_argument("--baseline", help="baseline JSON to compare against (exit 1 on regression)")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed relative latency increase / throughput drop vs. the baseline")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    images = load_images(args.images_dir, list(args.mix), args.images_per_class, args.seed)
+    workload = Workload(images, args.mix, unique=not args.allow_cache_hits, seed=args.seed)
+
+    if args.url:
+        records, elapsed, server_stats = asyncio.run(run(args.url, workload, args))
+    else:
+        with InProcessServer() as url:
+            records, elapsed, server_stats = asyncio.run(run(url, workload, args))
+
+    result = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.url or "in-process",
+        "mode": {"rate": args.rate} if args.rate else {"concurrency": args.concurrency},
+        "duration_s": args.duration,
+        "mix": args.mix,
+        "cache_hits_allowed": args.allow_cache_hits,
+        **summarize(records, elapsed),
+        "server": server_stats,
+    }
+    lat = result["latency_ms"]
+    print(f"{result['requests']:,} requests in {elapsed:.1f}s: {result['throughput_rps']} req/s, "
+          f"error rate {result['error_rate']:.2%}, p50 {lat.get('p50')} ms, p95 {lat.get('p95')} ms, "
+          f"p99 {lat.get('p99')} ms")
+    for cls, stats in result["per_class"].items():
+        print(f"  {cls:>10}: {stats['requests']:,} requests, p50 {stats['latency_ms'].get('p50')} ms, "
+              f"p99 {stats['latency_ms'].get('p99')} ms")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Baseline saved to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline.get("mode") != result["mode"]:
+            print(f"⚠️ Baseline was run with {baseline.get('mode')}, this run with {result['mode']}")
+        found = regressions(result, baseline, args.tolerance, args.max_error_rate)
+        if found:
+            print("❌ Regressions vs. baseline:")
+            for line in found:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("✅ No regressions vs. baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Combine the three per-stage MobileNetV2 models into one multi-head model.
+
+The backbone runs once per image and all three heads (stage 1 cattle/buffalo/
+non_cattle, stage 2 cattle breed, stage 3 buffalo breed) read the same pooled
+feature. The per-stage models are left untouched so they can still be loaded
+for comparison.
+
+Usage (from the project root):
+    python scripts/multihead.py [--backbone buffalo_breed] [--fit-heads 5]
+
+The heads trained on another stage's backbone are re-fitted on the shared one
+by default (`--fit-heads 0` skips that, e.g. for a quick export to compare).
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import MobileNetV2
+from tensorflow.keras.layers import Dense, Dropout, GlobalAveragePooling2D, Input
+from tensorflow.keras.models import Model, Sequential
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, "models")
+COMBINED_MODEL_PATH = os.path.join(MODELS_DIR, "combined_model.keras")
+
+IMG_SIZE = (224, 224)
+BATCH_SIZE = 32
+
+# Output order of the combined model
+HEAD_NAMES = ("stage1", "cattle_breed", "buffalo_breed")
+
+# Per-stage model, class indices and data directory for every head
+STAGES = {
+    "stage1": ("cattle_detector", "cattle_class_indices.json", "data_stage1"),
+    "cattle_breed": ("breed_classifier", "breed_class_indices.json", "data_stage2"),
+    "buffalo_breed": ("buffalo_breed_classifier", "buffalo_class_indices.json", "data_stage3"),
+}
+
+
+def stage_model_path(head):
+    name = STAGES[head][0]
+    for ext in (".keras", ".h5"):
+        path = os.path.join(MODELS_DIR, name + ext)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No .keras or .h5 model found for {head} ({name}) in {MODELS_DIR}")
+
+
+def load_stage_model(head):
+    return tf.keras.models.load_model(stage_model_path(head))
+
+
+def split_at_pooling(model):
+    """Return (backbone, head_layers) of a per-stage model.
+
+    Works for the functional stage 1 model (MobileNetV2 layers inlined) and the
+    Sequential stage 2/3 models (MobileNetV2 nested as the first layer).
+    """
+    pool_idx = next(i for i, layer in enumerate(model.layers)
+                    if isinstance(layer, GlobalAveragePooling2D))
+    head_layers = model.layers[pool_idx + 1:]
+    if isinstance(model.layers[0], Model):
+        backbone = model.layers[0]
+    else:
+        backbone = Model(model.input, model.layers[pool_idx].input)
+    return backbone, head_layers
+
+
+def build_combined_model(stage_models, backbone_source="buffalo_breed"):
+    """Build the shared-backbone model from the loaded per-stage models.
+
+    `backbone_source` is either one of HEAD_NAMES (reuse that stage's backbone
+    weights) or "imagenet". Stage 3 (buffalo_breed) never unfreezes its
+    backbone, so its weights are the ImageNet ones.
+    """
+    backbone = MobileNetV2(include_top=False, input_shape=IMG_SIZE + (3,),
+                           weights="imagenet" if backbone_source == "imagenet" else None)
+    if backbone_source != "imagenet":
+        source_backbone, _ = split_at_pooling(stage_models[backbone_source])
+        backbone.set_weights(source_backbone.get_weights())
+    backbone.trainable = False
+
+    inputs = Input(shape=IMG_SIZE + (3,))
+    features = GlobalAveragePooling2D(name="pooled_features")(backbone(inputs, training=False))
+
+    outputs = []
+    copied = []
+    for head in HEAD_NAMES:
+        _, head_layers = split_at_pooling(stage_models[head])
+        x = features
+        for layer in head_layers:
+            config = layer.get_config()
+            config["name"] = f"{head}_{layer.name}"
+            clone = layer.__class__.from_config(config)
+            x = clone(x)
+            copied.append((clone, layer))
+        outputs.append(x)
+
+    model = Model(inputs, outputs, name="multihead")
+    for clone, layer in copied:
+        clone.set_weights(layer.get_weights())
+    return model
+
+
+def head_for_model(name):
+    """HEAD_NAMES entry whose per-stage model is called `name`, or None."""
+    return next((head for head, (model_name, _, _) in STAGES.items() if model_name == name), None)
+
+
+def build_stage_architecture(head):
+    """Untrained per-stage model with the exact layer structure the training
+    script builds, so weights saved from the trained model (in get_weights()
+    order) can be set without deserializing the model config."""
+    num_classes = len(load_class_names()[HEAD_NAMES.index(head)])
+    base = MobileNetV2(include_top=False, input_shape=IMG_SIZE + (3,), weights=None)
+    if head == "stage1":
+        x = GlobalAveragePooling2D()(base.output)
+        x = Dropout(0.5)(x)
+        return Model(base.input, Dense(num_classes, activation="softmax")(x))
+    if head == "cattle_breed":
+        return Sequential([base, GlobalAveragePooling2D(), Dropout(0.5), Dense(num_classes, activation="softmax")])
+    return Sequential([base, GlobalAveragePooling2D(), Dropout(0.4), Dense(128, activation="relu"), Dropout(0.4),
+                       Dense(num_classes, activation="softmax")])
+
+
+def head_layers_of(combined_model, head):
+    return [layer for layer in combined_model.layers if layer.name.startswith(head + "_")]
+
+
+def flow(directory, shuffle=False):
+    return ImageDataGenerator(rescale=1./255).flow_from_directory(
+        directory,
+        target_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode="categorical",
+        shuffle=shuffle
+    )
+
+
+def pooled_features(combined_model, directory):
+    """Pooled backbone features and labels for every image in `directory`."""
+    feature_model = Model(combined_model.input, combined_model.get_layer("pooled_features").output)
+    gen = flow(directory)
+    features = feature_model.predict(gen, verbose=1)
+    labels = tf.keras.utils.to_categorical(gen.classes, num_classes=len(gen.class_indices))
+    return features, labels
+
+
+def fit_heads(combined_model, epochs, heads=("stage1", "cattle_breed")):
+    """Re-fit heads on the shared backbone's features.
+
+    Stage 1 and stage 2 heads were trained on top of fine-tuned backbones, so
+    they drift when moved onto the shared one. The head layers are shared with
+    `combined_model`, so fitting them here updates the combined model in place.
+    """
+    for head in heads:
+        data_dir = os.path.join(BASE_DIR, STAGES[head][2])
+        x_train, y_train = pooled_features(combined_model, os.path.join(data_dir, "train"))
+        x_val, y_val = pooled_features(combined_model, os.path.join(data_dir, "val"))
+
+        head_model = Sequential([Input(shape=x_train.shape[1:])] + head_layers_of(combined_model, head))
+        head_model.compile(
+            optimizer=tf.keras.optimizers.Adam(learning_rate=1e-4),
+            loss="categorical_crossentropy",
+            metrics=["accuracy"]
+        )
+        head_model.fit(x_train, y_train, validation_data=(x_val, y_val), epochs=epochs, batch_size=BATCH_SIZE)
+
+
+def compare(combined_model, stage_models):
+    """Val accuracy of the per-stage models vs. the combined heads, plus top-1 agreement."""
+    report = {}
+    for i, head in enumerate(HEAD_NAMES):
+        val_dir = os.path.join(BASE_DIR, STAGES[head][2], "val")
+        if not os.path.isdir(val_dir):
+            print(f"⚠️ Skipping {head}: {val_dir} not found")
+            continue
+        gen = flow(val_dir)
+        stage_pred = np.argmax(stage_models[head].predict(gen, verbose=0), axis=1)
+        combined_pred = np.argmax(combined_model.predict(gen, verbose=0)[i], axis=1)
+        report[head] = {
+            "per_stage_accuracy": float(np.mean(stage_pred == gen.classes)),
+            "combined_accuracy": float(np.mean(combined_pred == gen.classes)),
+            "agreement": float(np.mean(stage_pred == combined_pred)),
+            "images": int(len(gen.classes)),
+        }
+        print(f"{head}: per-stage acc {report[head]['per_stage_accuracy']:.4f} | "
+              f"combined acc {report[head]['combined_accuracy']:.4f} | "
+              f"agreement {report[head]['agreement']:.4f}")
+    return report
+
+
+def load_combined_model(path=COMBINED_MODEL_PATH):
+    return tf.keras.models.load_model(path)
+
+
+def load_class_names():
+    """Index -> class name lists for every head, in HEAD_NAMES order."""
+    names = []
+    for head in HEAD_NAMES:
+        with open(os.path.join(MODELS_DIR, STAGES[head][1]), "r") as f:
+            indices = json.load(f)
+        names.append([name for name, _ in sorted(indices.items(), key=lambda kv: kv[1])])
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the shared-backbone multi-head model.")
+    parser.add_argument("--backbone", default="buffalo_breed", choices=list(HEAD_NAMES) + ["imagenet"],
+                        help="which stage's backbone weights are shared (default: buffalo_breed, i.e. ImageNet)")
+    parser.add_argument("--fit-heads", type=int, default=5, metavar="EPOCHS",
+                        help="epochs to re-fit the heads whose stage used a different backbone (0: skip)")
+    parser.add_argument("--output", default=COMBINED_MODEL_PATH)
+    parser.add_argument("--no-compare", action="store_true", help="skip the validation comparison")
+    args = parser.parse_args()
+
+    stage_models = {head: load_stage_model(head) for head in HEAD_NAMES}
+    combined_model = build_combined_model(stage_models, backbone_source=args.backbone)
+
+    if args.fit_heads:
+        # Stage 3 trained on the plain ImageNet backbone, so its head only needs
+        # re-fitting when another stage's fine-tuned backbone is shared
+        exact = ("imagenet", "buffalo_breed") if args.backbone in ("imagenet", "buffalo_breed") else (args.backbone,)
+        heads = [h for h in HEAD_NAMES if h not in exact]
+        fit_heads(combined_model, args.fit_heads, heads=heads)
+
+    combined_model.save(args.output)
+    per_stage = sum(m.count_params() for m in stage_models.values())
+    print(f"✅ Combined model saved to {args.output}")
+    print(f"Parameters: {combined_model.count_params():,} combined vs {per_stage:,} across per-stage models")
+
+    if not args.no_compare:
+        report = compare(combined_model, stage_models)
+        with open(os.path.splitext(args.output)[0] + "_report.json", "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,120 @@
 import os
+import json
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
+
+from inference import BACKEND, CompiledPredictor, load_predictor
+from cascade import BREED_STAGES, USE_GATE, Stage1Gate, dispatch_breeds, gate_model_name, run_stage1
+from metrics import BATCH_SIZE, count_prediction, timed
+from multihead import COMBINED_MODEL_PATH, load_class_names, load_combined_model
+from preprocessing import preprocess_image
 
 # Paths
 stage1_model_path = "models/stage1_model.h5"
 stage2_model_path = "models/stage2_model.h5"
 stage3_model_path = "models/stage3_model.h5"
 
-# Load models
-stage1_model = tf.keras.models.load_model(stage1_model_path)
-stage2_model = tf.keras.models.load_model(stage2_model_path)
-stage3_model = tf.keras.models.load_model(stage3_model_path)
+# USE_COMBINED_MODEL=1 runs the shared-backbone model (scripts/multihead.py)
+# instead of the per-stage models once it has been exported; check its report
+# (models/combined_model_report.json) before switching.
+# FARMVISION_BACKEND=tflite-<variant> runs the per-stage TFLite exports instead.
+USE_COMBINED_MODEL = (BACKEND == "keras" and os.path.exists(COMBINED_MODEL_PATH)
+                      and os.environ.get("USE_COMBINED_MODEL", "0") == "1")
+
+# Load models (wrapped in warmed-up compiled predictors for low single-image latency)
+if USE_COMBINED_MODEL:
+    combined_predict = CompiledPredictor(load_combined_model())
+else:
+    stage1_predict = load_predictor("cattle_detector", BACKEND, keras_path=stage1_model_path)
+    stage2_predict = load_predictor("breed_classifier", BACKEND, keras_path=stage2_model_path)
+    stage3_predict = load_predictor("buffalo_breed_classifier", BACKEND, keras_path=stage3_model_path)
 
 # Helper function to preprocess image
 def preprocess_img(img_path, target_size=(224, 224)):
-    img = image.load_img(img_path, target_size=target_size)
-    x = image.img_to_array(img)
+    with timed("decode"):
+        x = preprocess_image(img_path, target_size)
     x = np.expand_dims(x, axis=0)
-    x = x / 255.0
     return x
 
-# Stage 1 classes
-stage1_classes = ['cattle', 'buffalo', 'non_cattle']
+# Stage 1 classes, in the index order written by train_stage1.py
+with open("models/cattle_class_indices.json", "r") as f:
+    stage1_class_indices = json.load(f)
+stage1_classes = sorted(stage1_class_indices, key=stage1_class_indices.get)
+
+# Breed names by index for stage 2 (cattle) and stage 3 (buffalo)
+_, cattle_breeds, buffalo_breeds = load_class_names()
+
+# Optional low-res stage-1 early exit (FARMVISION_STAGE1_GATE=1, see scripts/cascade.py);
+# the gate model is always served with the keras backend
+GATE = Stage1Gate(load_predictor(gate_model_name(), "keras"), stage1_class_indices) if USE_GATE else None
+
+# Run the cascade on a preprocessed batch (N, 224, 224, 3). Stage 1 runs on the
+# whole batch (behind the low-res gate when one is given); the cattle and
+# buffalo sub-batches each go to their breed model in one call. Returns one
+# result dict per image, in input order. Stage timings and predicted classes
+# are recorded in scripts/metrics.py (metrics.render()).
+def classify_batch(x, gate=GATE):
+    if USE_COMBINED_MODEL:
+        # One backbone pass; all three heads read the same pooled feature.
+        # Images the gate rejects skip that pass altogether
+        if gate is None:
+            run = np.arange(len(x))
+            with timed("combined"):
+                preds1, preds2, preds3 = combined_predict(x)
+        else:
+            preds1, exits, _, _ = gate(x)
+            run = np.setdiff1d(np.arange(len(x)), exits)
+            preds2 = np.zeros((len(x), len(cattle_breeds)), dtype=np.float32)
+            preds3 = np.zeros((len(x), len(buffalo_breeds)), dtype=np.float32)
+            if len(run):
+                with timed("combined"):
+                    preds1[run], preds2[run], preds3[run] = combined_predict(x[run])
+        if len(run):
+            BATCH_SIZE.observe(len(run), stage="stage1")
+    else:
+        preds1 = run_stage1(x, stage1_predict, gate)
+
+    # Stage 1: classify cattle, buffalo, or non_cattle
+    idx1 = np.argmax(preds1, axis=1)
+    results = [{
+        "stage1_label": stage1_classes[i],
+        "stage1_confidence": float(preds1[row, i]),
+        "breed": None,
+        "breed_confidence": None,
+    } for row, i in enumerate(idx1)]
+
+    # Stage 2 (cattle breed) and stage 3 (buffalo breed) on their sub-batches
+    if USE_COMBINED_MODEL:
+        predict_rows = {"cattle": lambda rows: preds2[rows], "buffalo": lambda rows: preds3[rows]}
+    else:
+        predict_rows = {"cattle": lambda rows: stage2_predict(x[rows]),
+                        "buffalo": lambda rows: stage3_predict(x[rows])}
+    breed_preds = dispatch_breeds(idx1, stage1_class_indices, predict_rows)
+    breed_names = {"cattle": cattle_breeds, "buffalo": buffalo_breeds}
+    for result, p in zip(results, breed_preds):
+        if p is None:
+            continue
+        label = result["stage1_label"]
+        result["breed"] = breed_names[label][int(np.argmax(p))]
+        result["breed_confidence"] = float(np.max(p))
+        count_prediction(BREED_STAGES[label], result["breed"])
+
+    for r in results:
+        count_prediction("stage1", r["stage1_label"])
+    return results
 
 # Pipeline
 def run_pipeline(img_path):
     x = preprocess_img(img_path)
+    result = classify_batch(x)[0]
+    print(f"Stage 1: {result['stage1_label']} ({result['stage1_confidence']:.2f})")
 
-    # Stage 1: classify cattle, buffalo, or non_cattle
-    preds1 = stage1_model.predict(x)
-    pred_idx1 = np.argmax(preds1[0])
-    pred_label1 = stage1_classes[pred_idx1]
-    confidence1 = preds1[0][pred_idx1]
-    print(f"Stage 1: {pred_label1} ({confidence1:.2f})")
-
-    if pred_label1 == 'non_cattle':
-        return
-
-    if pred_label1 == 'cattle':
-        # Stage 2: cattle breed classification
-        preds2 = stage2_model.predict(x)
-        pred_idx2 = np.argmax(preds2[0])
-        confidence2 = preds2[0][pred_idx2]
-        print(f"Stage 2: {pred_idx2} ({confidence2:.2f})")
-    else:
-        # Stage 3: buffalo breed classification
-        preds3 = stage3_model.predict(x)
-        pred_idx3 = np.argmax(preds3[0])
-        confidence3 = preds3[0][pred_idx3]
-        print(f"Stage 3: {pred_idx3} ({confidence3:.2f})")
+    if result["stage1_label"] == "cattle":
+        print(f"Stage 2: {result['breed']} ({result['breed_confidence']:.2f})")
+    elif result["stage1_label"] == "buffalo":
+        print(f"Stage 3: {result['breed']} ({result['breed_confidence']:.2f})")
+    return result
 
 # Example usage
 if __name__ == "__main__":
     test_img = "/Users/pritpatel/Downloads/sahiwal-cow.jpg"  # change path to test
-    run_pipeline(test_img)
\ No newline at end of file
+    run_pipeline(test_img)
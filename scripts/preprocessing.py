@@ -0,0 +1,119 @@
+"""Image decoding and preprocessing shared by the API and every script.
+
+Phone JPEGs are decoded at reduced size (libjpeg DCT scaling via
+`Image.draft`) to the smallest scale that still covers the target size,
+EXIF orientation is applied, the resize happens on uint8 pixels, and
+conversion to float32 and scaling to [0, 1] happen in one pass straight into
+the caller's batch buffer.
+
+Resizing uses nearest-neighbour, like the `flow_from_directory`/`load_img`
+defaults the models were trained with.
+"""
+import io
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+
+IMG_SIZE = (224, 224)
+# Extensions tf.io.decode_image can read too, so every loader sees the same files
+VALID_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+RESAMPLE = Image.NEAREST
+_SCALE = np.float32(1.0 / 255.0)
+
+
+def list_directory(directory, exts=VALID_EXTS, class_indices=None):
+    """(filepaths, labels, class_indices) of a class-per-folder directory, in
+    flow_from_directory order (classes and files sorted).
+
+    With `class_indices` (e.g. the train split's), labels follow that mapping
+    and classes without a folder simply have no files.
+    """
+    directory = str(directory)
+    folders = sorted(d for d in os.listdir(directory)
+                     if not d.startswith(".") and os.path.isdir(os.path.join(directory, d)))
+    if class_indices is None:
+        class_indices = {name: i for i, name in enumerate(folders)}
+    unknown = set(folders) - set(class_indices)
+    if unknown:
+        raise ValueError(f"{directory} has folders that aren't known classes: {sorted(unknown)}")
+    filepaths, labels = [], []
+    for name in folders:
+        idx = class_indices[name]
+        for root, _, files in sorted(os.walk(os.path.join(directory, name))):
+            for f in sorted(files):
+                if f.lower().endswith(exts):
+                    filepaths.append(os.path.join(root, f))
+                    labels.append(idx)
+    return filepaths, np.array(labels, dtype=np.int32), dict(class_indices)
+
+
+def load_image(source, target_size=IMG_SIZE):
+    """Decode a path, file object or bytes to an upright RGB uint8 image of
+    `target_size` (width, height; PIL order)."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        # JPEG only: decode straight at 1/2, 1/4 or 1/8 scale when that's still >= target_size
+        img.draft("RGB", target_size)
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if img.size != target_size:
+            img = img.resize(target_size, RESAMPLE)
+        return img
+
+
+def normalize(pixels, out=None):
+    """uint8 pixels (one image or a batch) -> float32 in [0, 1] in a single
+    pass; written into `out` when given."""
+    if out is None:
+        out = np.empty(pixels.shape, dtype=np.float32)
+    np.multiply(pixels, _SCALE, out=out, dtype=np.float32)
+    return out
+
+
+def downscale(pixels, size):
+    """Nearest-neighbour resize of an (N, H, W, C) batch to (N, size, size, C)
+    by index sampling; works on uint8 or float pixels."""
+    h, w = pixels.shape[1:3]
+    # Pixel-centre sampling, as PIL NEAREST and tf.image.resize(method="nearest")
+    rows = ((np.arange(size) + 0.5) * h / size).astype(np.intp)
+    cols = ((np.arange(size) + 0.5) * w / size).astype(np.intp)
+    return pixels[:, rows[:, None], cols]
+
+
+def to_array(img, out=None):
+    """(H, W, 3) float32 in [0, 1]; written into `out` when given."""
+    return normalize(np.asarray(img, dtype=np.uint8), out=out)
+
+
+def preprocess_image(source, target_size=IMG_SIZE, out=None):
+    return to_array(load_image(source, target_size), out=out)
+
+
+def new_batch(n, target_size=IMG_SIZE):
+    return np.empty((n, target_size[1], target_size[0], 3), dtype=np.float32)
+
+
+def load_batch(sources, target_size=IMG_SIZE, out=None, pool=None):
+    """Preprocess `sources` into one (N, H, W, 3) float32 batch.
+
+    `out` is an optional preallocated buffer with at least N rows (the first N
+    are filled and returned); `pool` is an optional executor used to decode in
+    parallel.
+    """
+    sources = list(sources)
+    if out is None:
+        out = new_batch(len(sources), target_size)
+    out = out[:len(sources)]
+
+    def fill(i):
+        preprocess_image(sources[i], target_size, out=out[i])
+
+    if pool is None:
+        for i in range(len(sources)):
+            fill(i)
+    else:
+        list(pool.map(fill, range(len(sources))))
+    return out
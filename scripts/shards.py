@@ -0,0 +1,202 @@
+"""Sharded, pre-resized dataset format written by the split scripts.
+
+Each split is decoded once (with the shared preprocessing path) into
+fixed-size shards of uint8 224x224 RGB images, stored next to the class
+folders:
+
+    data_stage1/shards/train/
+        index.json              format, img_size, class_indices, shard list
+        labels.npy              int32 label of every image, in shard order
+        paths.npy               source path of every image
+        images-00000.npy        (N, 224, 224, 3) uint8, memory-mappable  (format "npy")
+        images-00000.tfrecord   raw uint8 image + label + path examples  (format "tfrecord")
+
+Training streams them through input_pipeline.directory_dataset (DATA_SHARDS=1)
+and evaluation through ShardReader, so neither decodes the JPEGs again.
+"""
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from preprocessing import IMG_SIZE, VALID_EXTS, list_directory, load_image
+
+FORMATS = ("npy", "tfrecord")
+SHARD_SIZE = 1024
+INDEX_NAME = "index.json"
+
+
+def shard_dir(split_dir):
+    """data_stageN/<split> -> data_stageN/shards/<split>"""
+    split_dir = os.path.normpath(str(split_dir))
+    return os.path.join(os.path.dirname(split_dir), "shards", os.path.basename(split_dir))
+
+
+def index_path(split_dir):
+    return os.path.join(shard_dir(split_dir), INDEX_NAME)
+
+
+def _decode_into(path, out, img_size):
+    try:
+        out[...] = np.asarray(load_image(path, img_size), dtype=np.uint8)
+        return True
+    except Exception as exc:
+        print(f"⚠️ Skipping unreadable image {path}: {type(exc).__name__}: {exc}")
+        return False
+
+
+def _write_tfrecord(path, pixels, labels, paths):
+    import tensorflow as tf
+
+    with tf.io.TFRecordWriter(path) as writer:
+        for img, label, src in zip(pixels, labels, paths):
+            example = tf.train.Example(features=tf.train.Features(feature={
+                "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[img.tobytes()])),
+                "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[int(label)])),
+                "path": tf.train.Feature(bytes_list=tf.train.BytesList(value=[str(src).encode()])),
+            }))
+            writer.write(example.SerializeToString())
+
+
+def write_shards(filepaths, labels, class_indices, out_dir, fmt="npy", shard_size=SHARD_SIZE,
+                 img_size=IMG_SIZE, workers=None):
+    """Decode `filepaths` into shards under `out_dir` (replacing what was there).
+
+    `img_size` is (width, height). Unreadable images are skipped, so a shard
+    can hold fewer than `shard_size` images; the index records every count.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown shard format {fmt!r}, expected one of {FORMATS}")
+    if os.path.exists(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    width, height = img_size
+    kept_paths, kept_labels, shards = [], [], []
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for start in range(0, len(filepaths), shard_size):
+            chunk_paths = [str(p) for p in filepaths[start:start + shard_size]]
+            chunk_labels = np.asarray(labels[start:start + shard_size], dtype=np.int32)
+            pixels = np.empty((len(chunk_paths), height, width, 3), dtype=np.uint8)
+            ok = np.array(list(pool.map(lambda i: _decode_into(chunk_paths[i], pixels[i], img_size),
+                                        range(len(chunk_paths)))), dtype=bool)
+            if not ok.all():
+                pixels, chunk_labels = pixels[ok], chunk_labels[ok]
+                chunk_paths = [p for p, keep in zip(chunk_paths, ok) if keep]
+            if not len(chunk_paths):
+                continue
+
+            name = f"images-{len(shards):05d}.{fmt}"
+            if fmt == "npy":
+                np.save(os.path.join(out_dir, name), pixels)
+            else:
+                _write_tfrecord(os.path.join(out_dir, name), pixels, chunk_labels, chunk_paths)
+            shards.append({"file": name, "start": len(kept_paths), "count": len(chunk_paths)})
+            kept_paths.extend(chunk_paths)
+            kept_labels.append(chunk_labels)
+            print(f"💾 {os.path.join(out_dir, name)} ({len(chunk_paths)} images)")
+
+    np.save(os.path.join(out_dir, "labels.npy"),
+            np.concatenate(kept_labels) if kept_labels else np.empty(0, dtype=np.int32))
+    np.save(os.path.join(out_dir, "paths.npy"), np.array(kept_paths, dtype=str))
+    index = {
+        "format": fmt,
+        "img_size": [height, width],
+        "class_indices": class_indices,
+        "count": len(kept_paths),
+        "shards": shards,
+    }
+    # Written last: a directory without index.json is an unfinished write
+    with open(os.path.join(out_dir, INDEX_NAME), "w") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def write_split_shards(split_dir, fmt="npy", shard_size=SHARD_SIZE, img_size=IMG_SIZE, exts=VALID_EXTS,
+                       workers=None):
+    """Shard a class-per-folder split directory into shard_dir(split_dir)."""
+    filepaths, labels, class_indices = list_directory(split_dir, exts)
+    return write_shards(filepaths, labels, class_indices, shard_dir(split_dir), fmt, shard_size, img_size, workers)
+
+
+class ShardReader:
+    """Random and sequential access to the shards of one split.
+
+    `location` is the split directory (data_stage1/val), its shard directory
+    or the index.json itself.
+    """
+
+    def __init__(self, location):
+        location = str(location)
+        if location.endswith(".json"):
+            self.root = os.path.dirname(location)
+        elif os.path.exists(os.path.join(location, INDEX_NAME)):
+            self.root = location
+        else:
+            self.root = shard_dir(location)
+        with open(os.path.join(self.root, INDEX_NAME), "r") as f:
+            self.index = json.load(f)
+
+        self.format = self.index["format"]
+        self.img_size = tuple(self.index["img_size"])  # (height, width)
+        self.class_indices = self.index["class_indices"]
+        self.classes = sorted(self.class_indices, key=self.class_indices.get)
+        self.samples = self.index["count"]
+        self.labels = np.load(os.path.join(self.root, "labels.npy"))
+        self.paths = np.load(os.path.join(self.root, "paths.npy"))
+        self.files = [os.path.join(self.root, s["file"]) for s in self.index["shards"]]
+        self.starts = np.array([s["start"] for s in self.index["shards"]], dtype=np.int64)
+        self._images = {}
+
+    def __len__(self):
+        return self.samples
+
+    def images(self, shard):
+        """Memory-mapped (N, H, W, 3) uint8 images of one npy shard."""
+        if self.format != "npy":
+            raise ValueError("Random access needs npy shards; read tfrecord shards with iter_batches")
+        if shard not in self._images:
+            self._images[shard] = np.load(self.files[shard], mmap_mode="r")
+        return self._images[shard]
+
+    def take(self, idx):
+        """(uint8 images, labels) for global sample indices `idx` (npy shards)."""
+        idx = np.asarray(idx, dtype=np.int64)
+        out = np.empty((len(idx),) + self.img_size + (3,), dtype=np.uint8)
+        shard_of = np.searchsorted(self.starts, idx, side="right") - 1
+        for shard in np.unique(shard_of):
+            rows = shard_of == shard
+            out[rows] = self.images(shard)[idx[rows] - self.starts[shard]]
+        return out, self.labels[idx]
+
+    def iter_batches(self, batch_size=64):
+        """(uint8 images, labels, paths) batches in shard order."""
+        if self.format == "npy":
+            for start in range(0, self.samples, batch_size):
+                idx = np.arange(start, min(start + batch_size, self.samples))
+                images, labels = self.take(idx)
+                yield images, labels, self.paths[idx]
+            return
+
+        import tensorflow as tf
+
+        ds = tf.data.TFRecordDataset(self.files).map(
+            lambda record: parse_example(record, self.img_size), num_parallel_calls=tf.data.AUTOTUNE)
+        start = 0
+        for images, labels in ds.batch(batch_size).prefetch(tf.data.AUTOTUNE):
+            yield images.numpy(), labels.numpy(), self.paths[start:start + len(labels)]
+            start += len(labels)
+
+
+def parse_example(record, img_size):
+    """tfrecord example -> ((H, W, 3) uint8 image, int32 label)."""
+    import tensorflow as tf
+
+    features = tf.io.parse_single_example(record, {
+        "image": tf.io.FixedLenFeature([], tf.string),
+        "label": tf.io.FixedLenFeature([], tf.int64),
+    })
+    img = tf.reshape(tf.io.decode_raw(features["image"], tf.uint8), tuple(img_size) + (3,))
+    return img, tf.cast(features["label"], tf.int32)
@@ -0,0 +1,251 @@
+"""Manifest-based, incremental train/val splitting shared by the split scripts.
+
+Every source image is recorded in `<output>/manifest.csv` with its content
+hash, class and split. Re-running only hashes files whose size or mtime
+changed, keeps the split of every file already in the manifest, and only
+(re)materializes added or changed files; files that disappeared from the
+source are removed from the output. New files are assigned by their content
+hash, so the assignment does not depend on which other files exist and an
+identical image always lands in the same split. The one exception: a class
+with at least two images always gets at least one in each split (the image
+whose hash is closest to the missing split moves there), and a single-image
+class goes to train.
+
+Both split folders are created for every class, and the class indices of the
+train split are written to `<output>/class_indices.json`; the input pipeline
+uses them for both splits, so val labels can't shift when val lacks a class.
+
+The train/val trees are materialized as hardlinks (default; copies when the
+output is on another filesystem), symlinks, copies, or not at all ("none",
+train from shards instead: see shards.py).
+"""
+import csv
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from shards import FORMATS, SHARD_SIZE, index_path, write_shards
+
+MANIFEST_NAME = "manifest.csv"
+CLASS_INDICES_NAME = "class_indices.json"
+FIELDS = ["path", "sha1", "size", "mtime_ns", "class", "split", "dest"]
+MATERIALIZE_MODES = ("hardlink", "symlink", "copy", "none")
+SPLITS = ("train", "val")
+WORKERS = min(32, (os.cpu_count() or 4) * 4)
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def assign_split(sha1, val_ratio):
+    return "val" if int(sha1[:8], 16) / 0x100000000 < val_ratio else "train"
+
+
+def _val_score(row):
+    return int(row["sha1"][:8], 16)
+
+
+def balance_splits(rows):
+    """Move rows so every class with >= 2 images has both splits (and a
+    single-image class is in train); returns the moved rows' previous states."""
+    by_class = {}
+    for row in rows:
+        by_class.setdefault(row["class"], []).append(row)
+    moved = []
+    for cls_rows in by_class.values():
+        for split in SPLITS:
+            if any(r["split"] == split for r in cls_rows):
+                continue
+            if split == "val" and len(cls_rows) < 2:
+                continue
+            # Val takes the most val-like hash, train the least
+            pick = min if split == "val" else max
+            row = pick(cls_rows, key=_val_score)
+            moved.append(dict(row))
+            row["split"], row["dest"] = split, ""
+    return moved
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", newline="") as f:
+        return {row["path"]: row for row in csv.DictReader(f)}
+
+
+def save_manifest(path, rows):
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda r: (r["split"], r["class"], r["dest"])))
+    os.replace(tmp, path)
+
+
+def update_manifest(files, old, val_ratio=0.2, workers=WORKERS):
+    """New manifest rows for `files` ((path, class) pairs) given the `old` rows.
+
+    Returns (rows, changes) where changes maps "added", "changed", "removed"
+    and "unchanged" to lists of rows, and "moved" to the previous state of
+    rows balance_splits moved to the other split.
+    """
+    stats, to_hash = {}, []
+    for path, cls in files:
+        path = str(path)
+        st = os.stat(path)
+        stats[path] = (cls, st.st_size, st.st_mtime_ns)
+        prev = old.get(path)
+        if prev is None or prev["class"] != cls or int(prev["size"]) != st.st_size \
+                or int(prev["mtime_ns"]) != st.st_mtime_ns:
+            to_hash.append(path)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = dict(zip(to_hash, pool.map(file_sha1, to_hash)))
+
+    # A renamed/moved file keeps the split it had under its old name
+    split_by_hash = {row["sha1"]: row["split"] for row in old.values()}
+    changes = {"added": [], "changed": [], "removed": [], "unchanged": [], "moved": []}
+    rows = []
+    for path, (cls, size, mtime_ns) in stats.items():
+        prev = old.get(path)
+        if prev is not None and prev["class"] == cls:
+            row = dict(prev, size=str(size), mtime_ns=str(mtime_ns))
+            if path in hashes:
+                row["sha1"] = hashes[path]
+            kind = "unchanged" if row["sha1"] == prev["sha1"] else "changed"
+        else:
+            sha1 = hashes[path]
+            split = split_by_hash.get(sha1) or assign_split(sha1, val_ratio)
+            row = {"path": path, "sha1": sha1, "size": str(size), "mtime_ns": str(mtime_ns),
+                   "class": cls, "split": split, "dest": ""}
+            kind = "added"
+        rows.append(row)
+        changes[kind].append(row)
+
+    # Rows already in the manifest that move are re-placed like changed files
+    changes["moved"] = balance_splits(rows)
+    moved_paths = {row["path"] for row in changes["moved"] if row["dest"]}
+    changes["unchanged"] = [row for row in changes["unchanged"] if row["path"] not in moved_paths]
+    changes["changed"] = [row for row in changes["changed"] if row["path"] not in moved_paths] \
+        + [row for row in rows if row["path"] in moved_paths]
+    taken = {row["dest"] for row in rows if row["dest"]}
+
+    for row in rows:
+        if not row["dest"]:
+            row["dest"] = _dest_name(row, taken)
+            taken.add(row["dest"])
+
+    changes["removed"] = [row for path, row in old.items()
+                          if path not in stats or stats[path][0] != row["class"]]
+    return rows, changes
+
+
+def _dest_name(row, taken):
+    """split/class/name, disambiguated like the old copy loop did (parent folder prefix)."""
+    name = os.path.basename(row["path"])
+    parent = os.path.basename(os.path.dirname(row["path"]))
+    for candidate in (name, f"{parent}_{name}", f"{row['sha1'][:8]}_{name}"):
+        dest = "/".join((row["split"], row["class"], candidate))
+        if dest not in taken:
+            return dest
+    raise ValueError(f"Cannot find a free destination name for {row['path']}")
+
+
+def _place(src, dst, mode):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+        return
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            # Different filesystem (or no hardlink support): fall back to a copy
+            pass
+    shutil.copy2(src, dst)
+
+
+def materialize(rows, changes, output_root, mode="hardlink", workers=WORKERS):
+    """Bring the train/val trees in line with the manifest; returns files written."""
+    if mode == "none":
+        return 0
+    # Both splits get a folder for every class, even an empty one, so
+    # list_directory sees the same classes in train and val
+    for split in SPLITS:
+        for cls in {row["class"] for row in rows}:
+            os.makedirs(os.path.join(output_root, split, cls), exist_ok=True)
+    for row in changes["removed"] + [r for r in changes["moved"] if r["dest"]]:
+        dst = os.path.join(output_root, row["dest"])
+        if os.path.lexists(dst):
+            os.remove(dst)
+
+    refresh = {row["dest"] for row in changes["added"] + changes["changed"]}
+    jobs = [(row["path"], os.path.join(output_root, row["dest"])) for row in rows
+            if row["dest"] in refresh or not os.path.lexists(os.path.join(output_root, row["dest"]))]
+    for dst_dir in {os.path.dirname(dst) for _, dst in jobs}:
+        os.makedirs(dst_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda job: _place(job[0], job[1], mode), jobs))
+    return len(jobs)
+
+
+def _shard_format(split_dir):
+    if not os.path.exists(index_path(split_dir)):
+        return None
+    with open(index_path(split_dir), "r") as f:
+        return json.load(f)["format"]
+
+
+def split_dataset(files, output_root, val_ratio=0.2, mode="hardlink", shards=None, shard_size=SHARD_SIZE,
+                  workers=WORKERS, rebuild=False):
+    """Update `output_root`'s manifest, train/val trees and (optionally) shards
+    for `files` ((path, class) pairs); returns the manifest rows."""
+    output_root = str(output_root)
+    if rebuild and os.path.exists(output_root):
+        shutil.rmtree(output_root)
+    os.makedirs(output_root, exist_ok=True)
+    manifest_path = os.path.join(output_root, MANIFEST_NAME)
+
+    rows, changes = update_manifest(files, load_manifest(manifest_path), val_ratio, workers)
+    written = materialize(rows, changes, output_root, mode, workers)
+    save_manifest(manifest_path, rows)
+    # Every class is in train (balance_splits), so these cover val too
+    class_indices = {name: i for i, name in enumerate(sorted({r["class"] for r in rows if r["split"] == "train"}))}
+    with open(os.path.join(output_root, CLASS_INDICES_NAME), "w") as f:
+        json.dump(class_indices, f, indent=2)
+    print(f"Manifest {manifest_path}: {len(changes['added'])} added, {len(changes['changed'])} changed, "
+          f"{len(changes['removed'])} removed, {len(changes['unchanged'])} unchanged, "
+          f"{len(changes['moved'])} moved to balance the splits; {written} files written ({mode})")
+
+    if shards:
+        touched = {row["split"] for kind in ("added", "changed", "removed", "moved") for row in changes[kind]}
+        for split in SPLITS:
+            split_dir = os.path.join(output_root, split)
+            if split not in touched and _shard_format(split_dir) == shards:
+                continue
+            split_rows = sorted((r for r in rows if r["split"] == split), key=lambda r: (r["class"], r["dest"]))
+            index = write_shards([r["path"] for r in split_rows], [class_indices[r["class"]] for r in split_rows],
+                                 class_indices, os.path.dirname(index_path(split_dir)), shards, shard_size,
+                                 workers=workers)
+            print(f"✅ {split} shards: {index['count']} images in {len(index['shards'])} {shards} shards")
+    return rows
+
+
+def add_arguments(parser):
+    """Command-line options shared by the split scripts."""
+    parser.add_argument("--val-ratio", type=float, default=0.2, help="fraction of new images assigned to val")
+    parser.add_argument("--materialize", choices=MATERIALIZE_MODES, default="hardlink",
+                        help="how train/val trees are created ('none': manifest and shards only)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="threads for hashing and copying")
+    parser.add_argument("--rebuild", action="store_true", help="delete the output and split from scratch")
+    parser.add_argument("--shards", choices=FORMATS, help="also write pre-resized shards of each split")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="images per shard")
@@ -1,41 +1,36 @@
+import argparse
 import os
-import shutil
-from sklearn.model_selection import train_test_split
+
+from preprocessing import VALID_EXTS
+from split_manifest import add_arguments, split_dataset
+
+parser = argparse.ArgumentParser(description="Split raw_images_stage2 into data_stage2/train|val.")
+add_arguments(parser)
+args = parser.parse_args()
 
 images_root = "raw_images_stage2"
 output_root = "data_stage2"
 
-if os.path.exists(output_root):
-    shutil.rmtree(output_root)
-os.makedirs(output_root, exist_ok=True)
-
 train_root = os.path.join(output_root, "train")
 val_root = os.path.join(output_root, "val")
-os.makedirs(train_root, exist_ok=True)
-os.makedirs(val_root, exist_ok=True)
 
 breeds = [d for d in os.listdir(images_root) if os.path.isdir(os.path.join(images_root, d))]
 
+files = []
 for breed in breeds:
     breed_folder = os.path.join(images_root, breed)
-    images = [f for f in os.listdir(breed_folder) if os.path.isfile(os.path.join(breed_folder, f))]
-    train_imgs, val_imgs = train_test_split(images, test_size=0.2, random_state=42)
-
-    os.makedirs(os.path.join(train_root, breed), exist_ok=True)
-    os.makedirs(os.path.join(val_root, breed), exist_ok=True)
-
-    for img_file in train_imgs:
-        src = os.path.join(breed_folder, img_file)
-        dst = os.path.join(train_root, breed, img_file)
-        shutil.copy(src, dst)
+    images = [f for f in os.listdir(breed_folder)
+              if os.path.isfile(os.path.join(breed_folder, f)) and f.lower().endswith(VALID_EXTS)]
+    files.extend((os.path.join(breed_folder, img_file), breed) for img_file in images)
 
-    for img_file in val_imgs:
-        src = os.path.join(breed_folder, img_file)
-        dst = os.path.join(val_root, breed, img_file)
-        shutil.copy(src, dst)
+rows = split_dataset(files, output_root, args.val_ratio, args.materialize, args.shards, args.shard_size,
+                     args.workers, args.rebuild)
 
-    print(f"Breed '{breed}': {len(train_imgs)} training images, {len(val_imgs)} validation images")
+for breed in sorted(breeds):
+    train_imgs = sum(1 for r in rows if r["class"] == breed and r["split"] == "train")
+    val_imgs = sum(1 for r in rows if r["class"] == breed and r["split"] == "val")
+    print(f"Breed '{breed}': {train_imgs} training images, {val_imgs} validation images")
 
 print("All done. Output at:")
 print(f" - {train_root}/<breed_name>")
-print(f" - {val_root}/<breed_name>")
\ No newline at end of file
+print(f" - {val_root}/<breed_name>")
@@ -0,0 +1,363 @@
+"""Pipeline-parallel cascade: one group of worker processes per stage.
+
+    decode -> stage 1 -> cattle breed (stage 2)
+                      -> buffalo breed (stage 3)
+
+Decode workers write uint8 pixels straight into a slot of one shared-memory
+block; the stage processes read them from there, so no image data is pickled
+or copied between processes. Only small messages (batch id, slot, row
+indices, labels) travel through the bounded queues, and the number of slots
+bounds how many batches are in flight. While the breed models work on one
+batch, stage 1 is already on the next and the decoders further ahead, so
+every stage stays busy on a stream of images.
+
+Each worker records how long it was busy, waiting for input and blocked on
+its output; `StagePipeline.utilization()` turns that into per-stage
+utilization to rebalance the worker counts with.
+
+    with StagePipeline(batch_size=64, workers={"decode": 4, "stage1": 1, "cattle": 1, "buffalo": 1}) as pipe:
+        for batch_paths, ok_paths, results, errors in pipe.run(chunked(paths, 64)):
+            ...
+"""
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from preprocessing import IMG_SIZE, load_image, new_batch, normalize
+
+STAGE_NAMES = ("decode", "stage1", "cattle", "buffalo")
+DEFAULT_WORKERS = {"decode": max(1, (os.cpu_count() or 2) // 2), "stage1": 1, "cattle": 1, "buffalo": 1}
+# Breed stage -> (model name, multihead head)
+BREED_MODELS = {"cattle": ("breed_classifier", "cattle_breed"), "buffalo": ("buffalo_breed_classifier", "buffalo_breed")}
+
+
+def parse_workers(text):
+    """"decode=4,stage1=1" -> worker counts, unspecified stages at their defaults."""
+    workers = dict(DEFAULT_WORKERS)
+    for part in text.split(","):
+        name, _, count = part.partition("=")
+        if name.strip() not in STAGE_NAMES:
+            raise ValueError(f"unknown stage {name!r}, expected one of {STAGE_NAMES}")
+        workers[name.strip()] = int(count)
+    if min(workers.values()) < 1:
+        raise ValueError("every stage needs at least one worker")
+    return workers
+
+
+class StageStats:
+    """Busy / waiting time of one worker process."""
+
+    def __init__(self, stage, index):
+        self.stage = stage
+        self.index = index
+        self.start = time.perf_counter()
+        self.busy_s = self.wait_in_s = self.wait_out_s = 0.0
+        self.batches = self.images = 0
+
+    def loaded(self):
+        """Start the clock once the worker's model is loaded."""
+        self.start = time.perf_counter()
+
+    def get(self, q, field="wait_in_s"):
+        start = time.perf_counter()
+        item = q.get()
+        setattr(self, field, getattr(self, field) + time.perf_counter() - start)
+        return item
+
+    def put(self, q, item):
+        start = time.perf_counter()
+        q.put(item)
+        self.wait_out_s += time.perf_counter() - start
+
+    @contextmanager
+    def busy(self, images):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy_s += time.perf_counter() - start
+            self.batches += 1
+            self.images += images
+
+    def summary(self):
+        return {"stage": self.stage, "index": self.index, "wall_s": time.perf_counter() - self.start,
+                "busy_s": self.busy_s, "wait_in_s": self.wait_in_s, "wait_out_s": self.wait_out_s,
+                "batches": self.batches, "images": self.images}
+
+
+def attach_slots(name, shape):
+    # Workers share the parent's resource tracker, which unlinks the block if the parent dies
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+
+def worker_main(body, stage, index, results, *args):
+    """Process entry point: run a stage body, then report its stats (or its
+    traceback) to the parent."""
+    stats = StageStats(stage, index)
+    try:
+        body(stats, results, *args)
+        results.put(("stats", stats.summary()))
+    except Exception:
+        results.put(("error", f"{stage}[{index}]", traceback.format_exc()))
+
+
+def _load_stage_model(name, head, threads):
+    os.environ["FARMVISION_INTRA_OP_THREADS"] = str(threads)
+    os.environ["FARMVISION_INTER_OP_THREADS"] = "1"
+    os.environ["FARMVISION_TFLITE_THREADS"] = str(threads)
+    from inference import BACKEND, load_predictor
+    from multihead import stage_model_path
+
+    keras_path = stage_model_path(head) if BACKEND == "keras" else None
+    return load_predictor(name, BACKEND, keras_path=keras_path)
+
+
+def decode_body(stats, results, tasks, outbox, free, shm_name, shape):
+    shm, slots = attach_slots(shm_name, shape)
+    while True:
+        task = stats.get(tasks)
+        if task is None:
+            break
+        batch_id, paths = task
+        # Waiting for a free slot is backpressure from the stages downstream
+        slot = stats.get(free, "wait_out_s")
+        ok, errors = [], {}
+        with stats.busy(len(paths)):
+            for path in paths:
+                try:
+                    slots[slot, len(ok)] = np.asarray(load_image(path, IMG_SIZE))
+                    ok.append(path)
+                except Exception as exc:
+                    errors[path] = f"{type(exc).__name__}: {exc}"
+        stats.put(outbox, (batch_id, slot, ok, errors))
+    shm.close()
+
+
+def stage1_body(stats, results, inbox, breed_queues, shm_name, shape, threads):
+    predict = _load_stage_model("cattle_detector", "stage1", threads)
+    from cascade import USE_GATE, Stage1Gate, gate_model_name, run_stage1
+    from inference import load_predictor
+    from multihead import load_class_names
+
+    classes = load_class_names()[0]
+    class_indices = {name: i for i, name in enumerate(classes)}
+    gate = Stage1Gate(load_predictor(gate_model_name(), "keras"), class_indices) if USE_GATE else None
+    shm, slots = attach_slots(shm_name, shape)
+    buffer = new_batch(shape[1])
+    stats.loaded()
+    while True:
+        msg = stats.get(inbox)
+        if msg is None:
+            break
+        batch_id, slot, ok, errors = msg
+        labels, confidences, parts = [], [], {}
+        if ok:
+            with stats.busy(len(ok)):
+                x = normalize(slots[slot, :len(ok)], out=buffer[:len(ok)])
+                preds = run_stage1(x, predict, gate)
+                idx = np.argmax(preds, axis=1)
+                confidences = preds[np.arange(len(idx)), idx].tolist()
+                labels = [classes[i] for i in idx]
+                for label in breed_queues:
+                    rows = np.flatnonzero(idx == class_indices[label])
+                    if len(rows):
+                        parts[label] = rows
+        # Report stage 1 first: the parent frees the slot once every part is back
+        results.put(("stage1", batch_id, slot, ok, errors, labels, confidences, len(parts)))
+        for label, rows in parts.items():
+            stats.put(breed_queues[label], (batch_id, slot, rows))
+    shm.close()
+
+
+def breed_body(stats, results, label, inbox, shm_name, shape, threads):
+    name, head = BREED_MODELS[label]
+    predict = _load_stage_model(name, head, threads)
+    from multihead import HEAD_NAMES, load_class_names
+
+    breeds = load_class_names()[HEAD_NAMES.index(head)]
+    shm, slots = attach_slots(shm_name, shape)
+    stats.loaded()
+    while True:
+        msg = stats.get(inbox)
+        if msg is None:
+            break
+        batch_id, slot, rows = msg
+        with stats.busy(len(rows)):
+            preds = predict(normalize(slots[slot][rows]))
+            idx = np.argmax(preds, axis=1)
+            confidences = preds[np.arange(len(idx)), idx].tolist()
+        results.put(("breed", batch_id, label, rows.tolist(), [breeds[i] for i in idx], confidences))
+    shm.close()
+
+
+class StagePipeline:
+    """Runs the cascade with one group of processes per stage (see the module
+    docstring). Use as a context manager; `run()` yields
+    (batch_paths, ok_paths, results, errors) per batch, in input order, with
+    one classify_batch-style result dict per ok path."""
+
+    def __init__(self, batch_size=64, workers=None, slots=None, threads=None):
+        self.batch_size = batch_size
+        self.workers = dict(workers or DEFAULT_WORKERS)
+        model_workers = sum(self.workers[s] for s in STAGE_NAMES[1:])
+        self.threads = threads or max(1, (os.cpu_count() or 1) // model_workers)
+        # Enough slots for every stage to hold a batch, plus one being decoded per decoder
+        self.slots = slots or 2 * (self.workers["decode"] + model_workers)
+        self.max_inflight = self.slots + self.workers["decode"]
+        self.shape = (self.slots, batch_size) + (IMG_SIZE[1], IMG_SIZE[0], 3)
+        self.stats = []
+        self.wall_s = 0.0
+
+    def __enter__(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)))
+        self.tasks = ctx.Queue(self.max_inflight)
+        self.free = ctx.Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+        self.stage1_queue = ctx.Queue(self.slots)
+        self.breed_queues = {label: ctx.Queue(self.slots) for label in BREED_MODELS}
+        self.results = ctx.Queue()
+
+        def start(stage, body, count, *args):
+            procs = []
+            for i in range(count):
+                proc = ctx.Process(target=worker_main, name=f"farmvision-{stage}-{i}",
+                                   args=(body, stage, i, self.results) + args, daemon=True)
+                proc.start()
+                procs.append(proc)
+            return procs
+
+        self.procs = {
+            "decode": start("decode", decode_body, self.workers["decode"], self.tasks, self.stage1_queue,
+                            self.free, self.shm.name, self.shape),
+            "stage1": start("stage1", stage1_body, self.workers["stage1"], self.stage1_queue,
+                            self.breed_queues, self.shm.name, self.shape, self.threads),
+            **{label: start(label, breed_body, self.workers[label], label, q, self.shm.name, self.shape,
+                            self.threads)
+               for label, q in self.breed_queues.items()},
+        }
+        self._start = time.perf_counter()
+        return self
+
+    def _next_result(self):
+        while True:
+            try:
+                msg = self.results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [p.name for procs in self.procs.values() for p in procs if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Stage worker(s) exited unexpectedly: {', '.join(dead)}")
+                continue
+            if msg[0] == "error":
+                raise RuntimeError(f"Stage worker {msg[1]} failed:\n{msg[2]}")
+            if msg[0] == "stats":
+                self.stats.append(msg[1])
+                continue
+            return msg
+
+    def run(self, path_batches):
+        path_batches = iter(path_batches)
+        pending, done = {}, {}
+        submitted = yielded = 0
+        exhausted = False
+        while True:
+            while not exhausted and submitted - yielded < self.max_inflight:
+                paths = next(path_batches, None)
+                if paths is None:
+                    exhausted = True
+                    break
+                pending[submitted] = {"paths": paths, "expected": None, "breeds": []}
+                self.tasks.put((submitted, paths))
+                submitted += 1
+            while yielded in done:
+                yield done.pop(yielded)
+                yielded += 1
+            if exhausted and yielded == submitted:
+                return
+
+            msg = self._next_result()
+            batch_id = msg[1]
+            state = pending[batch_id]
+            if msg[0] == "stage1":
+                _, _, state["slot"], state["ok"], state["errors"], labels, confidences, state["expected"] = msg
+                state["results"] = [{"stage1_label": label, "stage1_confidence": conf,
+                                     "breed": None, "breed_confidence": None}
+                                    for label, conf in zip(labels, confidences)]
+            else:
+                state["breeds"].append(msg[3:])
+            if state["expected"] is not None and len(state["breeds"]) == state["expected"]:
+                for rows, breeds, confidences in state["breeds"]:
+                    for row, breed, conf in zip(rows, breeds, confidences):
+                        state["results"][row].update(breed=breed, breed_confidence=conf)
+                self.free.put(state["slot"])
+                del pending[batch_id]
+                done[batch_id] = (state["paths"], state["ok"], state["results"], state["errors"])
+
+    def _stop(self, stage, inbox):
+        for _ in self.procs[stage]:
+            inbox.put(None)
+        for proc in self.procs[stage]:
+            while proc.is_alive():
+                # Keep draining results so the worker can flush its stats and exit
+                try:
+                    msg = self.results.get(timeout=0.1)
+                    if msg[0] == "stats":
+                        self.stats.append(msg[1])
+                except queue.Empty:
+                    pass
+                proc.join(timeout=0)
+
+    def __exit__(self, exc_type, *exc):
+        self.wall_s = time.perf_counter() - self._start
+        try:
+            if exc_type is None:
+                # Upstream first, so nothing is left in a queue when its consumers stop
+                self._stop("decode", self.tasks)
+                self._stop("stage1", self.stage1_queue)
+                for label, q in self.breed_queues.items():
+                    self._stop(label, q)
+                while True:
+                    try:
+                        msg = self.results.get_nowait()
+                    except queue.Empty:
+                        break
+                    if msg[0] == "stats":
+                        self.stats.append(msg[1])
+        finally:
+            for procs in self.procs.values():
+                for proc in procs:
+                    if proc.is_alive():
+                        proc.terminate()
+            self.shm.close()
+            self.shm.unlink()
+
+    def utilization(self):
+        """Per-stage busy share of the workers' wall time, plus a rebalancing hint."""
+        stages = {}
+        for stage in STAGE_NAMES:
+            workers = [s for s in self.stats if s["stage"] == stage]
+            wall = sum(s["wall_s"] for s in workers)
+            stages[stage] = {
+                "workers": self.workers[stage],
+                "batches": sum(s["batches"] for s in workers),
+                "images": sum(s["images"] for s in workers),
+                "busy_s": round(sum(s["busy_s"] for s in workers), 3),
+                "wait_in_s": round(sum(s["wait_in_s"] for s in workers), 3),
+                "wait_out_s": round(sum(s["wait_out_s"] for s in workers), 3),
+                "utilization": round(sum(s["busy_s"] for s in workers) / wall, 4) if wall else None,
+            }
+        busiest = max(stages, key=lambda s: stages[s]["utilization"] or 0)
+        idle = [s for s in stages if (stages[s]["utilization"] or 0) < 0.3 and self.workers[s] > 1]
+        hint = f"{busiest} is the bottleneck; give it more workers"
+        if idle:
+            hint += f" (taken from {', '.join(idle)})"
+        return {"wall_s": round(self.wall_s, 3), "threads_per_model_worker": self.threads,
+                "slots": self.slots, "stages": stages, "hint": hint}
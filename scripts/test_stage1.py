@@ -2,7 +2,9 @@ import os
 import random
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
+
+from inference import CompiledPredictor
+from preprocessing import preprocess_image
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 VAL_DIR = os.path.join(BASE_DIR, "data_stage1", "val")
@@ -15,6 +17,7 @@ class_names = sorted([d for d in os.listdir(train_dir) if not d.startswith('.')]
 print("Class names (from training):", class_names)
 
 model = tf.keras.models.load_model(MODEL_PATH)
+predict = CompiledPredictor(model)
 
 total_predictions = 0
 correct_predictions = 0
@@ -25,11 +28,10 @@ for class_name in class_names:
     sampled_images = random.sample(images, min(num_samples_per_class, len(images)))
     for img_name in sampled_images:
         img_path = os.path.join(class_dir, img_name)
-        img = load_img(img_path, target_size=(img_height, img_width))
-        img_array = img_to_array(img) / 255.0
+        img_array = preprocess_image(img_path, target_size=(img_width, img_height))
         img_array = np.expand_dims(img_array, axis=0)
 
-        predictions = model.predict(img_array)
+        predictions = predict(img_array)
         predicted_index = np.argmax(predictions[0])
         confidence = predictions[0][predicted_index]
 
@@ -3,11 +3,15 @@ import json
 import random
 import numpy as np
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+
+from inference import CompiledPredictor
+from preprocessing import load_batch, new_batch, normalize, preprocess_image
+from shards import ShardReader, index_path
 
 # Load the trained breed classifier
 model_path = 'models/breed_classifier.keras'
 model = load_model(model_path)
+predict = CompiledPredictor(model)
 
 # Load the class indices to breed names mapping
 with open('models/breed_class_indices.json', 'r') as f:
@@ -39,12 +43,11 @@ for idx in sample_indices:
     actual_breed = val_labels[idx]
 
     # Load and preprocess the image
-    img = image.load_img(img_path, target_size=(224, 224))
-    img_array = image.img_to_array(img) / 255.0
+    img_array = preprocess_image(img_path)
     img_array = np.expand_dims(img_array, axis=0)
 
     # Predict
-    preds = model.predict(img_array)
+    preds = predict(img_array)
     pred_index = np.argmax(preds)
     pred_breed = indices_to_breed[pred_index]
     confidence = preds[0][pred_index]
@@ -55,25 +58,32 @@ for idx in sample_indices:
 correct = 0
 total = len(val_image_paths)
 batch_size = 32
+batch_buffer = new_batch(batch_size)
 
-for i in range(0, total, batch_size):
-    batch_paths = val_image_paths[i:i+batch_size]
-    batch_labels = val_labels[i:i+batch_size]
+if os.path.exists(index_path(val_dir)):
+    # Pre-resized shards written by split_stage2.py --shards: no JPEG decoding
+    reader = ShardReader(val_dir)
+    total = reader.samples
+    for pixels, labels, _ in reader.iter_batches(batch_size):
+        preds = predict(normalize(pixels, out=batch_buffer[:len(pixels)]))
+        pred_indices = np.argmax(preds, axis=1)
+        for pred_index, label in zip(pred_indices, labels):
+            if indices_to_breed[pred_index] == reader.classes[label]:
+                correct += 1
+else:
+    for i in range(0, total, batch_size):
+        batch_paths = val_image_paths[i:i+batch_size]
+        batch_labels = val_labels[i:i+batch_size]
 
-    batch_images = []
-    for img_path in batch_paths:
-        img = image.load_img(img_path, target_size=(224, 224))
-        img_array = image.img_to_array(img) / 255.0
-        batch_images.append(img_array)
-    batch_images = np.array(batch_images)
+        batch_images = load_batch(batch_paths, out=batch_buffer)
 
-    preds = model.predict(batch_images)
-    pred_indices = np.argmax(preds, axis=1)
-    pred_breeds = [indices_to_breed[idx] for idx in pred_indices]
+        preds = predict(batch_images)
+        pred_indices = np.argmax(preds, axis=1)
+        pred_breeds = [indices_to_breed[idx] for idx in pred_indices]
 
-    for pred_breed, actual_breed in zip(pred_breeds, batch_labels):
-        if pred_breed == actual_breed:
-            correct += 1
+        for pred_breed, actual_breed in zip(pred_breeds, batch_labels):
+            if pred_breed == actual_breed:
+                correct += 1
 
 accuracy = correct / total if total > 0 else 0
 print(f"Overall validation accuracy: {accuracy:.4f}")
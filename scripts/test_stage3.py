@@ -6,9 +6,11 @@ import random
 import json
 import numpy as np
 from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
 from pathlib import Path
 
+from inference import CompiledPredictor
+from preprocessing import preprocess_image
+
 # Paths
 MODEL_PATH = "models/buffalo_breed_classifier.keras"
 CLASS_INDICES_PATH = "models/buffalo_class_indices.json"
@@ -16,16 +18,15 @@ VAL_DIR = Path("data_stage3/val")
 
 # Load model and class indices
 model = load_model(MODEL_PATH)
+predict = CompiledPredictor(model)
 with open(CLASS_INDICES_PATH, "r") as f:
     class_indices = json.load(f)
 inv_class_indices = {v: k for k, v in class_indices.items()}
 
 # Helper: preprocess image
 def preprocess_img(img_path, target_size=(224, 224)):
-    img = image.load_img(img_path, target_size=target_size)
-    x = image.img_to_array(img)
+    x = preprocess_image(img_path, target_size)
     x = np.expand_dims(x, axis=0)
-    x = x / 255.0
     return x
 
 # Sample images
@@ -40,7 +41,7 @@ for breed_dir in VAL_DIR.iterdir():
 correct = 0
 for img_path in sampled_images:
     x = preprocess_img(img_path)
-    preds = model.predict(x)
+    preds = predict(x)
     pred_idx = np.argmax(preds[0])
     pred_class = inv_class_indices[pred_idx]
     confidence = preds[0][pred_idx]
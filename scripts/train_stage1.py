@@ -1,49 +1,43 @@
 import os
 import json
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.applications import MobileNetV2
 from tensorflow.keras.models import Model
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
 from sklearn.utils import class_weight
 import numpy as np
 
+from input_pipeline import AUGMENTATION, directory_dataset
+from feature_cache import USE_FEATURE_CACHE, fit_head_on_features
+from multihead import split_at_pooling
+from training_profiler import profiler_callbacks
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 train_dir = os.path.join(BASE_DIR, "data_stage1", "train")
 val_dir = os.path.join(BASE_DIR, "data_stage1", "val")
 
-IMG_SIZE = (224, 224)
+# STAGE1_IMG_SIZE=128 trains the low-resolution early-exit detector
+# (models/cattle_detector_128.*) used by the stage-1 gate in scripts/cascade.py
+# instead of the full 224x224 one
+IMG_SIZE = (int(os.environ.get("STAGE1_IMG_SIZE", 224)),) * 2
 BATCH_SIZE = 32
+MODEL_NAME = "cattle_detector" if IMG_SIZE[0] == 224 else f"cattle_detector_{IMG_SIZE[0]}"
 
-train_datagen = ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=20,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=0.3,
-    brightness_range=[0.8, 1.2],
-    channel_shift_range=30.0,
-    horizontal_flip=True,
-    fill_mode="nearest"
-)
-
-val_datagen = ImageDataGenerator(rescale=1./255)
-
-train_ds = train_datagen.flow_from_directory(
+# Parallel decode + augmentation with tf.data (rescaled to [0, 1], categorical labels)
+train_ds = directory_dataset(
     train_dir,
-    target_size=IMG_SIZE,
+    img_size=IMG_SIZE,
     batch_size=BATCH_SIZE,
-    class_mode="categorical",
+    augment=AUGMENTATION["stage1"],
     shuffle=True
 )
 
-val_ds = val_datagen.flow_from_directory(
+val_ds = directory_dataset(
     val_dir,
-    target_size=IMG_SIZE,
+    img_size=IMG_SIZE,
     batch_size=BATCH_SIZE,
-    class_mode="categorical",
-    shuffle=True
+    shuffle=False,
+    class_indices=train_ds.class_indices
 )
 
 # Calculate class weights
@@ -52,7 +46,7 @@ y_integers = train_ds.classes
 class_weights_array = class_weight.compute_class_weight('balanced', classes=np.unique(y_integers), y=y_integers)
 class_weights = dict(enumerate(class_weights_array))
 
-base_model = MobileNetV2(weights="imagenet", include_top=False, input_shape=(224, 224, 3))
+base_model = MobileNetV2(weights="imagenet", include_top=False, input_shape=IMG_SIZE + (3,))
 base_model.trainable = False
 
 x = base_model.output
@@ -72,19 +66,34 @@ from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
 
 early_stop = EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)
 checkpoint = ModelCheckpoint(
-    os.path.join(BASE_DIR, "models", "best_cattle_detector.keras"),
+    os.path.join(BASE_DIR, "models", f"best_{MODEL_NAME}.keras"),
     monitor='val_loss',
     save_best_only=True
 )
 
 EPOCHS = 10
-history = model.fit(
-    train_ds,
-    validation_data=val_ds,
-    epochs=EPOCHS,
-    class_weight=class_weights,
-    callbacks=[early_stop, checkpoint]
-)
+if USE_FEATURE_CACHE:
+    # Backbone is frozen: train the head on cached pooled features instead
+    history = fit_head_on_features(
+        base_model,
+        split_at_pooling(model)[1],
+        train_dir,
+        val_dir,
+        EPOCHS,
+        img_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        augment=AUGMENTATION["stage1"],
+        class_weight=class_weights,
+        callbacks=[early_stop]
+    )
+else:
+    history = model.fit(
+        train_ds.dataset,
+        validation_data=val_ds.dataset,
+        epochs=EPOCHS,
+        class_weight=class_weights,
+        callbacks=[early_stop, checkpoint] + profiler_callbacks(train_ds, f"{MODEL_NAME}_frozen")
+    )
 
 # Unfreeze the top 50 layers of the base model
 base_model.trainable = True
@@ -102,11 +111,11 @@ model.compile(
 # Fine-tune the model
 FINE_TUNE_EPOCHS = 5
 fine_tune_history = model.fit(
-    train_ds,
-    validation_data=val_ds,
+    train_ds.dataset,
+    validation_data=val_ds.dataset,
     epochs=FINE_TUNE_EPOCHS,
     class_weight=class_weights,
-    callbacks=[early_stop, checkpoint]
+    callbacks=[early_stop, checkpoint] + profiler_callbacks(train_ds, f"{MODEL_NAME}_finetune")
 )
 
 os.makedirs(os.path.join(BASE_DIR, "models"), exist_ok=True)
@@ -114,7 +123,7 @@ os.makedirs(os.path.join(BASE_DIR, "models"), exist_ok=True)
 with open(os.path.join(BASE_DIR, "models", "cattle_class_indices.json"), "w") as f:
     json.dump(train_ds.class_indices, f)
 
-model.save(os.path.join(BASE_DIR, "models", "cattle_detector.keras"))
-model.save(os.path.join(BASE_DIR, "models", "cattle_detector.h5"))
+model.save(os.path.join(BASE_DIR, "models", f"{MODEL_NAME}.keras"))
+model.save(os.path.join(BASE_DIR, "models", f"{MODEL_NAME}.h5"))
 
-print("✅ Binary classifier trained and saved to models/cattle_detector.keras and .h5")
\ No newline at end of file
+print(f"✅ Binary classifier trained and saved to models/{MODEL_NAME}.keras and .h5")
\ No newline at end of file
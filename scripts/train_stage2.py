@@ -4,44 +4,35 @@ import numpy as np
 import tensorflow as tf
 from tensorflow.keras import layers, models, callbacks, optimizers
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 import json
 
+from input_pipeline import AUGMENTATION, directory_dataset
+from feature_cache import USE_FEATURE_CACHE, fit_head_on_features
+from multihead import split_at_pooling
+from training_profiler import profiler_callbacks
+
 # Data directories
 train_dir = 'data_stage2/train'
 val_dir = 'data_stage2/val'
 batch_size = 32
 img_size = (224, 224)
 
-# Data generators with stronger augmentation
-train_datagen = ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=30,
-    width_shift_range=0.1,
-    height_shift_range=0.1,
-    shear_range=0.1,
-    zoom_range=0.2,
-    brightness_range=[0.8,1.2],
-    horizontal_flip=True,
-    fill_mode='nearest'
-)
-val_datagen = ImageDataGenerator(rescale=1./255)
-
-train_gen = train_datagen.flow_from_directory(
+# tf.data pipelines with stronger augmentation (parallel decode, prefetch)
+train_gen = directory_dataset(
     train_dir,
-    target_size=img_size,
+    img_size=img_size,
     batch_size=batch_size,
-    class_mode='categorical',
+    augment=AUGMENTATION['stage2'],
     shuffle=True
 )
 train_classes = list(train_gen.class_indices.keys())
 
-val_gen = val_datagen.flow_from_directory(
+val_gen = directory_dataset(
     val_dir,
-    target_size=img_size,
+    img_size=img_size,
     batch_size=batch_size,
-    class_mode='categorical',
-    shuffle=False
+    shuffle=False,
+    class_indices=train_gen.class_indices
 )
 
 num_classes = len(train_gen.class_indices)
@@ -72,14 +63,28 @@ checkpoint = callbacks.ModelCheckpoint('models/best_breed_classifier.h5', monito
 epochs = 10
 steps_per_epoch = len(train_gen)
 validation_steps = len(val_gen)
-model.fit(
-    train_gen,
-    epochs=epochs,
-    validation_data=val_gen,
-    steps_per_epoch=steps_per_epoch,
-    validation_steps=validation_steps,
-    callbacks=[early_stop, checkpoint]
-)
+if USE_FEATURE_CACHE:
+    # Backbone is frozen: train the head on cached pooled features instead
+    fit_head_on_features(
+        base_model,
+        split_at_pooling(model)[1],
+        train_dir,
+        val_dir,
+        epochs,
+        img_size=img_size,
+        batch_size=batch_size,
+        augment=AUGMENTATION['stage2'],
+        callbacks=[early_stop]
+    )
+else:
+    model.fit(
+        train_gen.dataset,
+        epochs=epochs,
+        validation_data=val_gen.dataset,
+        steps_per_epoch=steps_per_epoch,
+        validation_steps=validation_steps,
+        callbacks=[early_stop, checkpoint] + profiler_callbacks(train_gen, 'breed_classifier_frozen')
+    )
 
 # Unfreeze top 50 layers of base_model for fine-tuning
 base_model.trainable = True
@@ -97,13 +102,13 @@ model.compile(
 fine_tune_epochs = 5
 total_epochs = epochs + fine_tune_epochs
 model.fit(
-    train_gen,
+    train_gen.dataset,
     epochs=total_epochs,
     initial_epoch=epochs,
-    validation_data=val_gen,
+    validation_data=val_gen.dataset,
     steps_per_epoch=steps_per_epoch,
     validation_steps=validation_steps,
-    callbacks=[early_stop, checkpoint]
+    callbacks=[early_stop, checkpoint] + profiler_callbacks(train_gen, 'breed_classifier_finetune')
 )
 
 # Save final model and class indices
@@ -119,7 +124,7 @@ print("Class indices saved as 'models/breed_class_indices.json'.")
 print("breed_class_indices.json generated with mapping:", train_gen.class_indices)
 
 # Inference on 5 random val images
-from tensorflow.keras.preprocessing import image
+from preprocessing import preprocess_image
 
 class_indices = val_gen.class_indices
 idx_to_class = {v: k for k, v in class_indices.items()}
@@ -138,10 +143,8 @@ print("\nSampled validation predictions:")
 for file_path in sampled_files:
     img_path = os.path.join(val_dir, file_path)
     actual_breed = os.path.dirname(file_path)
-    img = image.load_img(img_path, target_size=img_size)
-    x = image.img_to_array(img)
+    x = preprocess_image(img_path, target_size=img_size)
     x = np.expand_dims(x, axis=0)
-    x = x / 255.0
     preds = model.predict(x)
     pred_idx = np.argmax(preds[0])
     pred_breed = idx_to_class[pred_idx]
@@ -149,5 +152,5 @@ for file_path in sampled_files:
     print(f"Actual: {actual_breed} | Predicted: {pred_breed} ({confidence:.2%})")
 
 # Evaluate overall validation accuracy
-val_loss, val_acc = model.evaluate(val_gen, steps=validation_steps)
+val_loss, val_acc = model.evaluate(val_gen.dataset, steps=validation_steps)
 print(f"\nOverall validation accuracy: {val_acc:.2%}")
\ No newline at end of file
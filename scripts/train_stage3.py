@@ -1,4 +1,3 @@
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dropout, Dense, GlobalAveragePooling2D
 from tensorflow.keras.optimizers import Adam
@@ -7,35 +6,27 @@ from tensorflow.keras.applications import MobileNetV2
 from pathlib import Path
 import json
 
+from input_pipeline import AUGMENTATION, directory_dataset
+from feature_cache import USE_FEATURE_CACHE, fit_head_on_features
+from multihead import split_at_pooling
+from training_profiler import profiler_callbacks
+
 # Directories for training and validation data
 train_dir = Path("data_stage3/train")
 val_dir = Path("data_stage3/val")
 
-# Image data generators with augmentation for training and rescaling for validation
-train_datagen = ImageDataGenerator(
-    rotation_range=30,
-    width_shift_range=0.2,
-    height_shift_range=0.2,
-    shear_range=0.2,
-    zoom_range=0.2,
-    horizontal_flip=True,
-    fill_mode='nearest',
-    rescale=1./255
-)
-val_datagen = ImageDataGenerator(rescale=1./255)
-
-# Flow images from directories
-train_generator = train_datagen.flow_from_directory(
+# tf.data pipelines with augmentation for training and rescaling for validation
+train_generator = directory_dataset(
     train_dir,
-    target_size=(224, 224),
+    img_size=(224, 224),
     batch_size=32,
-    class_mode='categorical'
+    augment=AUGMENTATION['stage3']
 )
-val_generator = val_datagen.flow_from_directory(
+val_generator = directory_dataset(
     val_dir,
-    target_size=(224, 224),
+    img_size=(224, 224),
     batch_size=32,
-    class_mode='categorical'
+    class_indices=train_generator.class_indices
 )
 
 # Number of classes inferred from the training generator
@@ -82,13 +73,27 @@ reduce_lr = ReduceLROnPlateau(
     verbose=1
 )
 
-# Train the model
-model.fit(
-    train_generator,
-    epochs=20,
-    validation_data=val_generator,
-    callbacks=[early_stopping, checkpoint, reduce_lr]
-)
+# Train the model. The backbone stays frozen for the whole run, so with
+# FEATURE_CACHE=1 all of it happens on cached pooled features
+if USE_FEATURE_CACHE:
+    fit_head_on_features(
+        base_model,
+        split_at_pooling(model)[1],
+        train_dir,
+        val_dir,
+        20,
+        augment=AUGMENTATION['stage3'],
+        optimizer=Adam(learning_rate=1e-4),
+        callbacks=[early_stopping, reduce_lr]
+    )
+    model.save('models/buffalo_breed_classifier.keras')
+else:
+    model.fit(
+        train_generator.dataset,
+        epochs=20,
+        validation_data=val_generator.dataset,
+        callbacks=[early_stopping, checkpoint, reduce_lr] + profiler_callbacks(train_generator, 'buffalo_breed_classifier')
+    )
 
 # Save the model in .h5 format as well
 model.save('models/buffalo_breed_classifier.h5')
@@ -0,0 +1,320 @@
+"""Training throughput and input-stall profiling for model.fit.
+
+Keras pulls each batch from the tf.data iterator inside its compiled train
+step, so a callback can't time the wait for data on its own. The profiler
+splits each step into waiting and computing like this:
+
+  * step time: wall time of every training step, timed from the batch
+    callbacks. The first steps of a fit (tracing) are left out.
+  * compute time: at the start of a fit, a forward and backward pass on one
+    cached batch, timed with nothing else running. The gradients are not
+    applied and batch-norm statistics are restored afterwards, so training is
+    not affected. It is also timed at half and double the batch size to see
+    whether another batch size would be faster.
+  * input rate: batches pulled from a fresh iterator of the training dataset
+    with no model running, i.e. the most the input pipeline can supply.
+
+The data wait of a step is its step time minus the probe's compute time. It
+also covers host overhead, and because decoding and compute share the CPU
+during training it is an estimate. When the probe runs out of memory at the
+training batch size, the wait isn't estimated and the stall is reported as
+unknown. Images/s, peak host memory (and peak GPU
+memory when there is a GPU) and suggestions for the batch size and input
+settings go into one JSON summary per fit, in reports/training/.
+
+Enable in the training scripts with TRAIN_PROFILE=1 (TRAIN_PROFILE_STEPS=N
+probe steps, default 20).
+
+Usage (from the project root), to compare runs across machines and settings:
+    python scripts/training_profiler.py reports/training/*.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from feature_cache import USE_FEATURE_CACHE
+from input_pipeline import CACHE_DIR, USE_SHARDS
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USE_TRAIN_PROFILE = os.environ.get("TRAIN_PROFILE", "0") == "1"
+PROFILE_STEPS = int(os.environ.get("TRAIN_PROFILE_STEPS", 20))
+PROFILE_DIR = os.environ.get("TRAIN_PROFILE_DIR", os.path.join(BASE_DIR, "reports", "training"))
+# Steps at the start of each fit not counted (tracing, pipeline warm-up)
+WARMUP_STEPS = 3
+# Share of step time spent waiting on data above which a fit counts as input-bound
+STALL_THRESHOLD = 0.1
+# A probed batch size must be this much faster to be suggested
+BATCH_GAIN_THRESHOLD = 0.1
+
+
+def percentiles(values):
+    if not len(values):
+        return {}
+    return {f"p{p}": round(float(np.percentile(values, p)), 2) for p in (50, 90, 99)}
+
+
+def peak_host_memory_mb():
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def input_settings():
+    """The input-related settings a run was made with."""
+    return {"INPUT_CACHE_DIR": CACHE_DIR, "DATA_SHARDS": USE_SHARDS, "FEATURE_CACHE": USE_FEATURE_CACHE}
+
+
+def hardware():
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "gpus": [gpu.name for gpu in tf.config.list_physical_devices("GPU")],
+        "tensorflow": tf.__version__,
+    }
+
+
+def time_input(data, steps, warmup=WARMUP_STEPS):
+    """Seconds per batch pulled from a fresh iterator of `data` (a
+    DirectoryDataset), no model running; capped at one epoch of batches."""
+    batches = len(data)
+    warmup = max(0, min(warmup, batches - 1))
+    steps = max(1, min(steps, batches - warmup))
+    iterator = iter(data.dataset)
+    for _ in range(warmup):
+        next(iterator)
+    start = time.perf_counter()
+    for _ in range(steps):
+        next(iterator)
+    return (time.perf_counter() - start) / steps
+
+
+def make_compute_probe(model):
+    """Function timing forward + backward passes on a batch, without changing the model."""
+    loss_fn = tf.keras.losses.get(model.loss)
+
+    @tf.function(reduce_retracing=True)
+    def gradients(x, y):
+        with tf.GradientTape() as tape:
+            loss = loss_fn(y, model(x, training=True))
+        return tape.gradient(loss, model.trainable_variables)
+
+    def probe(x, y, steps, warmup=WARMUP_STEPS):
+        # Batch norm layers update their moving statistics in training mode
+        saved = [v.numpy() for v in model.non_trainable_variables]
+        try:
+            for _ in range(warmup):
+                tf.nest.map_structure(lambda g: g.numpy() if g is not None else None, gradients(x, y))
+            start = time.perf_counter()
+            for _ in range(steps):
+                result = gradients(x, y)
+            tf.nest.map_structure(lambda g: g.numpy() if g is not None else None, result)
+            return (time.perf_counter() - start) / steps
+        finally:
+            for v, value in zip(model.non_trainable_variables, saved):
+                v.assign(value)
+
+    return probe
+
+
+def resize_batch(x, y, size):
+    reps = -(-size // int(x.shape[0]))
+    return tf.tile(x, [reps, 1, 1, 1])[:size], tf.tile(y, [reps, 1])[:size]
+
+
+def suggestions(summary):
+    tips = []
+    settings = summary["settings"]
+    stall = summary["stall_fraction"]
+    input_rate, compute_rate = summary["input_images_per_s"], summary["compute_images_per_s"]
+    if stall is not None and stall > STALL_THRESHOLD:
+        tips.append(f"Input-bound: about {stall:.0%} of each step waits on data. The input pipeline alone "
+                    f"supplies {input_rate:,.0f} img/s, and the model could take {compute_rate:,.0f} img/s"
+                    + (", so the stall comes from decoding and compute competing for the same cores."
+                       if input_rate >= compute_rate else "."))
+        if not settings["DATA_SHARDS"]:
+            tips.append("Write shards (split scripts with --shards npy) and train with DATA_SHARDS=1 "
+                        "to skip JPEG decoding and resizing.")
+        if not settings["INPUT_CACHE_DIR"]:
+            tips.append("Set INPUT_CACHE_DIR to cache decoded images on disk after the first epoch.")
+        if summary["frozen_backbone"] and not settings["FEATURE_CACHE"]:
+            tips.append("The backbone is frozen: FEATURE_CACHE=1 trains the head on cached features "
+                        "instead of decoding every image every epoch.")
+        if not summary["hardware"]["gpus"]:
+            tips.append(f"Decoding/augmentation and compute share the {summary['hardware']['cpus']} CPU cores; "
+                        "a larger batch won't help until the input pipeline keeps up.")
+    elif stall is not None:
+        tips.append(f"Compute-bound: only {stall:.0%} of step time waits on data, so input settings are fine.")
+    elif compute_rate is None:
+        tips.append(f"Batch size {summary['batch_size']} ran out of memory in the compute probe, "
+                    "so the data wait couldn't be estimated.")
+
+    batch_size = summary["batch_size"]
+    probed = summary["batch_size_probe"]
+    current = probed.get(str(batch_size))
+    if current:
+        best_size, best = max(probed.items(), key=lambda item: item[1] or 0)
+        if best and int(best_size) != batch_size and best > current * (1 + BATCH_GAIN_THRESHOLD):
+            tips.append(f"Batch size {best_size} computes {best:,.0f} img/s vs {current:,.0f} img/s at "
+                        f"{batch_size}; scale the learning rate with it if you switch.")
+    if probed.get(str(batch_size * 2)) is None and str(batch_size * 2) in probed:
+        tips.append(f"Batch size {batch_size * 2} ran out of memory in the compute probe.")
+    return tips
+
+
+class ThroughputProfiler(tf.keras.callbacks.Callback):
+    """Records step time, data wait vs. compute, images/s and peak memory for
+    one model.fit over `train_data` (a DirectoryDataset) and writes the JSON
+    summary when the fit ends."""
+
+    def __init__(self, train_data, run_name, probe_steps=PROFILE_STEPS, output_dir=PROFILE_DIR):
+        super().__init__()
+        self.train_data = train_data
+        self.run_name = run_name
+        self.probe_steps = probe_steps
+        self.output_dir = output_dir
+        self.path = None
+
+    def on_train_begin(self, logs=None):
+        self.epochs = []
+        self.step_times = []
+        self.gpu = tf.config.list_physical_devices("GPU")
+        if self.gpu:
+            tf.config.experimental.reset_memory_stats("GPU:0")
+
+        batch_size = self.train_data.batch_size
+        x, y = next(iter(self.train_data.dataset))
+        probe = make_compute_probe(self.model)
+        self.batch_size_probe = {}
+        for size in sorted({max(1, batch_size // 2), batch_size, batch_size * 2}):
+            try:
+                seconds = probe(*resize_batch(x, y, size), self.probe_steps)
+                self.batch_size_probe[str(size)] = round(size / seconds, 1)
+            except tf.errors.ResourceExhaustedError:
+                self.batch_size_probe[str(size)] = None
+        # None when the probe itself ran out of memory: no compute time to split steps with
+        rate = self.batch_size_probe[str(batch_size)]
+        self.compute_s = batch_size / rate if rate else None
+        self.input_s = time_input(self.train_data, self.probe_steps)
+        compute = f"{self.compute_s * 1000:.1f} ms/step" if self.compute_s else "out of memory in the probe"
+        print(f"⏱️ {self.run_name}: compute {compute}, "
+              f"input pipeline alone {self.input_s * 1000:.1f} ms/batch")
+        self.fit_start = time.perf_counter()
+
+    def data_waits(self, steps):
+        if self.compute_s is None:
+            return np.array([])
+        return np.maximum(steps - self.compute_s, 0)
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch = epoch
+        self.epoch_steps = []
+        self.epoch_start = self.last_end = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        self.epoch_steps.append(now - self.last_end)
+        self.last_end = now
+
+    def on_epoch_end(self, epoch, logs=None):
+        steps = np.array(self.epoch_steps[WARMUP_STEPS if not self.epochs else 0:])
+        self.step_times.extend(steps)
+        waits = self.data_waits(steps)
+        train_s = self.last_end - self.epoch_start
+        self.epochs.append({
+            "epoch": epoch + 1,
+            "steps": len(self.epoch_steps),
+            "train_seconds": round(train_s, 2),
+            # Every step but the last is a full batch
+            "images_per_s": round(min(len(self.epoch_steps) * self.train_data.batch_size,
+                                      self.train_data.samples) / train_s, 1) if train_s else None,
+            "step_ms": percentiles(steps * 1000),
+            "data_wait_ms": percentiles(waits * 1000),
+            "stall_fraction": round(float(waits.sum() / steps.sum()), 3) if steps.sum() and len(waits) else None,
+            "peak_host_memory_mb": peak_host_memory_mb(),
+            **{k: round(float(v), 4) for k, v in (logs or {}).items()},
+        })
+
+    def on_train_end(self, logs=None):
+        steps = np.array(self.step_times)
+        waits = self.data_waits(steps)
+        batch_size = self.train_data.batch_size
+        summary = {
+            "run": self.run_name,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "hardware": hardware(),
+            "settings": input_settings(),
+            "batch_size": batch_size,
+            "train_images": self.train_data.samples,
+            "frozen_backbone": sum(int(np.prod(v.shape)) for v in self.model.trainable_variables)
+            < 0.1 * sum(int(np.prod(v.shape)) for v in self.model.variables),
+            "fit_seconds": round(time.perf_counter() - self.fit_start, 2),
+            "epochs": self.epochs,
+            "images_per_s": round(batch_size / float(np.mean(steps)), 1) if len(steps) else None,
+            "step_ms": percentiles(steps * 1000),
+            "compute_ms": round(self.compute_s * 1000, 2) if self.compute_s else None,
+            "data_wait_ms": percentiles(waits * 1000),
+            "stall_fraction": round(float(waits.sum() / steps.sum()), 3) if steps.sum() and len(waits) else None,
+            "compute_images_per_s": round(batch_size / self.compute_s, 1) if self.compute_s else None,
+            "input_images_per_s": round(batch_size / self.input_s, 1),
+            "batch_size_probe": self.batch_size_probe,
+            "peak_host_memory_mb": peak_host_memory_mb(),
+        }
+        if self.gpu:
+            summary["peak_gpu_memory_mb"] = round(tf.config.experimental.get_memory_info("GPU:0")["peak"] / 2**20, 1)
+        summary["suggestions"] = suggestions(summary)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.path = os.path.join(self.output_dir, f"{self.run_name}_{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(self.path, "w") as f:
+            json.dump(summary, f, indent=2)
+        stall = summary["stall_fraction"]
+        print(f"📈 {self.run_name}: {summary['images_per_s']} img/s, "
+              f"{f'{stall:.0%}' if stall is not None else 'unknown share'} of step time waiting on data, "
+              f"peak host memory {summary['peak_host_memory_mb']:,.0f} MB")
+        for tip in summary["suggestions"]:
+            print(f"   💡 {tip}")
+        print(f"✅ Training profile written to {self.path}")
+
+
+def profiler_callbacks(train_data, run_name):
+    """[ThroughputProfiler] with TRAIN_PROFILE=1, else []; for a model.fit callback list."""
+    return [ThroughputProfiler(train_data, run_name)] if USE_TRAIN_PROFILE else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare training profile summaries.")
+    parser.add_argument("summaries", nargs="*", help="JSON summaries (default: all in reports/training/)")
+    args = parser.parse_args()
+
+    paths = args.summaries or sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")))
+    if not paths:
+        sys.exit(f"No training profiles found in {PROFILE_DIR} (train with TRAIN_PROFILE=1)")
+    rows = []
+    for path in paths:
+        with open(path, "r") as f:
+            s = json.load(f)
+        device = ", ".join(s["hardware"]["gpus"]) or f"{s['hardware']['cpus']} CPUs"
+        flags = ",".join(name for name, value in s["settings"].items() if value) or "-"
+        rows.append([s["run"], s["timestamp"], s["hardware"]["host"], device, flags, s["batch_size"],
+                     s["images_per_s"], s["compute_images_per_s"] or "-", s["input_images_per_s"],
+                     f"{s['stall_fraction']:.0%}" if s["stall_fraction"] is not None else "-",
+                     s["peak_host_memory_mb"], s.get("peak_gpu_memory_mb", "-")])
+
+    header = ["run", "time", "host", "device", "input settings", "batch", "img/s", "compute img/s",
+              "input img/s", "stall", "host MB", "GPU MB"]
+    widths = [max(len(str(v)) for v in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    main()
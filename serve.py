@@ -0,0 +1,229 @@
+"""Pre-forked multi-worker serving of app.py.
+
+The supervisor binds the listening socket, maps the exported TFLite models
+read-only and faults them into the page cache once, then forks the workers.
+Each worker imports app.py (and so TensorFlow) only after the fork. Its
+interpreters run TFLite's builtin kernels, which read the float32 and int8
+weights straight from the same mapped files, so the weights are loaded once
+and shared read-only by every worker. float16 models are still dequantized
+per worker. `--xnnpack` enables TFLite's default XNNPACK delegate instead:
+roughly 2-3x faster inference, but it repacks the weights into private memory
+in every worker (the Python API has no XNNPACK weight cache to share them).
+Measure with scripts/bench_workers.py.
+
+Each worker gets a fixed slice of the cores for its TF/TFLite/decode threads.
+Dead workers are restarted; SIGTERM/SIGINT stops them all gracefully.
+
+    python serve.py --workers 4 [--backend tflite-int8] [--xnnpack] [--pin-cpus] [--port 8000]
+
+The keras backend works too, but every worker then also loads every model
+file itself (TF variables can't live in shared memory).
+"""
+import argparse
+import json
+import mmap
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TFLITE_DIR = os.path.join(BASE_DIR, "models", "tflite")
+# Models app.py serves; TensorFlow must not be imported before the fork, so
+# these aren't read from app.py
+MODEL_NAMES = ("cattle_detector", "breed_classifier", "buffalo_breed_classifier")
+# A worker dying this soon after starting counts as a crash loop (restart backoff)
+MIN_UPTIME = 10.0
+
+
+def shared_model_files(backend):
+    if not backend.startswith("tflite-"):
+        return []
+    paths = [os.path.join(TFLITE_DIR, f"{name}_{backend[len('tflite-'):]}.tflite") for name in MODEL_NAMES]
+    missing = [p for p in paths if not os.path.exists(p)]
+    if missing:
+        sys.exit(f"❌ Missing TFLite exports (run scripts/export_tflite.py): {', '.join(missing)}")
+    return paths
+
+
+def map_models(paths):
+    """Read-only mappings of the model files, faulted into the page cache."""
+    maps = []
+    for path in paths:
+        with open(path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(m, "madvise"):
+            m.madvise(mmap.MADV_WILLNEED)
+        for offset in range(0, len(m), mmap.PAGESIZE):
+            m[offset]
+        maps.append(m)
+    return maps
+
+
+def worker_env(backend, threads, inter_op_threads, xnnpack=False):
+    return {
+        "FARMVISION_BACKEND": backend,
+        "FARMVISION_TFLITE_XNNPACK": "1" if xnnpack else "0",
+        "FARMVISION_TFLITE_THREADS": str(threads),
+        "FARMVISION_INTRA_OP_THREADS": str(threads),
+        "FARMVISION_INTER_OP_THREADS": str(inter_op_threads),
+        "FARMVISION_DECODE_WORKERS": str(threads),
+        "OMP_NUM_THREADS": str(threads),
+    }
+
+
+def run_worker(index, sock, env, cpus, ready, log_level):
+    # Forked with the supervisor's handlers; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    os.environ.update(env)
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    sys.path.insert(0, BASE_DIR)
+    import uvicorn
+    from app import app, models
+
+    def report_ready():
+        ready[index] = 1 if models.wait() else -1
+
+    threading.Thread(target=report_ready, daemon=True).start()
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    def __init__(self, args):
+        self.args = args
+        self.ctx = multiprocessing.get_context("fork")
+        self.ready = self.ctx.Array("b", args.workers, lock=False)
+        self.procs = [None] * args.workers
+        self.started = [0.0] * args.workers
+        self.crashes = [0] * args.workers
+        self.restart_at = [None] * args.workers
+        self.stopping = False
+
+        cores = sorted(os.sched_getaffinity(0))
+        self.threads = args.threads_per_worker or max(1, len(cores) // args.workers)
+        self.cpus = [None] * args.workers
+        if args.pin_cpus:
+            self.cpus = [{cores[(i * self.threads + j) % len(cores)] for j in range(self.threads)}
+                         for i in range(args.workers)]
+        self.env = worker_env(args.backend, self.threads, args.inter_op_threads, args.xnnpack)
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((args.host, args.port))
+        self.sock.listen(args.backlog)
+        self.sock.set_inheritable(True)
+        self.port = self.sock.getsockname()[1]
+
+    def start(self, index):
+        self.ready[index] = 0
+        proc = self.ctx.Process(target=run_worker, name=f"farmvision-worker-{index}", daemon=False, args=(
+            index, self.sock, self.env, self.cpus[index], self.ready, self.args.log_level))
+        proc.start()
+        self.procs[index] = proc
+        self.started[index] = time.monotonic()
+
+    def status(self):
+        return {
+            "supervisor": os.getpid(),
+            "bind": f"{self.args.host}:{self.port}",
+            "backend": self.args.backend,
+            "threads_per_worker": self.threads,
+            "workers": [{"index": i, "pid": p.pid if p else None, "ready": self.ready[i] == 1,
+                         "failed": self.ready[i] == -1, "cpus": sorted(self.cpus[i]) if self.cpus[i] else None}
+                        for i, p in enumerate(self.procs)],
+        }
+
+    def write_status(self):
+        if not self.args.status_file:
+            return
+        tmp = self.args.status_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.status(), f, indent=2)
+        os.replace(tmp, self.args.status_file)
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for i in range(self.args.workers):
+            self.start(i)
+        print(f"🚀 Serving on http://{self.args.host}:{self.port} with {self.args.workers} workers "
+              f"({self.args.backend}, {self.threads} threads each)")
+
+        last_status, announced = None, False
+        while not self.stopping:
+            now = time.monotonic()
+            for i, proc in enumerate(self.procs):
+                if proc.is_alive():
+                    continue
+                if self.restart_at[i] is None:
+                    self.ready[i] = 0
+                    uptime = now - self.started[i]
+                    self.crashes[i] = self.crashes[i] + 1 if uptime < MIN_UPTIME else 0
+                    delay = min(2 ** self.crashes[i], 30) if self.crashes[i] else 0
+                    print(f"⚠️ Worker {i} (pid {proc.pid}) exited with {proc.exitcode} after {uptime:.1f}s; "
+                          f"restarting in {delay}s")
+                    self.restart_at[i] = now + delay
+                elif now >= self.restart_at[i]:
+                    self.restart_at[i] = None
+                    self.start(i)
+
+            status = self.status()
+            if status != last_status:
+                self.write_status()
+                last_status = status
+            if not announced and all(w["ready"] for w in status["workers"]):
+                print(f"✅ All {self.args.workers} workers ready")
+                announced = True
+            time.sleep(0.5)
+
+        print("🛑 Stopping workers")
+        for proc in self.procs:
+            if proc.is_alive():
+                proc.terminate()
+        deadline = time.monotonic() + self.args.graceful_timeout
+        for proc in self.procs:
+            proc.join(max(deadline - time.monotonic(), 0))
+            if proc.is_alive():
+                proc.kill()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve app.py from pre-forked workers on one socket.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backend", default=os.environ.get("FARMVISION_BACKEND", "tflite-float32"),
+                        help="FARMVISION_BACKEND for every worker; tflite-* backends share the weights")
+    parser.add_argument("--xnnpack", action="store_true",
+                        help="faster TFLite inference, but every worker repacks its own copy of the weights")
+    parser.add_argument("--threads-per-worker", type=int,
+                        help="TF intra-op / TFLite / decode threads per worker (default: cores / workers)")
+    parser.add_argument("--inter-op-threads", type=int, default=1)
+    parser.add_argument("--pin-cpus", action="store_true", help="bind each worker to its own cores")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--status-file", help="JSON file kept up to date with worker pids and readiness")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+
+    if args.backend == "keras":
+        print("⚠️ keras backend: each worker loads its own copy of every model")
+    maps = map_models(shared_model_files(args.backend))
+    if maps:
+        shared = "XNNPACK packs a private copy of the weights per worker" if args.xnnpack else "shared by all workers"
+        print(f"🗺️ Mapped {sum(len(m) for m in maps) / 1e6:.1f} MB of model weights ({shared})")
+    Supervisor(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import time
+
+import numpy as np
+
+# Tunables for /stream (override through the environment when starting uvicorn)
+STREAM_DHASH_DISTANCE = int(os.environ.get("FARMVISION_STREAM_DHASH_DISTANCE", 6))  # bits, -1 keeps every frame
+STREAM_MAX_FPS = float(os.environ.get("FARMVISION_STREAM_MAX_FPS", 5))  # classified frames/s per stream, 0 = no limit
+STREAM_WINDOW = int(os.environ.get("FARMVISION_STREAM_WINDOW", 4))  # frames of one stream in the cascade at once
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class FrameFilter:
+    """Decides which frames of one stream are worth running through the models.
+
+    Before decoding, a frame is dropped as `rate` when it comes sooner than
+    1/max_fps after the last classified frame, and as `busy` while `window`
+    frames of the stream are still in the cascade. After decoding, it is
+    dropped as `duplicate` when its dhash is within `max_distance` bits of
+    the last classified frame. Comparing with the last classified frame
+    rather than the previous one means a slow drift is picked up once it
+    adds up.
+    """
+
+    def __init__(self, max_distance=STREAM_DHASH_DISTANCE, max_fps=STREAM_MAX_FPS, window=STREAM_WINDOW):
+        self.max_distance = max_distance
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.window = window
+        self.in_flight = 0
+        self.reset()
+
+    def reset(self):
+        self.last_hash = None
+        self.last_time = None
+
+    def precheck(self, now=None):
+        """Why to drop a frame without decoding it ("rate" or "busy"), or None."""
+        now = time.monotonic() if now is None else now
+        if self.last_time is not None and now - self.last_time < self.min_interval:
+            return "rate"
+        if self.in_flight >= self.window:
+            return "busy"
+        return None
+
+    def accept(self, phash, now=None):
+        """False for a near-duplicate of the last classified frame; otherwise
+        the frame becomes the last classified one and counts as in flight
+        until `done()`."""
+        if self.last_hash is not None and hamming(phash, self.last_hash) <= self.max_distance:
+            return False
+        self.last_hash = phash
+        self.last_time = time.monotonic() if now is None else now
+        self.in_flight += 1
+        return True
+
+    def done(self):
+        self.in_flight -= 1
+
+
+class RunningPrediction:
+    """Aggregates per-frame cascade outputs of one stream into one prediction.
+
+    Stage-1 probabilities are averaged over every classified frame, and the
+    breed probabilities of each animal type over the frames stage 1 sent to
+    that type's breed model. `current()` returns the winning animal with its
+    mean stage-1 row and mean breed row, in the same form as a single
+    image's (label, stage-1 row, breed row) so it can be turned into the
+    usual response.
+    """
+
+    def __init__(self, stage1_classes):
+        self.stage1_classes = list(stage1_classes)
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.stage1_sum = np.zeros(len(self.stage1_classes), dtype=np.float64)
+        self.breed_sums = {}
+        self.breed_frames = {}
+
+    def update(self, label, pred_stage1, pred_breed):
+        self.frames += 1
+        self.stage1_sum += pred_stage1
+        if pred_breed is not None:
+            if label in self.breed_sums:
+                self.breed_sums[label] += pred_breed
+            else:
+                self.breed_sums[label] = np.array(pred_breed, dtype=np.float64)
+            self.breed_frames[label] = self.breed_frames.get(label, 0) + 1
+
+    def current(self):
+        """(label, mean stage-1 row, mean breed row or None, breed frames), or None before any frame."""
+        if not self.frames:
+            return None
+        mean_stage1 = self.stage1_sum / self.frames
+        label = self.stage1_classes[int(np.argmax(mean_stage1))]
+        breed_frames = self.breed_frames.get(label, 0)
+        mean_breed = self.breed_sums[label] / breed_frames if breed_frames else None
+        return label, mean_stage1, mean_breed, breed_frames
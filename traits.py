@@ -0,0 +1,88 @@
+import csv
+import json
+import os
+import threading
+from collections import Counter
+
+DATASET_PATH = "models/dataset.csv"
+BREED_CLASS_INDICES_PATH = "models/breed_class_indices.json"
+
+
+# Compute ATC score (simple weighted average)
+def compute_atc(age, height, weight):
+    return round((0.2 * age + 0.3 * height + 0.5 * weight) / 10, 2)
+
+
+def _mode(values):
+    # Same tie-break as pandas' Series.mode()[0]: smallest of the most common values
+    counts = Counter(values)
+    top = max(counts.values())
+    return min(v for v, c in counts.items() if c == top)
+
+
+def load_class_indices(path=BREED_CLASS_INDICES_PATH):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def build_trait_index(class_indices, dataset_path=DATASET_PATH):
+    """Per-breed trait summary keyed by the breed model's class index.
+
+    dataset.csv stores breeds upper-case (e.g. SAHIWAL) while the class indices
+    use the folder names (sahiwal), so breeds are matched case-insensitively.
+    Breeds with no rows in the dataset are left out.
+    """
+    rows = {}
+    with open(dataset_path, newline="") as f:
+        for row in csv.DictReader(f):
+            rows.setdefault(row["breed"].strip().lower(), []).append(row)
+
+    index = {}
+    for breed_name, idx in class_indices.items():
+        breed_rows = rows.get(breed_name.lower())
+        if not breed_rows:
+            continue
+        age = sum(float(r["age_in_year"]) for r in breed_rows) / len(breed_rows)
+        height = sum(float(r["height_in_inch"]) for r in breed_rows) / len(breed_rows)
+        weight = sum(float(r["weight_in_kg"]) for r in breed_rows) / len(breed_rows)
+        index[int(idx)] = {
+            "sex": _mode(r["sex"] for r in breed_rows),
+            "age_in_year": age,
+            "height_in_inch": height,
+            "weight_in_kg": weight,
+            "ATC_score": compute_atc(age, height, weight),
+        }
+    return index
+
+
+class BreedTraitIndex:
+    """Trait lookup built once and rebuilt only when dataset.csv changes.
+
+    Keyed by the `class_indices` the breed model is served with, so names and
+    traits always come from the same class map.
+    """
+
+    def __init__(self, class_indices, dataset_path=DATASET_PATH):
+        self.class_indices = dict(class_indices)
+        self.dataset_path = dataset_path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._index = {}
+        self.refresh()
+
+    def _current_signature(self):
+        st = os.stat(self.dataset_path)
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self):
+        signature = self._current_signature()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature != self._signature:
+                self._index = build_trait_index(self.class_indices, self.dataset_path)
+                self._signature = signature
+
+    def get(self, breed_idx):
+        self.refresh()
+        return self._index.get(int(breed_idx))